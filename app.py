@@ -1,25 +1,25 @@
 #!/usr/bin/env python3
-import subprocess, threading, time, os, sys
+import threading, time, os, sys
 import tkinter as tk
 
+import connectivity
+
 # Paths to your three modules
 WIFI_SCRIPT     = "/home/neonflake/codes/wifi.py"
 RECORDER_SCRIPT = "/home/neonflake/codes/main.py"
 UPLOADER_SCRIPT = "/home/neonflake/codes/uploader.py"
 
 # ======================================================
-# FAST INTERNET CHECK (0.1 sec)
+# FAST INTERNET CHECK (connectivity.py, no ping process)
 # ======================================================
-def has_internet():
-    try:
-        # Ping 8.8.8.8 once, 1-second timeout
-        subprocess.check_output(
-            ["ping", "-c", "1", "-W", "1", "8.8.8.8"],
-            stderr=subprocess.DEVNULL
-        )
-        return True
-    except:
-        return False
+def has_internet(fresh=False):
+    # the uploader's monitor state, or one HTTP probe while it is starting up;
+    # fresh=True probes now (after wifi.py, before the monitor notices).
+    # A captive portal (Wi-Fi up, login page) counts as no internet
+    state = connectivity.state(fresh=fresh)
+    if state == connectivity.CAPTIVE:
+        print("ðŸ“¶ Wi-Fi needs a browser login (captive portal)")
+    return state == connectivity.ONLINE
 
 # ======================================================
 # RUN A PYTHON FILE IN CURRENT INTERPRETER
@@ -71,13 +71,13 @@ def main():
     start_wifi()
 
     # After Wi-Fi window closes â†’ check internet again
-    if has_internet():
+    if has_internet(fresh=True):
         print("ðŸŒ Wi-Fi connected successfully.")
         start_recorder()
     else:
         print("âŒ Still no internet. Restarting Wi-Fi...")
         start_wifi()  # retry
-        if has_internet():
+        if has_internet(fresh=True):
             start_recorder()
         else:
             # Fail-safe â€“ show message on screen
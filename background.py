@@ -0,0 +1,68 @@
+"""
+Blocking work for the Tk UI, done off the Tk thread.
+
+Background(master, name) runs the jobs given to submit() on its own thread,
+one at a time and in order, so camera calls never overlap. Each job's
+result (or exception) comes back on the Tk thread through
+master.after(0, ...), so done/error callbacks may touch widgets.
+
+on_busy(True) is called when the lane gets work, and on_busy(False) when
+its last job has finished, both on the Tk thread, so the UI can show that
+it is busy instead of freezing. RecorderApp uses three lanes: "camera" for
+starting, stopping and reconfiguring the camera, "io" for the online check,
+and "spool" for retention and eviction. That way a slow spool scan never
+holds up START, and a downscale (ffmpeg, maybe minutes) never freezes the
+online label.
+"""
+import time
+import queue
+import threading
+
+SLOW_JOB = 0.5      # seconds; longer jobs are logged
+
+
+class Background:
+    def __init__(self, master, name, on_busy=None):
+        self.master = master
+        self.name = name
+        self.on_busy = on_busy
+        self.pending = 0             # submitted and not yet finished; Tk thread only
+        self.jobs = queue.Queue()
+        threading.Thread(target=self.worker, name=f"bg-{name}", daemon=True).start()
+
+    def submit(self, fn, *args, done=None, error=None):
+        """Tk thread: run fn(*args) in the background, then done(result) or error(exc) on the Tk thread."""
+        self.pending += 1
+        if self.pending == 1 and self.on_busy:
+            self.on_busy(True)
+        self.jobs.put((fn, args, done, error))
+
+    def busy(self):
+        return self.pending > 0
+
+    def worker(self):
+        while True:
+            fn, args, done, error = self.jobs.get()
+            t0 = time.monotonic()
+            try:
+                result, exc = fn(*args), None
+            except Exception as e:
+                result, exc = None, e
+            took = time.monotonic() - t0
+            if took > SLOW_JOB:
+                print(f"[bg] {self.name}: {getattr(fn, '__name__', fn)} took {took:.2f} s")
+            self.master.after(0, self.finish, result, exc, done, error)
+
+    def finish(self, result, exc, done, error):
+        self.pending -= 1
+        try:
+            if exc is not None:
+                if error:
+                    error(exc)
+                else:
+                    print(f"[bg] {self.name}: {exc}")
+            elif done:
+                done(result)
+        finally:
+            if self.pending == 0 and self.on_busy:
+                self.on_busy(False)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Recorder benchmarks.
+
+  python3 bench_record.py mux --seconds 20 --runs 3
+      Feed an H.264 stream to each file output at the camera's pace, the way
+      the encoder thread does, in a fresh process per run:
+
+        ffmpeg   one ffmpeg process reading the frames from a pipe, with the
+                 arguments picamera2's FfmpegOutput uses
+        mp4      mp4mux.Mp4Output in the recorder process
+
+      Reports how long start() blocks the caller, the time until the first
+      bytes reach the file, the CPU time per second of video (recorder
+      process + ffmpeg), and the memory added (the recorder's peak RSS
+      growth + ffmpeg's peak RSS).
+
+      --input takes an Annex B .h264 file (on the kiosk:
+      rpicam-vid -t 20000 --inline --intra 30 -o sample.h264). Without it,
+      a test pattern is encoded with ffmpeg.
+
+  python3 bench_record.py screens --trees /tmp/before . --runs 10
+      Tap-to-paint per screen transition of the recorder UI, for each tree
+      (a checkout of the code; main.py and its modules are imported from
+      there, in a fresh process per tree). A tap invokes the button the
+      operator would press. The transition counts as painted once the next
+      screen's marker widget is on top at its centre, redraws are done and
+      an X round trip has returned. START and STOP include the camera
+      lane's work. Needs the display (DISPLAY=:0). Stop launcher.service
+      first to measure with the camera. Without the camera there is no
+      preview.
+
+      For the tree before a change: git worktree add /tmp/before HEAD~1
+      With two trees the last column is the first tree's median over the
+      second's, i.e. how many times faster the second tree paints.
+"""
+import os, sys, time, json, shutil, argparse, resource, tempfile, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FFMPEG_OUTPUT_CMD = ["ffmpeg", "-loglevel", "warning", "-y", "-use_wallclock_as_timestamps", "1",
+                     "-thread_queue_size", "64", "-i", "-", "-c:v", "copy", "{dst}"]
+
+
+# ---------------------------------------
+# Helpers
+# ---------------------------------------
+def access_units(data):
+    """Split an Annex B stream into frames: [(bytes, keyframe)]. A frame starts at an
+    AUD, SPS or PPS, or at a slice with first_mb_in_slice 0, once the current frame has a slice."""
+    import mp4mux
+    frames, units, has_slice, key = [], [], False, False
+    for u in mp4mux.nal_units(data):
+        kind = u[0] & 0x1F
+        is_slice = kind in (mp4mux.NAL_SLICE, mp4mux.NAL_IDR)
+        starts = kind in (mp4mux.NAL_AUD, mp4mux.NAL_SPS, mp4mux.NAL_PPS) or (is_slice and u[1] & 0x80)
+        if has_slice and starts:
+            frames.append((b"".join(b"\x00\x00\x00\x01" + x for x in units), key))
+            units, has_slice, key = [], False, False
+        units.append(u)
+        has_slice |= is_slice
+        key |= kind == mp4mux.NAL_IDR
+    if has_slice:
+        frames.append((b"".join(b"\x00\x00\x00\x01" + x for x in units), key))
+    return frames
+
+
+def test_stream(path, seconds, fps, size, bitrate):
+    cmd = ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi",
+           "-i", f"testsrc2=size={size[0]}x{size[1]}:rate={fps}", "-t", str(seconds),
+           "-c:v", "libx264", "-bf", "0", "-g", str(fps), "-b:v", str(bitrate),
+           "-x264-params", "repeat-headers=1", "-f", "h264", path]
+    subprocess.run(cmd, check=True)
+
+
+def vm_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+class PipeOutput:
+    """What FfmpegOutput does per recording: fork ffmpeg, write each frame to its stdin."""
+    def __init__(self, path):
+        self.path = path
+        self.ffmpeg = None
+
+    def start(self):
+        cmd = [a.format(dst=self.path) for a in FFMPEG_OUTPUT_CMD]
+        self.ffmpeg = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def outputframe(self, frame, keyframe=True, timestamp=None):
+        self.ffmpeg.stdin.write(frame)
+        self.ffmpeg.stdin.flush()
+
+    def stop(self):
+        self.ffmpeg.stdin.close()
+        self.ffmpeg.wait()
+
+
+def mux_child(backend, src, dst, fps, seconds, size):
+    """One run, in its own process; prints the result as JSON."""
+    import mp4mux
+    with open(src, "rb") as f:
+        frames = access_units(f.read())[:int(seconds * fps)]
+    base_rss = vm_kb("VmRSS")
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")                    # reset VmHWM to the current RSS
+    out = mp4mux.Mp4Output(dst, size, fps) if backend == "mp4" else PipeOutput(dst)
+    cpu0 = resource.getrusage(resource.RUSAGE_SELF)
+
+    t0 = time.perf_counter()
+    out.start()
+    start_call = time.perf_counter() - t0
+    first_bytes = None
+    for i, (frame, key) in enumerate(frames):
+        while True:                     # wait for the frame's turn, watching the file meanwhile
+            if first_bytes is None and os.path.exists(dst) and os.path.getsize(dst):
+                first_bytes = time.perf_counter() - t0
+            left = t0 + i / fps - time.perf_counter()
+            if left <= 0:
+                break
+            time.sleep(min(left, 0.005))
+        out.outputframe(frame, key, int(i * 1_000_000 / fps))
+        if first_bytes is None and os.path.exists(dst) and os.path.getsize(dst):
+            first_bytes = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    out.stop()
+    stop_call = time.perf_counter() - t1
+
+    cpu1 = resource.getrusage(resource.RUSAGE_SELF)
+    child = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (cpu1.ru_utime + cpu1.ru_stime - cpu0.ru_utime - cpu0.ru_stime
+           + child.ru_utime + child.ru_stime)
+    print(json.dumps({
+        "start_ms": start_call * 1000, "first_bytes_ms": (first_bytes or 0) * 1000,
+        "stop_ms": stop_call * 1000, "cpu_per_s": cpu / (len(frames) / fps),
+        "rss_mb": (max(0, vm_kb("VmHWM") - base_rss) + child.ru_maxrss) / 1024,
+        "file_mb": os.path.getsize(dst) / 1e6, "frames": len(frames)}))
+
+
+# marker text that is on top when the screen is showing
+SCREEN_MARKS = {"home": "Enter Order ID", "settings": "SET CAMERA ANGLE",
+                "preview": "STOP PREVIEW", "record": "STOP RECORDING"}
+# (text of the button tapped, screen it leads to), starting on home
+SCREEN_TAPS = [("⚙️", "settings"), ("SET CAMERA ANGLE", "preview"), ("STOP PREVIEW", "home"),
+               ("⚙️", "settings"), ("BACK", "home"),
+               ("START RECORDING", "record"), ("STOP RECORDING", "home")]
+
+
+def widgets(w):
+    for child in w.winfo_children():
+        yield child
+        yield from widgets(child)
+
+
+def on_top(root, text):
+    """The widget showing `text` that no other screen covers, or None."""
+    import tkinter as tk
+    for w in widgets(root):
+        try:
+            if w.cget("text") != text or not w.winfo_ismapped():
+                continue
+            x = w.winfo_rootx() + w.winfo_width() // 2
+            y = w.winfo_rooty() + w.winfo_height() // 2
+        except tk.TclError:
+            continue
+        if root.winfo_containing(x, y) == w:
+            return w
+    return None
+
+
+def tap_to_paint(root, text, screen, timeout=15):
+    """Seconds from invoking the button showing `text` until `screen` is on the display."""
+    button = on_top(root, text)
+    if button is None:
+        raise SystemExit(f"no button {text!r} on the screen")
+    t0 = time.perf_counter()
+    button.invoke()
+    while True:
+        root.update()
+        if on_top(root, SCREEN_MARKS[screen]) is not None:
+            break
+        if time.perf_counter() - t0 > timeout:
+            raise SystemExit(f"{screen} not shown {timeout} s after tapping {text!r}")
+        time.sleep(0.001)           # waiting for a background lane (START, STOP)
+    root.update_idletasks()
+    root.winfo_pointerxy()          # X round trip: everything before it has been drawn
+    return time.perf_counter() - t0
+
+
+def screens_child(tree, runs):
+    """One tree, in its own process; prints {transition: [seconds, ...]} as JSON."""
+    sys.path.insert(0, os.path.abspath(tree))
+    import main
+    root = main.ttkbs.Window(themename="flatly")
+    root.attributes("-fullscreen", True)
+    app = main.RecorderApp(root)
+    for _ in range(20):             # let the window map and settle
+        root.update()
+        time.sleep(0.05)
+    times, current = {}, "home"
+    for run in range(runs):
+        for text, screen in SCREEN_TAPS:
+            if text == "START RECORDING":
+                app.id_entry.delete(0, "end")
+                app.id_entry.insert(0, f"BENCH{run}")
+            times.setdefault(f"{current} -> {screen}", []).append(tap_to_paint(root, text, screen))
+            current = screen
+    root.destroy()
+    print(json.dumps(times))
+
+
+# ---------------------------------------
+# mux
+# ---------------------------------------
+def bench_mux(args):
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        src = args.input
+        if not src:
+            if not shutil.which("ffmpeg"):
+                raise SystemExit("no ffmpeg to encode a test stream; pass --input sample.h264")
+            src = f"{tmp}/test.h264"
+            test_stream(src, args.seconds, args.fps, args.size, args.bitrate)
+
+        print(f"{'output':<8}{'start() ms':>11}{'1st bytes ms':>13}{'stop() ms':>10}"
+              f"{'cpu ms/s':>10}{'RSS +MB':>9}{'file MB':>9}")
+        for backend in args.outputs:
+            if backend == "ffmpeg" and not shutil.which("ffmpeg"):
+                print(f"{backend:<8}  skipped: ffmpeg not installed")
+                continue
+            for run in range(args.runs):
+                dst = f"{tmp}/{backend}{run}.mp4"
+                code = ("import bench_record; bench_record.mux_child(%r, %r, %r, %r, %r, %r)"
+                        % (backend, src, dst, args.fps, args.seconds, tuple(args.size)))
+                p = subprocess.run([sys.executable, "-c", code], cwd=HERE,
+                                   stdout=subprocess.PIPE, text=True)
+                if p.returncode != 0:
+                    raise SystemExit(f"{backend} run failed")
+                r = json.loads(p.stdout.strip().splitlines()[-1])
+                print(f"{backend:<8}{r['start_ms']:>11.1f}{r['first_bytes_ms']:>13.1f}"
+                      f"{r['stop_ms']:>10.1f}{r['cpu_per_s'] * 1000:>10.1f}"
+                      f"{r['rss_mb']:>9.1f}{r['file_mb']:>9.2f}")
+                os.remove(dst)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ---------------------------------------
+# screens
+# ---------------------------------------
+def bench_screens(args):
+    if not os.environ.get("DISPLAY"):
+        raise SystemExit("needs the display: DISPLAY=:0 python3 bench_record.py screens ...")
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        results = []
+        for i, tree in enumerate(args.trees):
+            env = dict(os.environ, PACKPROOF_DIR=f"{tmp}/data{i}")
+            code = "import bench_record; bench_record.screens_child(%r, %r)" % (tree, args.runs)
+            p = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env,
+                               stdout=subprocess.PIPE, text=True)
+            if p.returncode != 0:
+                raise SystemExit(f"{tree}: run failed")
+            results.append(json.loads(p.stdout.strip().splitlines()[-1]))
+
+        # per tree: median and worst tap-to-paint in ms; with two trees, before/after of the medians
+        ratio = len(results) == 2
+        print(f"{'transition':<22}" + "".join(f"{t[-24:]:>26}" for t in args.trees)
+              + (f"{'speedup':>9}" if ratio else ""))
+        print(f"{'':<22}" + f"{'median / max ms':>26}" * len(args.trees))
+        for transition in results[0]:
+            cells, medians = [], []
+            for r in results:
+                ms = sorted(x * 1000 for x in r[transition])
+                medians.append(ms[len(ms) // 2])
+                cells.append(f"{medians[-1]:.1f} / {ms[-1]:.1f}")
+            print(f"{transition:<22}" + "".join(f"{c:>26}" for c in cells)
+                  + (f"{medians[0] / medians[1]:>8.1f}x" if ratio else ""))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="PackProof recorder benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("mux", help="ffmpeg process vs in-process mp4 muxing per recording")
+    p.add_argument("--input", help="Annex B .h264 file (default: encode a test pattern)")
+    p.add_argument("--seconds", type=float, default=20, help="video fed per run")
+    p.add_argument("--fps", type=int, default=30)
+    p.add_argument("--size", type=int, nargs=2, default=[640, 480])
+    p.add_argument("--bitrate", type=int, default=3_000_000, help="of the test pattern")
+    p.add_argument("--runs", type=int, default=3, help="runs per output")
+    p.add_argument("--outputs", nargs="+", default=["ffmpeg", "mp4"], choices=["ffmpeg", "mp4"])
+    p.set_defaults(fn=bench_mux)
+
+    p = sub.add_parser("screens", help="tap-to-paint per recorder screen transition")
+    p.add_argument("--trees", nargs="+", default=["."], help="code checkouts to compare")
+    p.add_argument("--runs", type=int, default=10, help="passes through all transitions")
+    p.set_defaults(fn=bench_screens)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
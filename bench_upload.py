@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Uploader benchmarks against the local stand-in server.
+
+  python3 bench_upload.py rss --sizes 50 400
+      Upload files of each size (MB) with uploader.upload_entry in a fresh
+      process and report the uploader's peak RSS. With --baseline the same
+      files are also sent the old way (requests files= dict) for comparison.
+
+  python3 bench_upload.py streams --size 64 --latency 0.05 --streams 1 2 4 8
+      Upload one file in chunked mode through ImpairProxy (added latency,
+      per-connection window) with 1..N parallel byte-range streams and
+      report the throughput of each.
+
+  python3 bench_upload.py handoff --count 10
+      Run uploader.py in the background, queue small recordings the way
+      main.py does and report the time from queueing to the server having
+      the file, with the notify socket and with plain 5 s polling.
+
+  python3 bench_upload.py drain --count 20 --size 8 --bandwidth 2e6 --loss 0.01 \
+          --cold-start 10 --error-rate 0.05 --hang-rate 0.02 --modes single chunked
+      Queue a backlog, then run uploader.py as a separate process against the
+      stand-in (with cold start, 503s and hung requests) behind ImpairProxy
+      (bandwidth, latency, loss) until the server has every file. Reports
+      MB/s, drain time, attempts/failures from lifecycle.log, the faults
+      injected and the uploader's peak RSS, per upload mode.
+
+  python3 bench_upload.py simulate --runs 20 --backlog 40
+      Simulated drain of synthetic backlogs (mostly short clips, some long
+      recordings, new ones arriving meanwhile) through queue_db.due() with
+      each schedule.POLICIES order; reports mean and p95 time from queueing
+      to uploaded. No network: the uplink is shared evenly by the workers.
+"""
+import os, sys, time, json, random, shutil, argparse, tempfile, threading, subprocess
+
+import standin_server
+from util import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------
+# Helpers
+# ---------------------------------------
+def start_server(store):
+    server = standin_server.make_server(port=0, store_dir=store)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_video(data_dir, name, size_mb):
+    """Write a size_mb file of non-repeating data (fast: one random MB repeated with a counter)."""
+    os.makedirs(f"{data_dir}/videos", exist_ok=True)
+    os.makedirs(f"{data_dir}/images", exist_ok=True)
+    path = f"{data_dir}/videos/{name}.mp4"
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for i in range(size_mb):
+            f.write(i.to_bytes(8, "little") + block[8:])
+    return path
+
+
+def run_child(code, env):
+    """Run python code in a child process; return (seconds, peak RSS in MB, stdout)."""
+    t0 = time.time()
+    p = subprocess.Popen([sys.executable, "-c", code], cwd=HERE, env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    out = p.stdout.read()
+    _, status, usage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return time.time() - t0, usage.ru_maxrss / 1024, out
+
+
+STREAM_CODE = """
+import uploader, sys
+sys.exit(0 if uploader.upload_entry({"id": %r}) else 1)
+"""
+
+BASELINE_CODE = """
+import uploader, requests, sys
+files = {"name": (None, %r), "videoFile": ("video.mp4", open(%r, "rb"), "video/mp4")}
+r = requests.post(uploader.API_URL, files=files, timeout=uploader.UPLOAD_TIMEOUT)
+sys.exit(0 if r.status_code in [200, 201] else 1)
+"""
+
+
+# ---------------------------------------
+# rss
+# ---------------------------------------
+def bench_rss(args):
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        server, url = start_server(f"{tmp}/server")
+        env = dict(os.environ, PACKPROOF_DIR=f"{tmp}/data", PACKPROOF_SERVER=url,
+                   PACKPROOF_UPLOAD_MODE="single")
+
+        print(f"{'mode':<10}{'size MB':>9}{'secs':>8}{'MB/s':>8}{'peak RSS MB':>13}")
+        for size in args.sizes:
+            name = f"rss{size}"
+            path = make_video(f"{tmp}/data", name, size)
+            runs = [("stream", STREAM_CODE % name)]
+            if args.baseline:
+                runs.append(("files=", BASELINE_CODE % (name, path)))
+            for mode, code in runs:
+                secs, rss, out = run_child(code, env)
+                if not os.path.exists(f"{tmp}/server/done/{name}.mp4"):
+                    print(out)
+                    raise SystemExit(f"{mode} upload of {size} MB failed")
+                os.remove(f"{tmp}/server/done/{name}.mp4")
+                print(f"{mode:<10}{size:>9}{secs:>8.1f}{size / secs:>8.1f}{rss:>13.1f}")
+            os.remove(path)
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ---------------------------------------
+# streams
+# ---------------------------------------
+def bench_streams(args):
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        server, _ = start_server(f"{tmp}/server")
+        proxy = standin_server.ImpairProxy(server.server_address[1], args.latency,
+                                           args.window, args.bandwidth or None).start()
+        url = f"http://127.0.0.1:{proxy.port}"
+        print(f"link: {args.latency * 1000:.0f} ms one-way, {args.window // 1024} KB window, "
+              f"bandwidth {args.bandwidth / 1e6 if args.bandwidth else 'unlimited'} MB/s")
+
+        print(f"{'streams':>8}{'size MB':>9}{'secs':>8}{'MB/s':>8}{'speedup':>9}")
+        base = None
+        for n in args.streams:
+            name = f"streams{n}"
+            make_video(f"{tmp}/data", name, args.size)
+            env = dict(os.environ, PACKPROOF_DIR=f"{tmp}/data", PACKPROOF_SERVER=url,
+                       PACKPROOF_UPLOAD_MODE="chunked", PACKPROOF_STREAMS=str(n),
+                       PACKPROOF_MAX_CONNECTIONS=str(max(n, 1)))
+            secs, _, out = run_child(STREAM_CODE % name, env)
+            if not os.path.exists(f"{tmp}/server/done/{name}.mp4"):
+                print(out)
+                raise SystemExit(f"{n}-stream upload failed")
+            os.remove(f"{tmp}/server/done/{name}.mp4")
+            base = base or secs
+            print(f"{n:>8}{args.size:>9}{secs:>8.1f}{args.size / secs:>8.2f}{base / secs:>8.1f}x")
+
+        proxy.close()
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ---------------------------------------
+# handoff
+# ---------------------------------------
+def server_done_at(url):
+    import urllib.request
+    with urllib.request.urlopen(f"{url}/stats") as r:
+        return json.load(r)["done_at"]
+
+
+def measure_handoff(tmp, url, notify, count):
+    data_dir = f"{tmp}/data-{'notify' if notify else 'poll'}"
+    env = dict(os.environ, PACKPROOF_DIR=data_dir, PACKPROOF_SERVER=url,
+               PACKPROOF_UPLOAD_MODE="single", PACKPROOF_NOTIFY="1" if notify else "0",
+               PACKPROOF_PROBE_URL=f"{url}/generate_204")
+    os.makedirs(data_dir, exist_ok=True)
+    up = subprocess.Popen([sys.executable, os.path.join(HERE, "uploader.py")], cwd=HERE, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # queue_db reads PACKPROOF_DIR at import; load a private copy for this data dir
+    os.environ["PACKPROOF_DIR"] = data_dir
+    sys.modules.pop("queue_db", None)
+    import queue_db
+    time.sleep(1.0)
+
+    latencies = []
+    try:
+        for i in range(count):
+            time.sleep(random.uniform(0.5, 3.0))
+            name = f"{'n' if notify else 'p'}{i}"
+            make_video(data_dir, name, 0)
+            t0 = time.time()
+            queue_db.enqueue(name)
+            queue_db.notify(name)
+            while name not in server_done_at(url):
+                time.sleep(0.005)
+            latencies.append(server_done_at(url)[name] - t0)
+    finally:
+        up.kill()
+        up.wait()
+    return latencies
+
+
+def bench_handoff(args):
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        server, url = start_server(f"{tmp}/server")
+        print(f"{'mode':<8}{'n':>4}{'mean ms':>10}{'max ms':>10}")
+        for notify in (False, True):
+            lat = measure_handoff(tmp, url, notify, args.count)
+            print(f"{'notify' if notify else 'poll':<8}{len(lat):>4}"
+                  f"{1000 * sum(lat) / len(lat):>10.0f}{1000 * max(lat):>10.0f}")
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ---------------------------------------
+# drain
+# ---------------------------------------
+def server_stats(url):
+    import urllib.request
+    with urllib.request.urlopen(f"{url}/stats") as r:
+        return json.load(r)
+
+
+def queue_backlog(data_dir, count, size_mb):
+    """Write count videos and queue them in data_dir's database, the way main.py does."""
+    os.environ["PACKPROOF_DIR"] = data_dir
+    sys.modules.pop("queue_db", None)
+    import queue_db
+    names = []
+    for i in range(count):
+        name = f"d{i:03d}"
+        path = make_video(data_dir, name, size_mb)
+        queue_db.enqueue(name, size=os.path.getsize(path))
+        names.append(name)
+    return names
+
+
+def attempt_counts(data_dir):
+    attempts = failed = 0
+    try:
+        with open(f"{data_dir}/lifecycle.log") as f:
+            for line in f:
+                e = json.loads(line)
+                if e["ev"] == "upload_attempt":
+                    attempts += 1
+                    failed += not e["ok"]
+    except FileNotFoundError:
+        pass
+    return attempts, failed
+
+
+def measure_drain(tmp, args, mode):
+    faults = standin_server.Faults(args.cold_start, 0, args.error_rate, args.hang_rate,
+                                   args.hang, seed=args.seed)
+    store = f"{tmp}/server-{mode}"
+    server = standin_server.make_server(port=0, store_dir=store, faults=faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    direct = f"http://127.0.0.1:{server.server_address[1]}"
+    proxy = standin_server.ImpairProxy(server.server_address[1], args.latency, args.window,
+                                       args.bandwidth or None, loss=args.loss).start()
+
+    data_dir = f"{tmp}/data-{mode}"
+    names = queue_backlog(data_dir, args.count, args.size)
+    total = sum(os.path.getsize(f"{data_dir}/videos/{n}.mp4") for n in names)
+    env = dict(os.environ, PACKPROOF_DIR=data_dir, PACKPROOF_SERVER=f"http://127.0.0.1:{proxy.port}",
+               PACKPROOF_UPLOAD_MODE=mode, PACKPROOF_KEEP_UPLOADED="0",
+               PACKPROOF_METRICS_PORT="0", PACKPROOF_BACKOFF_BASE=str(args.backoff),
+               PACKPROOF_PROBE_URL=f"{direct}/generate_204")
+
+    t0 = time.time()
+    up = subprocess.Popen([sys.executable, os.path.join(HERE, "uploader.py")], cwd=HERE, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    drained = False
+    while time.time() - t0 < args.max_time:
+        if all(n in server_stats(direct)["done_at"] for n in names):
+            drained = True
+            break
+        time.sleep(0.2)
+    secs = time.time() - t0
+    up.terminate()
+    _, _, usage = os.wait4(up.pid, 0)
+
+    stats = server_stats(direct)
+    proxy.close()
+    server.shutdown()
+    attempts, failed = attempt_counts(data_dir)
+    return {"mode": mode, "drained": drained, "secs": secs, "mbps": total / 1e6 / secs,
+            "attempts": attempts, "failed": failed, "faults": stats.get("faults", {}),
+            "rss": usage.ru_maxrss / 1024}
+
+
+def bench_drain(args):
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        print(f"backlog {args.count} x {args.size} MB; link {args.bandwidth / 1e6 if args.bandwidth else 'unlimited'} MB/s, "
+              f"{args.latency * 1000:.0f} ms, loss {args.loss:.1%}; server cold start {args.cold_start:g}s, "
+              f"503 {args.error_rate:.0%}, hang {args.hang_rate:.0%} ({args.hang:g}s)")
+        print(f"{'mode':<9}{'drain s':>9}{'MB/s':>7}{'attempts':>10}{'failed':>8}"
+              f"{'cold':>6}{'503':>6}{'hang':>6}{'peak RSS MB':>13}")
+        for mode in args.modes:
+            r = measure_drain(tmp, args, mode)
+            f = r["faults"]
+            print(f"{mode:<9}{r['secs']:>9.1f}{r['mbps']:>7.2f}{r['attempts']:>10}{r['failed']:>8}"
+                  f"{f.get('cold', 0):>6}{f.get('503', 0):>6}{f.get('hang', 0):>6}{r['rss']:>13.1f}"
+                  + ("" if r["drained"] else "  (not drained)"))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ---------------------------------------
+# simulate
+# ---------------------------------------
+def synthetic_backlog(rng, backlog, arrivals, priority_share, bitrate=3_000_000):
+    """[(queued_at, name, bytes, priority, deadline)]: a backlog at t=0, then Poisson arrivals."""
+    jobs, t = [], 0.0
+    for i in range(backlog + arrivals):
+        if i >= backlog:
+            t += rng.expovariate(1 / 120)          # a recording every ~2 min
+        minutes = rng.uniform(10, 20) if rng.random() < 0.2 else rng.uniform(0.5, 3)
+        disputed = rng.random() < priority_share
+        jobs.append((t, f"o{i}", int(minutes * 60 * bitrate / 8),
+                     1 if disputed else 0, t + 20 * 60 if disputed else None))
+    return jobs
+
+
+def simulate_drain(queue_db, order_by, jobs, workers, bandwidth):
+    """Returns {name: seconds from queueing to uploaded}."""
+    conn = queue_db.connect()
+    conn.execute("DELETE FROM queue")
+    arrivals = sorted(jobs)
+    active, done, t = {}, {}, 0.0      # name -> bytes left
+    queued_at = {}
+    while arrivals or active or len(done) < len(jobs):
+        while arrivals and arrivals[0][0] <= t:
+            at, name, size, prio, deadline = arrivals.pop(0)
+            queue_db.enqueue(name, size=size)
+            queue_db.update(name, created_at=at)
+            if prio:
+                queue_db.prioritize(name, prio, deadline)
+            queued_at[name] = at
+        if len(active) < workers:
+            for e in queue_db.due(t, limit=workers + len(active), order_by=order_by(t)):
+                if len(active) < workers and e["id"] not in active:
+                    active[e["id"]] = e["size"]
+        if not active:
+            t = arrivals[0][0]
+            continue
+        rate = bandwidth / len(active)
+        step = min(active.values()) / rate
+        if arrivals:
+            step = min(step, arrivals[0][0] - t)
+        t += step
+        for name in list(active):
+            active[name] -= rate * step
+            if active[name] <= 1:
+                del active[name]
+                queue_db.mark_uploaded(name)
+                done[name] = t - queued_at[name]
+    return done
+
+
+def bench_simulate(args):
+    import schedule
+    tmp = tempfile.mkdtemp(prefix="pp-bench-")
+    try:
+        os.environ["PACKPROOF_DIR"] = tmp
+        sys.modules.pop("queue_db", None)
+        import queue_db
+
+        print(f"{args.runs} backlogs of {args.backlog} + {args.arrivals} arriving, "
+              f"{args.workers} workers, {args.bandwidth / 1e6:g} MB/s uplink")
+        print(f"{'policy':<10}{'mean min':>10}{'p95 min':>10}{'disputed mean':>15}{'missed':>8}")
+        for policy in schedule.POLICIES:
+            rng = random.Random(args.seed)
+            times, disputed, missed = [], [], 0
+            for _ in range(args.runs):
+                jobs = synthetic_backlog(rng, args.backlog, args.arrivals, args.priority_share)
+                done = simulate_drain(queue_db, lambda now: schedule.order_by(policy, now),
+                                      jobs, args.workers, args.bandwidth)
+                for at, name, _, prio, deadline in jobs:
+                    times.append(done[name])
+                    if prio:
+                        disputed.append(done[name])
+                        missed += at + done[name] > deadline
+            dmean = f"{sum(disputed) / len(disputed) / 60:.1f}" if disputed else "-"
+            print(f"{policy:<10}{sum(times) / len(times) / 60:>10.1f}"
+                  f"{percentile(times, 95) / 60:>10.1f}{dmean:>15}{missed:>8}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="PackProof uploader benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("rss", help="peak uploader RSS vs file size")
+    p.add_argument("--sizes", type=int, nargs="+", default=[50, 400], help="file sizes in MB")
+    p.add_argument("--baseline", action="store_true", help="also run the in-memory files= upload")
+    p.set_defaults(fn=bench_rss)
+
+    p = sub.add_parser("streams", help="single- vs multi-stream throughput over a slow link")
+    p.add_argument("--size", type=int, default=64, help="file size in MB")
+    p.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--latency", type=float, default=0.05, help="one-way delay in seconds")
+    p.add_argument("--window", type=int, default=64 * 1024, help="bytes in flight per connection")
+    p.add_argument("--bandwidth", type=float, default=0, help="link bytes/s (0 = unlimited)")
+    p.set_defaults(fn=bench_streams)
+
+    p = sub.add_parser("handoff", help="queue-to-server latency, notify vs polling")
+    p.add_argument("--count", type=int, default=10, help="recordings per mode")
+    p.set_defaults(fn=bench_handoff)
+
+    p = sub.add_parser("drain", help="uploader.py draining a backlog from a faulty server over a bad link")
+    p.add_argument("--count", type=int, default=20, help="videos in the backlog")
+    p.add_argument("--size", type=int, default=8, help="MB per video")
+    p.add_argument("--modes", nargs="+", default=["single", "chunked"], choices=["single", "chunked"])
+    p.add_argument("--bandwidth", type=float, default=4e6, help="link bytes/s (0 = unlimited)")
+    p.add_argument("--latency", type=float, default=0.03, help="one-way delay in seconds")
+    p.add_argument("--window", type=int, default=256 * 1024, help="bytes in flight per connection")
+    p.add_argument("--loss", type=float, default=0.0, help="packet loss rate")
+    p.add_argument("--cold-start", type=float, default=5, help="seconds the sleeping server takes to wake")
+    p.add_argument("--error-rate", type=float, default=0.05, help="fraction of requests answered 503")
+    p.add_argument("--hang-rate", type=float, default=0.01, help="fraction of requests never answered")
+    p.add_argument("--hang", type=float, default=10, help="seconds before a hung request is dropped")
+    p.add_argument("--backoff", type=float, default=1, help="uploader PACKPROOF_BACKOFF_BASE")
+    p.add_argument("--max-time", type=float, default=600, help="give up after this many seconds")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(fn=bench_drain)
+
+    p = sub.add_parser("simulate", help="time-to-upload per ordering policy on synthetic backlogs")
+    p.add_argument("--runs", type=int, default=20, help="backlogs per policy")
+    p.add_argument("--backlog", type=int, default=40, help="recordings queued at the start")
+    p.add_argument("--arrivals", type=int, default=20, help="recordings queued during the drain")
+    p.add_argument("--workers", type=int, default=3)
+    p.add_argument("--bandwidth", type=float, default=2e6, help="uplink bytes/s")
+    p.add_argument("--priority-share", type=float, default=0.05, help="fraction of disputed orders")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(fn=bench_simulate)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+One connectivity state for the launcher, the recorder and the uploader:
+online, offline or captive (Wi-Fi is up but a login page intercepts
+traffic).
+
+The uploader runs Monitor, which always runs. It subscribes to
+NetworkManager's signals on the system bus (jeepney; optional) and reads
+NM's own connectivity check:
+
+  FULL                 online
+  PORTAL               captive
+  NONE, LIMITED        offline
+  UNKNOWN              (checks turned off in NetworkManager.conf) a probe decides
+
+Without jeepney or NetworkManager it falls back to probe(): one plain HTTP
+GET of PROBE_URL every PROBE_INTERVAL, in-process. A 204 means online.
+Any other answer (a redirect or a login page) means captive, and no
+answer means offline. NetworkManager is tried again after each probe.
+
+The state is written atomically to DATA_DIR/connectivity.json on every
+change, and again every HEARTBEAT. state() reads that file (one stat, and
+a JSON parse when it has changed), so checking it every few seconds costs
+no process spawn. If the file is missing or older than STALE_AFTER (the
+uploader is not running, e.g. the launcher right at boot), state() probes
+itself and keeps the result for PROBE_INTERVAL.
+
+fake_nm.py stands in for NetworkManager on a session bus for testing
+(PACKPROOF_NM_BUS=SESSION).
+"""
+import os
+import json
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+try:
+    from jeepney import DBusAddress, MatchRule, Properties, message_bus
+    from jeepney.wrappers import unwrap_msg
+    from jeepney.io.blocking import open_dbus_connection
+except Exception:
+    open_dbus_connection = None
+
+DATA_DIR   = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+STATE_FILE = f"{DATA_DIR}/connectivity.json"
+
+ONLINE, OFFLINE, CAPTIVE = "online", "offline", "captive"
+
+HEARTBEAT      = 30          # seconds between rewrites of STATE_FILE without a change
+STALE_AFTER    = 3 * HEARTBEAT
+PROBE_INTERVAL = 30
+PROBE_TIMEOUT  = 3
+PROBE_URL      = os.environ.get("PACKPROOF_PROBE_URL", "http://connectivitycheck.gstatic.com/generate_204")
+
+# "SYSTEM", "SESSION" (fake_nm.py) or a D-Bus address
+NM_BUS   = os.environ.get("PACKPROOF_NM_BUS", "SYSTEM")
+NM_NAME  = "org.freedesktop.NetworkManager"
+NM_PATH  = "/org/freedesktop/NetworkManager"
+NM_CALL_TIMEOUT = 5
+
+# NMConnectivityState -> state; 0 (UNKNOWN) is not here
+NM_CONNECTIVITY = {1: OFFLINE, 2: CAPTIVE, 3: OFFLINE, 4: ONLINE}
+NM_STATE_CONNECTED_SITE = 60     # NMState at or above this: there is an IP connection
+
+
+# ---------------------------------------
+# Probe
+# ---------------------------------------
+def probe(url=PROBE_URL, timeout=PROBE_TIMEOUT):
+    """One HTTP GET of url: online on 204, captive on any other answer, offline on none."""
+    u = urlsplit(url)
+    conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=timeout)
+    try:
+        conn.request("GET", u.path or "/", headers={"Connection": "close", "Cache-Control": "no-cache"})
+        r = conn.getresponse()
+        r.read(4096)
+        return ONLINE if r.status == 204 else CAPTIVE
+    except (OSError, http.client.HTTPException):
+        return OFFLINE
+    finally:
+        conn.close()
+
+
+# ---------------------------------------
+# Shared state file
+# ---------------------------------------
+def publish(state, source, since):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp = f"{STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"state": state, "source": source, "since": since, "updated": time.time()}, f)
+    os.replace(tmp, STATE_FILE)
+
+
+_lock = threading.Lock()
+_file = (None, None)          # (mtime_ns, parsed contents) of STATE_FILE
+_probed = (0.0, None)         # (monotonic time, state) of our own last probe
+
+
+def read():
+    """The monitor's last published state {state, source, since, updated}, or None."""
+    global _file
+    try:
+        mtime = os.stat(STATE_FILE).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        if _file[0] != mtime:
+            try:
+                with open(STATE_FILE) as f:
+                    _file = (mtime, json.load(f))
+            except (OSError, ValueError):
+                return None
+        return _file[1]
+
+
+def state(fresh=False):
+    """
+    online, offline or captive: the monitor's if it is running, else a probe
+    of our own. fresh=True probes now (e.g. right after joining a network,
+    which the monitor may not have seen yet).
+    """
+    global _probed
+    if not fresh:
+        data = read()
+        if data and time.time() - data.get("updated", 0) < STALE_AFTER:
+            return data["state"]
+        with _lock:
+            at, last = _probed
+            if last is not None and time.monotonic() - at < PROBE_INTERVAL:
+                return last
+    result = probe()
+    with _lock:
+        _probed = (time.monotonic(), result)
+    return result
+
+
+# ---------------------------------------
+# Monitor (runs in the uploader)
+# ---------------------------------------
+class Monitor:
+    """
+    Follows NetworkManager (or probes) on a daemon thread and publishes the
+    state. on_change(state) is called on that thread after each change.
+    """
+    def __init__(self, on_change=None, bus=NM_BUS):
+        self.on_change = on_change
+        self.bus = bus
+        self.state = None            # None until the first reading
+        self.source = None
+        self.since = None
+        self.published = 0.0
+        self.nm_following = False
+        self.nm_error = None
+
+    def start(self):
+        threading.Thread(target=self.run, name="connectivity", daemon=True).start()
+        return self
+
+    def online(self):
+        """False only while the link is known to be down or captive."""
+        return self.state in (None, ONLINE)
+
+    def run(self):
+        while True:
+            if open_dbus_connection is not None:
+                try:
+                    self.watch_nm()
+                except Exception as e:
+                    self.nm_following = False
+                    if str(e) != self.nm_error:
+                        print(f"[net] NetworkManager unavailable ({e}); probing every {PROBE_INTERVAL} s")
+                    self.nm_error = str(e)
+            self.set(probe(), "probe")
+            time.sleep(PROBE_INTERVAL)
+
+    def watch_nm(self):
+        """Returns only by raising: NM missing, gone, or the bus connection lost."""
+        nm = DBusAddress(NM_PATH, bus_name=NM_NAME, interface=NM_NAME)
+        conn = open_dbus_connection(bus=self.bus)
+        try:
+            # StateChanged and PropertiesChanged both come from NM_PATH; any signal there means re-read
+            rule = MatchRule(type="signal", path=NM_PATH)
+            unwrap_msg(conn.send_and_get_reply(message_bus.AddMatch(rule), timeout=NM_CALL_TIMEOUT))
+            with conn.filter(rule, bufsize=16) as signals:
+                self.set(*self.nm_state(conn, nm))
+                if not self.nm_following:
+                    print("[net] following NetworkManager")
+                    self.nm_following, self.nm_error = True, None
+                while True:
+                    try:
+                        conn.recv_until_filtered(signals, timeout=HEARTBEAT)
+                        signals.clear()
+                    except TimeoutError:
+                        pass             # heartbeat
+                    self.set(*self.nm_state(conn, nm))
+        finally:
+            conn.close()
+
+    def nm_state(self, conn, nm):
+        def get(name):
+            reply = conn.send_and_get_reply(Properties(nm).get(name), timeout=NM_CALL_TIMEOUT)
+            return unwrap_msg(reply)[0][1]
+        connectivity = get("Connectivity")
+        state = NM_CONNECTIVITY.get(connectivity)
+        if state == CAPTIVE and probe() == ONLINE:
+            return ONLINE, "nm+probe"    # logged in; NM re-checks only every few minutes
+        if state is not None:
+            return state, "nm"
+        if get("State") < NM_STATE_CONNECTED_SITE:
+            return OFFLINE, "nm"
+        return probe(), "nm+probe"
+
+    def set(self, state, source):
+        now = time.time()
+        changed = state != self.state
+        if changed:
+            print(f"[net] {self.state or 'unknown'} -> {state} ({source})")
+            self.state, self.since = state, now
+        if changed or source != self.source or now - self.published >= HEARTBEAT - 1:
+            self.source = source
+            try:
+                publish(state, source, self.since)
+                self.published = now
+            except OSError as e:
+                print(f"[net] cannot write {STATE_FILE}: {e}")
+        if changed and self.on_change:
+            try:
+                self.on_change(state)
+            except Exception as e:
+                print(f"[net] on_change: {e}")
+
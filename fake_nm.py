@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Fake NetworkManager for testing connectivity.py without touching the network.
+
+Takes the name org.freedesktop.NetworkManager on a D-Bus bus (the session
+bus by default) and answers Properties.Get/GetAll for State and
+Connectivity on /org/freedesktop/NetworkManager. Each change emits
+StateChanged and PropertiesChanged, as NetworkManager does. Needs jeepney.
+
+States (NMState, NMConnectivityState):
+
+  online    70 CONNECTED_GLOBAL, 4 FULL
+  captive   70 CONNECTED_GLOBAL, 2 PORTAL
+  limited   60 CONNECTED_SITE,   3 LIMITED
+  offline   20 DISCONNECTED,     1 NONE
+  unknown   70 CONNECTED_GLOBAL, 0 UNKNOWN (connectivity checks turned off)
+
+Run on a private session bus:
+
+  dbus-run-session -- sh -c '
+    python3 fake_nm.py serve --script online:20 captive:10 offline:10 online &
+    PACKPROOF_NM_BUS=SESSION python3 uploader.py'
+
+  serve without --script reads state names from stdin, one per line.
+
+  dbus-run-session -- python3 fake_nm.py check
+      runs connectivity.Monitor against the fake (and a local probe server
+      for "unknown"), walks it through every state, and reports how long
+      each change took to reach state() in another reader. Exits 1 if a
+      state comes out wrong.
+"""
+import os, sys, time, argparse, tempfile, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jeepney import (DBusAddress, MessageType, HeaderFields, message_bus,
+                     new_method_return, new_error, new_signal)
+from jeepney.wrappers import unwrap_msg
+from jeepney.io.blocking import open_dbus_connection
+
+NM_NAME  = "org.freedesktop.NetworkManager"
+NM_PATH  = "/org/freedesktop/NetworkManager"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+
+STATES = {
+    "online":  (70, 4),
+    "captive": (70, 2),
+    "limited": (60, 3),
+    "offline": (20, 1),
+    "unknown": (70, 0),
+}
+
+
+# ---------------------------------------
+# The fake
+# ---------------------------------------
+class FakeNM:
+    def __init__(self, bus="SESSION", state="online"):
+        self.conn = open_dbus_connection(bus=bus)
+        reply = unwrap_msg(self.conn.send_and_get_reply(message_bus.RequestName(NM_NAME, 4)))  # DO_NOT_QUEUE
+        if reply[0] != 1:
+            raise SystemExit(f"{NM_NAME} is already taken on this bus")
+        self.send_lock = threading.Lock()
+        self.nm_state, self.connectivity = STATES[state]
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def props(self):
+        return {"State": ("u", self.nm_state), "Connectivity": ("u", self.connectivity)}
+
+    def send(self, msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def serve(self):
+        while self.running:
+            try:
+                msg = self.conn.receive(timeout=0.5)
+            except TimeoutError:
+                continue
+            except OSError:
+                return
+            if msg.header.message_type == MessageType.method_call:
+                self.answer(msg)
+
+    def answer(self, msg):
+        fields = msg.header.fields
+        path, iface, member = (fields.get(HeaderFields.path), fields.get(HeaderFields.interface),
+                               fields.get(HeaderFields.member))
+        props = self.props()
+        if path == NM_PATH and iface == PROPERTIES and member == "Get" and msg.body[1] in props:
+            self.send(new_method_return(msg, "v", (props[msg.body[1]],)))
+        elif path == NM_PATH and iface == PROPERTIES and member == "GetAll":
+            self.send(new_method_return(msg, "a{sv}", (props,)))
+        else:
+            self.send(new_error(msg, "org.freedesktop.DBus.Error.UnknownMethod", "s",
+                                (f"fake_nm: no {iface}.{member} on {path}",)))
+
+    def set(self, name):
+        self.nm_state, self.connectivity = STATES[name]
+        self.send(new_signal(DBusAddress(NM_PATH, interface=NM_NAME), "StateChanged", "u", (self.nm_state,)))
+        self.send(new_signal(DBusAddress(NM_PATH, interface=PROPERTIES), "PropertiesChanged",
+                             "sa{sv}as", (NM_NAME, self.props(), [])))
+        print(f"[fake_nm] {name}: State {self.nm_state}, Connectivity {self.connectivity}", flush=True)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.conn.close()
+
+
+def serve(args):
+    nm = FakeNM(args.bus, args.state)
+    print(f"[fake_nm] {NM_NAME} on the {args.bus} bus, {args.state}", flush=True)
+    if args.script:
+        for step in args.script:
+            name, _, seconds = step.partition(":")
+            nm.set(name)
+            time.sleep(float(seconds) if seconds else 0)
+        if not args.script[-1].partition(":")[2]:
+            threading.Event().wait()       # the last step has no duration: stay there
+    else:
+        for line in sys.stdin:
+            if line.strip() in STATES:
+                nm.set(line.strip())
+            elif line.strip():
+                print(f"[fake_nm] states: {', '.join(STATES)}", flush=True)
+    nm.close()
+
+
+# ---------------------------------------
+# check: connectivity.Monitor against the fake
+# ---------------------------------------
+class ProbeHandler(BaseHTTPRequestHandler):
+    status = 204        # what the "internet" answers; 302 is a captive portal
+
+    def do_GET(self):
+        self.send_response(self.status)
+        if self.status == 302:
+            self.send_header("Location", "http://login.portal/")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def check(args):
+    probe_server = ThreadingHTTPServer(("127.0.0.1", 0), ProbeHandler)
+    threading.Thread(target=probe_server.serve_forever, daemon=True).start()
+    os.environ["PACKPROOF_DIR"] = tempfile.mkdtemp(prefix="pp-net-")
+    os.environ["PACKPROOF_PROBE_URL"] = f"http://127.0.0.1:{probe_server.server_port}/generate_204"
+    import connectivity
+
+    nm = FakeNM(args.bus, "offline")
+    changes = []
+    monitor = connectivity.Monitor(on_change=lambda s: changes.append((time.perf_counter(), s)),
+                                   bus=args.bus).start()
+
+    def until(expected, t0, timeout=5.0):
+        while time.perf_counter() - t0 < timeout:
+            if connectivity.state() == expected:
+                return (time.perf_counter() - t0) * 1000
+            time.sleep(0.001)
+        return None
+
+    failed = 0
+    if until("offline", time.perf_counter()) is None:
+        raise SystemExit("monitor did not publish the initial state")
+    print(f"{'NetworkManager':<16}{'probe':>7}{'expected':>10}{'state()':>10}{'ms':>8}")
+    steps = [("online", 204, "online"), ("captive", 204, "online"),   # logged in before NM re-checked
+             ("captive", 302, "captive"), ("limited", 204, "offline"), ("offline", 204, "offline"),
+             ("unknown", 204, "online"), ("unknown", 302, "captive"), ("online", 204, "online")]
+    for name, status, expected in steps:
+        ProbeHandler.status = status
+        t0 = time.perf_counter()
+        nm.set(name)
+        ms = until(expected, t0)
+        got = connectivity.state()
+        if ms is None:
+            failed += 1
+        print(f"{name:<16}{status:>7}{expected:>10}{got:>10}"
+              f"{'FAIL' if ms is None else f'{ms:.1f}':>8}")
+
+    n = 10_000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        connectivity.state()
+    print(f"\nstate(): {(time.perf_counter() - t0) / n * 1e6:.1f} us per call, no process spawned")
+    print(f"on_change calls: {len(changes)} ({' -> '.join(s for _, s in changes)})")
+    print(f"monitor source: {monitor.source}")
+    nm.close()
+    probe_server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake NetworkManager on D-Bus")
+    ap.add_argument("--bus", default="SESSION", help="SESSION, SYSTEM or a D-Bus address")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("serve", help="own the NetworkManager name and follow a script or stdin")
+    p.add_argument("--state", default="online", choices=list(STATES), help="initial state")
+    p.add_argument("--script", nargs="+", metavar="STATE[:SECONDS]",
+                   help="states to go through; the last one without seconds is kept")
+    p.set_defaults(fn=serve)
+
+    p = sub.add_parser("check", help="run connectivity.Monitor against the fake")
+    p.set_defaults(fn=check)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
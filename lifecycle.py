@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Order lifecycle trace: one JSON line per event, keyed by order id.
+
+main.py and uploader.py both append to TRACE_FILE with event(). Each line is
+written with a single O_APPEND write, so the two processes never interleave
+inside a line. When the file passes TRACE_MAX_BYTES it is rotated (under a
+lock) to .1 ... .TRACE_KEEP, so the trace never uses more than about
+TRACE_MAX_BYTES * (TRACE_KEEP + 1) on the card.
+
+Events (besides t, id, ev, proc):
+  record_start    live (one config for preview and recording), profile, bitrate, size
+  record_failed   error[, stage (stop|queue); none: START failed]
+  preroll         seconds, bytes (buffered video put in front of the recording)
+  first_frame     latency_ms (START press to first encoded frame), live
+  record_stop     bytes, seconds, frames, expected_frames
+  still           reason (button|stop), bytes, size, ms (JPEG of the label)
+  segment         index, bytes, seconds (segmented recording: one finished segment)
+  enqueue         bytes, new (False: already pending)
+  upload_attempt  kind (video|proxy|segment|manifest), bytes, seconds, ok, attempt[, index]
+  upload_skipped  reason (missing|damaged|on server)
+  uploaded
+  downscaled      bytes (before), to
+  deleted         reason (uploaded|evicted|expired), bytes
+
+  python3 lifecycle.py show INV123   timeline of one order
+  python3 lifecycle.py stats         latency percentiles per stage, all orders
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+
+from util import percentile
+
+DATA_DIR        = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+TRACE_FILE      = f"{DATA_DIR}/lifecycle.log"
+TRACE_MAX_BYTES = 4 * 1024 * 1024
+TRACE_KEEP      = 3
+
+PROC = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+
+# stage -> (from event, to event); "first" / "last" pick the occurrence
+STAGES = [
+    ("record",        ("record_start", "first"), ("record_stop", "last")),
+    ("stop→queued",   ("record_stop", "last"),   ("enqueue", "last")),
+    ("queued→tried",  ("enqueue", "last"),       ("upload_attempt", "first")),
+    ("tried→uploaded", ("upload_attempt", "first"), ("uploaded", "last")),
+    ("queued→uploaded", ("enqueue", "last"),     ("uploaded", "last")),
+    ("uploaded→deleted", ("uploaded", "last"),   ("deleted", "last")),
+]
+
+
+def event(order_id, ev, **fields):
+    """Append one event. Never raises: tracing must not break recording or uploads."""
+    rec = {"t": round(time.time(), 3), "id": order_id, "ev": ev, "proc": PROC, **fields}
+    line = (json.dumps(rec, separators=(",", ":")) + "\n").encode()
+    try:
+        _rotate_if_full()
+        fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"[trace] {e}")
+
+
+def _rotate_if_full():
+    try:
+        if os.path.getsize(TRACE_FILE) < TRACE_MAX_BYTES:
+            return
+    except FileNotFoundError:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        return
+    with open(TRACE_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # the other process may have rotated while we waited
+        if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) >= TRACE_MAX_BYTES:
+            for i in range(TRACE_KEEP - 1, 0, -1):
+                if os.path.exists(f"{TRACE_FILE}.{i}"):
+                    os.replace(f"{TRACE_FILE}.{i}", f"{TRACE_FILE}.{i + 1}")
+            os.replace(TRACE_FILE, f"{TRACE_FILE}.1")
+
+
+def read_events(order_id=None):
+    """All retained events, oldest first."""
+    files = [f"{TRACE_FILE}.{i}" for i in range(TRACE_KEEP, 0, -1)] + [TRACE_FILE]
+    events = []
+    for path in files:
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue   # torn line from a power cut
+                    if order_id is None or e.get("id") == order_id:
+                        events.append(e)
+        except FileNotFoundError:
+            pass
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+def fmt_secs(s):
+    if s < 1:
+        return f"{s * 1000:.0f} ms"
+    if s < 120:
+        return f"{s:.1f} s"
+    if s < 7200:
+        return f"{s / 60:.1f} min"
+    return f"{s / 3600:.1f} h"
+
+
+# ---------------------------------------
+# Command line
+# ---------------------------------------
+def show(order_id):
+    events = read_events(order_id)
+    if not events:
+        raise SystemExit(f"no events for {order_id}")
+    t0 = events[0]["t"]
+    for e in events:
+        extra = {k: v for k, v in e.items() if k not in ("t", "id", "ev", "proc")}
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["t"]))
+        detail = " ".join(f"{k}={v}" for k, v in extra.items())
+        print(f"{stamp}  +{fmt_secs(e['t'] - t0):>9}  {e['proc']:<9}{e['ev']:<16}{detail}")
+
+
+def stats():
+    by_id = {}
+    for e in read_events():
+        by_id.setdefault(e["id"], []).append(e)
+
+    def pick(events, name, which):
+        hits = [e for e in events if e["ev"] == name]
+        return (hits[0] if which == "first" else hits[-1]) if hits else None
+
+    def when(e):
+        # attempts are logged when they end; stages count from when they began
+        return e["t"] - e.get("seconds", 0) if e["ev"] == "upload_attempt" else e["t"]
+
+    rows = []
+    for stage, (a, wa), (b, wb) in STAGES:
+        spans = []
+        for events in by_id.values():
+            start, end = pick(events, a, wa), pick(events, b, wb)
+            if start and end and when(end) >= when(start):
+                spans.append(when(end) - when(start))
+        rows.append((stage, spans))
+    # START press to first encoded frame, live config vs. switch_mode, to compare the two
+    for live, label in ((True, "1st frame live"), (False, "1st frame switch")):
+        spans = [e["latency_ms"] / 1000 for events in by_id.values() for e in events
+                 if e["ev"] == "first_frame" and e.get("live") == live]
+        if spans or live:
+            rows.append((label, spans))
+    spans = [e["seconds"] for events in by_id.values() for e in events if e["ev"] == "preroll"]
+    if spans:
+        rows.append(("pre-roll", spans))
+    for kind in ("proxy", "video", "segment", "manifest"):
+        spans = [e["seconds"] for events in by_id.values() for e in events
+                 if e["ev"] == "upload_attempt" and e.get("kind") == kind]
+        if spans or kind in ("proxy", "video"):
+            rows.append((f"{kind} attempt", spans))
+
+    print(f"{len(by_id)} orders\n")
+    print(f"{'stage':<18}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, spans in rows:
+        if spans:
+            print(f"{stage:<18}{len(spans):>6}" + "".join(
+                f"{fmt_secs(percentile(spans, p)):>10}" for p in (50, 90, 99)) + f"{fmt_secs(max(spans)):>10}")
+        else:
+            print(f"{stage:<18}{0:>6}")
+    stops = [e for events in by_id.values() for e in events
+             if e["ev"] == "record_stop" and e.get("expected_frames")]
+    if stops:
+        short = sum(1 for e in stops if e["frames"] < 0.98 * e["expected_frames"])
+        ratio = sum(e["frames"] for e in stops) / sum(e["expected_frames"] for e in stops)
+        print(f"\nencoder: {ratio:.1%} of expected frames, {short} of {len(stops)} recordings short by >2%")
+    attempts = [e for events in by_id.values() for e in events if e["ev"] == "upload_attempt"]
+    failed = sum(1 for e in attempts if not e.get("ok"))
+    if attempts:
+        print(f"\n{len(attempts)} upload attempts, {failed} failed")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="PackProof order lifecycle trace")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("show", help="timeline of one order")
+    p.add_argument("order_id")
+    sub.add_parser("stats", help="latency percentiles per stage across all orders")
+    args = ap.parse_args()
+    if args.cmd == "show":
+        show(args.order_id)
+    else:
+        stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,21 +7,33 @@ from ttkbootstrap.constants import *
 try:
     from picamera2 import Picamera2
     from picamera2.encoders import H264Encoder
-    from picamera2.outputs import FfmpegOutput
+    from picamera2.outputs import FfmpegOutput, Output
 except Exception:
     Picamera2 = None
     H264Encoder = None
     FfmpegOutput = None
-
-from PIL import Image, ImageTk
-import os, time, json, subprocess, shlex
+    Output = object
+
+import os, time, subprocess, shlex, hashlib
+import background
+import connectivity
+import lifecycle
+import metrics
+import mp4mux
+import preroll
+import preview
+import quality
+import queue_db
+import segments
+import spool
+import stills
 
 # =========================
 # PATHS
 # =========================
-VIDEO_PATH = "/home/neonflake/packproof/videos"
-IMAGE_PATH = "/home/neonflake/packproof/images"
-LOG_FILE   = "/home/neonflake/packproof/upload_log.json"
+DATA_DIR   = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+VIDEO_PATH = f"{DATA_DIR}/videos"
+IMAGE_PATH = f"{DATA_DIR}/images"
 os.makedirs(VIDEO_PATH, exist_ok=True)
 os.makedirs(IMAGE_PATH, exist_ok=True)
 
@@ -35,46 +47,99 @@ ENTRY_FONT      = ("Arial", 48)
 ENTRY_IPADY     = 32
 
 # =========================
-# Helpers - nmcli check
+# RECORDING
 # =========================
-def run_cmd_list(cmd_list, timeout=4):
-    """Run command list and return (rc, stdout)."""
-    try:
-        p = subprocess.run(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
-        return p.returncode, p.stdout.strip()
-    except Exception:
-        return 1, ""
+# main stream size and bitrate: a quality.PROFILES entry picked from the
+# uplink, upload backlog and free spool (PACKPROOF_QUALITY_FLOOR / _CEILING)
+VIDEO_FPS        = 30
+
+# "mp4": mux into the mp4 inside this process (mp4mux.py, fragmented, uses the
+# encoder's timestamps); "ffmpeg": one ffmpeg process per file, as before.
+# Segmented recording always uses ffmpeg (its segment muxer)
+MUXER = os.environ.get("PACKPROOF_MUXER", "mp4")
+
+# keep the video configuration running for preview too, so START only attaches
+# the encoders (no switch_mode reconfigure and settle sleep); 0 = old behaviour
+LIVE_CONFIG = os.environ.get("PACKPROOF_LIVE_CONFIG", "1") != "0"
+
+# >0: record rolling segments of this many seconds and upload them during
+# the recording (segments.py); 0: one mp4 uploaded after STOP
+SEGMENT_SECONDS = segments.SEGMENT_SECONDS
+
+# with LIVE_CONFIG: keep this many seconds of encoded video in memory (one
+# always-on encoder, capped at preroll.PREROLL_MAX_BYTES) and put them in
+# front of each recording, so packing started before START is on video
+PREROLL_SECONDS = preroll.PREROLL_SECONDS if LIVE_CONFIG else 0
+MIN_RECORD_BYTES = quality.PROFILES[quality.QUALITY_FLOOR][1] // 8 * 300   # 5 minutes at the floor
+SPOOL_CHECK_MS   = 30_000
+
+# small second stream: feeds the preview, and the proxy encoder while recording
+LORES_SIZE = preview.LORES_SIZE
 
+# preview on the record screen: small, capped, and a tenth of a core at most
+RECORD_PREVIEW_BUDGET = 0.10
+RECORD_PREVIEW_FPS    = 10
+
+# low-bitrate proxy from the lores stream, uploaded ahead of the full video
+PROXY_ENABLED = True
+PROXY_BITRATE = 300_000
+
+# =========================
+# Helpers - online check
+# =========================
 def check_online():
-    """Return True when any active WiFi connection exists (nmcli)."""
-    # first try to get active wifi line
-    rc, out = run_cmd_list(["nmcli", "-t", "-f", "ACTIVE,SSID", "dev", "wifi"])
-    if rc == 0 and out:
-        for line in out.splitlines():
-            if line.startswith("yes:") or line.startswith("yes:"):
-                return True
-    # fallback: check device connection
-    rc2, out2 = run_cmd_list(["nmcli", "-t", "-f", "STATE", "general"])
-    if rc2 == 0 and "connected" in out2.lower():
-        return True
-    return False
+    """online, offline or captive, as published by the uploader's monitor (connectivity.py)."""
+    return connectivity.state()
 
 # =========================
 # Queue handler
 # =========================
-def add_to_upload_queue(order_id: str):
-    data = {"pending": [], "uploaded": []}
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, "r") as f:
-                data = json.load(f)
-        except:
-            pass
-    if not any(e.get("id") == order_id for e in data["pending"]):
-        data["pending"].append({"id": order_id})
-        with open(LOG_FILE, "w") as f:
-            json.dump(data, f, indent=2)
+def add_to_upload_queue(order_id: str, content_hash=None, size=None,
+                        proxy_hash=None, proxy_size=None, kind="video", profile=None):
+    added = queue_db.enqueue(order_id, content_hash=content_hash, size=size,
+                             proxy_hash=proxy_hash, proxy_size=proxy_size, kind=kind,
+                             profile=profile)
+    if added:
         print(f"[queue] Added {order_id}")
+    lifecycle.event(order_id, "enqueue", bytes=size, new=added)
+    queue_db.notify(order_id)
+
+def video_output(path, size, burst=False):
+    """Encoder output writing one mp4. burst: frames may arrive faster than real time (pre-roll)."""
+    if MUXER == "mp4":
+        return mp4mux.Mp4Output(path, size, fps=VIDEO_FPS)
+    if burst:
+        return preroll.RawFfmpegOutput(path, VIDEO_FPS)
+    return FfmpegOutput(path)
+
+# =========================
+# Encoder tee - content hash while recording
+# =========================
+class HashingOutput(Output):
+    """
+    Second encoder output next to the file output. It sees every encoded frame
+    as it is produced, so the content hash is ready at stop without reading
+    the video back from the SD card.
+    """
+    def __init__(self, on_first_frame=None):
+        super().__init__()
+        self.sha = hashlib.sha256()
+        self.bytes = 0
+        self.frames = 0
+        self.first_frame_at = None     # time.monotonic() of the first encoded frame
+        self.on_first_frame = on_first_frame
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if self.first_frame_at is None:
+            self.first_frame_at = time.monotonic()
+            if self.on_first_frame:
+                self.on_first_frame(self.first_frame_at)
+        self.sha.update(frame)
+        self.bytes += len(frame)
+        self.frames += 1
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
 
 # =========================
 # Numeric keypad (full screen)
@@ -177,33 +242,78 @@ class RecorderApp:
                                    ("pressed", "#FF8C00"),
                                    ("hover", "#FF8C00")])
 
+        self.profile = quality.pick()
+        size = quality.PROFILES[self.profile][0]
+
         # picamera2 initialization only if available
         if Picamera2:
             try:
                 self.picam2 = Picamera2()
-                self.preview_cfg = self.picam2.create_preview_configuration(main={"size": (640, 480)})
-                self.video_cfg = self.picam2.create_video_configuration(main={"size": (640, 480)})
-                self.picam2.configure(self.preview_cfg)
+                self.preview_cfg = self.picam2.create_preview_configuration(main={"size": size},
+                                                                            lores={"size": LORES_SIZE})
+                self.video_cfg = self.make_video_cfg(size)
+                self.picam2.configure(self.video_cfg if LIVE_CONFIG else self.preview_cfg)
                 self.picam2.start()
             except Exception:
                 self.picam2 = None
         else:
             self.picam2 = None
 
+        # label stills from the main stream, JPEG-encoded on their own thread
+        self.stills = stills.StillCapture(self.picam2, IMAGE_PATH)
+
+        self.preroll = None
+        if self.picam2 and PREROLL_SECONDS and H264Encoder:
+            self.start_preroll()
+
         self.keypad_open = False
-        self.preview_running = False
+        self.preview = None
+        self.spool_state = "ok"
+        self.action_button = None     # START or STOP, disabled while the camera lane is busy
+        self.screen = None            # name of the raised screen
+        self.timer_job = None
 
-        self.build_home()
+        # blocking calls run here, never on the Tk thread (background.py)
+        self.camera_jobs = background.Background(master, "camera", on_busy=self.show_busy)
+        self.io_jobs = background.Background(master, "io")
+        self.spool_jobs = background.Background(master, "spool")   # eviction may re-encode for minutes
+
+        self.build_screens()
+        self.show_home()
 
         # start online checker loop
         self.master.after(800, self.update_online_status)
-
-    def build_home(self):
-        for w in self.master.winfo_children():
-            w.destroy()
-
+        # recount the spool once, then keep it within budget
+        self.master.after(1500, lambda: self.update_spool_status(rescan=True))
+        # health counters -> metrics/recorder.prom (served by the uploader)
+        metrics.gauge("packproof_recording", 0)
+        metrics.start("recorder")
+
+    # ---------- screens: built once, switched with tkraise ----------
+    def build_screens(self):
+        """Every screen is a frame in the same grid cell; show_*() raise one and fill in its fields."""
+        self.master.rowconfigure(0, weight=1)
+        self.master.columnconfigure(0, weight=1)
+        self.screens = {}
+        for name, build in (("home", self.build_home), ("settings", self.build_settings),
+                            ("preview", self.build_preview), ("record", self.build_record_screen)):
+            frame = tk.Frame(self.master, bg="white")
+            frame.grid(row=0, column=0, sticky="nsew")
+            build(frame)
+            self.screens[name] = frame
+
+    def raise_screen(self, name):
+        """Leave the current screen (preview and timer stop) and show `name`."""
+        self.stop_preview()
+        if self.timer_job is not None:
+            self.master.after_cancel(self.timer_job)
+            self.timer_job = None
+        self.screens[name].tkraise()
+        self.screen = name
+
+    def build_home(self, screen):
         # top bar
-        top = tk.Frame(self.master, bg="white")
+        top = tk.Frame(screen, bg="white")
         top.pack(fill="x", side="top")
 
         # ONLINE/OFFLINE label (solid dot + text)
@@ -211,13 +321,19 @@ class RecorderApp:
                                      bg="white", fg="black")
         self.online_label.pack(side="left", padx=20, pady=10)
 
+        # storage warning (empty while the spool has room)
+        self.storage_label = tk.Label(top, text="", font=("Arial", 30, "bold"),
+                                      bg="white", fg="red")
+        self.storage_label.pack(side="left", padx=10, pady=10)
+        self.show_spool_state()
+
         # large settings icon
         tk.Button(top, text="⚙️", font=("Arial", 72, "bold"),
                   bg="white", fg="black", relief="flat",
-                  command=self.open_settings).pack(side="right", padx=24, pady=8)
+                  command=self.show_settings).pack(side="right", padx=24, pady=8)
 
         # main wrapper - reduced top/bottom padding to make space
-        wrapper = tk.Frame(self.master, bg="white")
+        wrapper = tk.Frame(screen, bg="white")
         wrapper.pack(fill="both", expand=True, padx=36, pady=(8,18))
 
         tk.Label(wrapper, text="Enter Order ID", font=TITLE_FONT, bg="white").pack(pady=(10, 18))
@@ -234,43 +350,101 @@ class RecorderApp:
         self.id_entry.bind("<Button-1>", lambda e: self.open_keypad())
 
         # START button - ensure visible by using pack after packing wrapper; give some vertical padding
-        ttkbs.Button(wrapper, text="START RECORDING", style="Start.TButton",
-                     command=self.start_recording).pack(fill="x", pady=(20, 28))
+        self.start_button = ttkbs.Button(wrapper, text="START RECORDING", style="Start.TButton",
+                                         command=self.start_recording)
+        self.start_button.pack(fill="x", pady=(20, 28))
+
+    def show_home(self):
+        self.raise_screen("home")
+        self.action_button = self.start_button
+        self.set_action_text("START RECORDING")
+        self.show_busy(self.camera_jobs.busy())
+
+    def show_busy(self, busy):
+        """Camera lane busy: no second START/STOP, and the touch shows it is working."""
+        try:
+            self.master.config(cursor="watch" if busy else "")
+            if self.action_button is not None:
+                self.action_button.configure(state="disabled" if busy else "normal")
+        except tk.TclError:
+            pass
 
-    def update_online_status(self):
+    def set_action_text(self, text):
         try:
-            online = check_online()
-        except Exception:
-            online = False
+            self.action_button.configure(text=text)
+        except (tk.TclError, AttributeError):
+            pass
 
-        if online:
-            # green dot + ONLINE text (solid bullet)
-            self.online_label.config(text="●  ONLINE", fg="green")
-        else:
-            self.online_label.config(text="●  OFFLINE", fg="red")
+    def update_online_status(self):
+        # a file read, in the io lane: it probes the network itself if the uploader is not running
+        self.io_jobs.submit(check_online, done=self.show_online,
+                            error=lambda e: self.show_online(connectivity.OFFLINE))
+
+    def show_online(self, state):
+        metrics.gauge("packproof_online", int(state == connectivity.ONLINE))
+        try:
+            if state == connectivity.ONLINE:
+                # green dot + ONLINE text (solid bullet)
+                self.online_label.config(text="●  ONLINE", fg="green")
+            elif state == connectivity.CAPTIVE:
+                # Wi-Fi is up, but the network wants a browser login first
+                self.online_label.config(text="●  WI-FI LOGIN", fg="orange")
+            else:
+                self.online_label.config(text="●  OFFLINE", fg="red")
+        except tk.TclError:
+            pass   # window closing
 
         # schedule again
         self.master.after(3000, self.update_online_status)
 
-    def open_settings(self):
-        for w in self.master.winfo_children():
-            w.destroy()
+    def update_spool_status(self, rescan=False):
+        """Run retention/eviction in the spool lane (it may re-encode videos), then update the label."""
+        self.spool_jobs.submit(self.check_spool, rescan, done=self.spool_checked)
 
-        top = tk.Frame(self.master, bg="white")
+    def check_spool(self, rescan):
+        try:
+            if rescan:
+                spool.rescan()
+            state = spool.evict()
+            if not spool.has_room(MIN_RECORD_BYTES):
+                state = "full"
+        except Exception as e:
+            print("[spool] check failed:", e)
+            state = self.spool_state
+        return state
+
+    def spool_checked(self, state):
+        self.show_spool_state(state)
+        self.master.after(SPOOL_CHECK_MS, self.update_spool_status)
+
+    def show_spool_state(self, state=None):
+        if state:
+            self.spool_state = state
+        metrics.gauge("packproof_spool_full", int(self.spool_state == "full"))
+        try:
+            self.storage_label.config(text="⚠ STORAGE FULL" if self.spool_state == "full" else "")
+        except Exception:
+            pass
+
+    def build_settings(self, screen):
+        top = tk.Frame(screen, bg="white")
         top.pack(fill="x", side="top")
 
         tk.Label(top, text="Settings", font=TITLE_FONT, bg="white").pack(side="left", padx=24, pady=12)
 
         tk.Button(top, text="⬅", font=("Arial", 48), bg="white", relief="flat",
-                  command=self.build_home).pack(side="right", padx=20, pady=12)
+                  command=self.show_home).pack(side="right", padx=20, pady=12)
 
-        wrapper = tk.Frame(self.master, bg="white")
+        wrapper = tk.Frame(screen, bg="white")
         wrapper.pack(fill="both", expand=True, padx=36, pady=36)
 
         # large option buttons
         self.big_button(wrapper, "SET CAMERA ANGLE", self.show_preview).pack(fill="x", pady=20)
         self.big_button(wrapper, "WI-FI SETTINGS", self.open_wifi).pack(fill="x", pady=20)
-        self.big_button(wrapper, "BACK", self.build_home).pack(fill="x", pady=20)
+        self.big_button(wrapper, "BACK", self.show_home).pack(fill="x", pady=20)
+
+    def show_settings(self):
+        self.raise_screen("settings")
 
     def open_wifi(self):
         # launch wifi.py in background, keep main app running
@@ -280,109 +454,321 @@ class RecorderApp:
         except Exception as e:
             print("Failed to launch wifi UI:", e)
 
-    def show_preview(self):
-        for w in self.master.winfo_children():
-            w.destroy()
-
-        frame = tk.Frame(self.master, bg="white")
-        frame.pack(fill="both", expand=True)
-
-        self.preview_label = tk.Label(frame, bg="white")
+    def build_preview(self, screen):
+        self.preview_label = tk.Label(screen, bg="white")
         self.preview_label.pack(expand=True, fill="both")
 
-        self.big_button(frame, "STOP PREVIEW", self.build_home).pack(fill="x", pady=18)
-
-        self.preview_running = True
-        self._update_preview()
+        self.big_button(screen, "STOP PREVIEW", self.show_home).pack(fill="x", pady=18)
 
-    def _update_preview(self):
-        if not self.preview_running:
+    def show_preview(self):
+        self.raise_screen("preview")
+        # lores frames captured off the Tk thread, painted into one reused PhotoImage
+        self.preview = preview.LivePreview(self.master, self.preview_label, self.picam2).start()
+
+    def make_video_cfg(self, size):
+        # main -> H264Encoder, lores -> proxy encoder and the on-screen preview
+        return self.picam2.create_video_configuration(main={"size": size},
+                                                      lores={"size": LORES_SIZE},
+                                                      controls={"FrameRate": VIDEO_FPS})
+
+    def use_profile(self, name):
+        """Between recordings: reconfigure the camera / pre-roll encoder for quality profile `name`."""
+        old, self.profile = self.profile, name
+        if name == old or not self.picam2:
             return
-        if self.picam2:
-            try:
-                frame = self.picam2.capture_array()
-                img = ImageTk.PhotoImage(Image.fromarray(frame))
-                self.preview_label.config(image=img)
-                self.preview_label.image = img
-            except Exception:
-                pass
-        self.master.after(120, self._update_preview)
+        size = quality.PROFILES[name][0]
+        try:
+            if self.preroll:
+                self.picam2.stop_encoder(self.preroll_encoder)
+            if size != quality.PROFILES[old][0]:
+                self.video_cfg = self.make_video_cfg(size)
+                if LIVE_CONFIG:
+                    self.picam2.stop()
+                    self.picam2.configure(self.video_cfg)
+                    self.picam2.start()
+            if self.preroll:
+                self.start_preroll()
+        except Exception as e:
+            print("Quality change failed:", e)
+
+    def start_preroll(self):
+        """The recording encoder, running from now on into the pre-roll buffer."""
+        try:
+            # a keyframe every second: the buffer is trimmed and flushed in whole GOPs;
+            # SPS/PPS repeated with each, since the first GOP is long gone by START
+            self.preroll_encoder = H264Encoder(bitrate=quality.PROFILES[self.profile][1],
+                                               repeat=True, iperiod=VIDEO_FPS)
+            self.preroll = preroll.PrerollOutput()
+            self.picam2.start_encoder(self.preroll_encoder, self.preroll)
+            print(f"[record] Pre-roll: {PREROLL_SECONDS:g} s, "
+                  f"{preroll.PREROLL_MAX_BYTES >> 20} MB max")
+        except Exception as e:
+            print("Pre-roll start failed:", e)
+            self.preroll = None
+
+    def stop_preview(self):
+        if self.preview:
+            self.preview.stop()
+            self.preview = None
 
     def start_recording(self):
+        if self.camera_jobs.busy():
+            return
+        pressed_at = time.monotonic()
         oid = self.id_entry.get().strip()
         if not oid:
             self.show_alert("Empty", "Please enter Order ID")
             return
 
+        # cheap budget check (statvfs + one db read) before the encoder starts
+        if self.spool_state == "full" or not spool.has_room(MIN_RECORD_BYTES):
+            self.show_spool_state("full")
+            self.show_alert("Storage full", "Waiting for uploads.\nCheck Wi-Fi.")
+            return
+
+        self.set_action_text("STARTING…")
+        self.camera_jobs.submit(self.begin_recording, oid, pressed_at,
+                                done=lambda ok: self.recording_started(oid, ok),
+                                error=lambda e: self.start_failed(oid, e))
+
+    def begin_recording(self, oid, pressed_at):
+        """Camera lane: files, encoders, outputs. Returns False if the camera would not record."""
+        if not self.preroll:
+            self.use_profile(quality.pick())   # with pre-roll the encoder is set up after each STOP
+        self.rec_profile = self.profile
+        size, bitrate = quality.PROFILES[self.profile]
+        lifecycle.event(oid, "record_start", live=LIVE_CONFIG, profile=self.profile,
+                        bitrate=bitrate, size=f"{size[0]}x{size[1]}")
         outfile = os.path.join(VIDEO_PATH, f"{oid}.mp4")
-        try:
-            if os.path.exists(outfile):
-                os.remove(outfile)
-        except:
-            pass
+        proxyfile = os.path.join(VIDEO_PATH, f"{oid}.proxy.mp4")
+        imagefile = os.path.join(IMAGE_PATH, f"{oid}.jpg")
+        for old in (outfile, proxyfile, imagefile):
+            try:
+                if os.path.exists(old):
+                    spool.account(-os.path.getsize(old))
+                    os.remove(old)
+            except:
+                pass
+        self.proxy_hasher = None
+        self.segments = None
+        self.preroll_seconds = 0.0
 
         if self.picam2 and H264Encoder and FfmpegOutput:
             try:
-                self.encoder = H264Encoder(bitrate=3_000_000)
-                self.output = FfmpegOutput(outfile)
-                self.picam2.switch_mode(self.video_cfg)
-                time.sleep(0.3)
-                self.picam2.start_recording(self.encoder, self.output)
+                if self.preroll:
+                    # encoder already running: the outputs get the buffered seconds, then live frames
+                    if SEGMENT_SECONDS:
+                        self.output = preroll.RawFfmpegOutput(
+                            segments.ffmpeg_target(segments.clear(oid)), VIDEO_FPS)
+                        self.segments = segments.SegmentWatcher(oid).start()
+                    else:
+                        self.output = video_output(outfile, size, burst=True)
+                elif SEGMENT_SECONDS:
+                    # rolling TS segments, uploaded while recording; a keyframe every second
+                    # lets ffmpeg cut close to SEGMENT_SECONDS
+                    self.encoder = H264Encoder(bitrate=bitrate, repeat=True, iperiod=VIDEO_FPS)
+                    self.output = FfmpegOutput(segments.ffmpeg_target(segments.clear(oid)))
+                    self.segments = segments.SegmentWatcher(oid).start()
+                else:
+                    self.encoder = H264Encoder(bitrate=bitrate, repeat=True, iperiod=VIDEO_FPS)
+                    self.output = video_output(outfile, size)
+                self.hasher = HashingOutput(
+                    on_first_frame=lambda at: self.first_frame(oid, at - pressed_at))
+                if self.preroll:
+                    self.preroll_seconds, buffered = self.preroll.attach([self.output, self.hasher])
+                    lifecycle.event(oid, "preroll", seconds=round(self.preroll_seconds, 2),
+                                    bytes=buffered)
+                elif LIVE_CONFIG:
+                    # camera already streaming the video config: just attach the encoder
+                    self.picam2.start_encoder(self.encoder, [self.output, self.hasher])
+                else:
+                    self.picam2.switch_mode(self.video_cfg)
+                    time.sleep(0.3)
+                    self.picam2.start_recording(self.encoder, [self.output, self.hasher])
             except Exception as e:
                 print("Recording start failed:", e)
-                self.show_alert("Error", "Failed to start recording")
-                return
+                lifecycle.event(oid, "record_failed", error=str(e))
+                if self.segments:
+                    self.segments.stopped.set()
+                return False
+            if PROXY_ENABLED:
+                self.start_proxy(proxyfile)
         else:
             # if camera not available, just create an empty placeholder file
             open(outfile, "wb").close()
+            self.hasher = HashingOutput()
+        return True
 
-        self.build_record_screen(oid)
-
-    def build_record_screen(self, oid):
-        for w in self.master.winfo_children():
-            w.destroy()
+    def recording_started(self, oid, ok):
+        if not ok:
+            self.set_action_text("START RECORDING")
+            self.show_alert("Error", "Failed to start recording")
+            return
+        metrics.gauge("packproof_recording", 1)
+        self.id_entry.delete(0, tk.END)     # the next order starts blank
+        self.show_record_screen(oid)
+
+    def start_failed(self, oid, exc):
+        """begin_recording raised: same as a camera that would not record."""
+        print(f"[record] {oid}: start failed: {exc}")
+        lifecycle.event(oid, "record_failed", error=str(exc))
+        self.recording_started(oid, False)
+
+    def first_frame(self, oid, latency):
+        """Encoder thread: START press to first encoded frame."""
+        print(f"[record] {oid}: first frame {latency * 1000:.0f} ms after START")
+        lifecycle.event(oid, "first_frame", latency_ms=round(latency * 1000), live=LIVE_CONFIG)
+
+    def start_proxy(self, proxyfile):
+        """Second hardware encode of the lores stream; the recording goes on without it if this fails."""
+        try:
+            self.proxy_encoder = H264Encoder(bitrate=PROXY_BITRATE, repeat=True, iperiod=VIDEO_FPS)
+            self.proxy_hasher = HashingOutput()
+            self.picam2.start_encoder(self.proxy_encoder,
+                                      [video_output(proxyfile, LORES_SIZE), self.proxy_hasher],
+                                      name="lores")
+        except Exception as e:
+            print("Proxy start failed:", e)
+            self.proxy_hasher = None
 
-        wrap = tk.Frame(self.master, bg="white", padx=28, pady=28)
+    def build_record_screen(self, screen):
+        wrap = tk.Frame(screen, bg="white", padx=28, pady=28)
         wrap.pack(fill="both", expand=True)
 
-        tk.Label(wrap, text=f"Recording: {oid}", font=("Arial", 40, "bold"), bg="white").pack(pady=10)
+        self.record_title = tk.Label(wrap, text="Recording:", font=("Arial", 40, "bold"), bg="white")
+        self.record_title.pack(pady=10)
         self.timer_label = tk.Label(wrap, text="(00:00)", font=("Arial", 36, "bold"), bg="white")
         self.timer_label.pack()
 
-        self.rec_start_time = time.time()
-        self._update_timer()
+        self.stop_button = self.big_button(wrap, "STOP RECORDING", self.stop_recording)
+        self.stop_button.pack(side="bottom", fill="x", pady=18)
 
-        self.big_button(wrap, "STOP RECORDING", self.stop_recording).pack(fill="x", pady=18)
+        # still of the label, in full main-stream resolution; the recording goes on
+        tk.Button(wrap, text="📷 CAPTURE LABEL", font=("Arial", 32, "bold"), bg="#7f8c8d", fg="white",
+                  relief="flat", command=self.capture_still).pack(side="bottom", fill="x")
+        self.still_label = tk.Label(wrap, text="", font=("Arial", 24), bg="white", fg="green")
+        self.still_label.pack(side="bottom")
+
+        # is the parcel in frame? lores picture next to the encoders, on a small CPU budget
+        self.record_preview_label = tk.Label(wrap, bg="white")
+        self.record_preview_label.pack(expand=True, fill="both")
+
+    def show_record_screen(self, oid):
+        self.raise_screen("record")
         self.current_oid = oid
+        self.record_title.config(text=f"Recording: {oid}")
+        self.still_label.config(text="")
+        self.action_button = self.stop_button
+        self.set_action_text("STOP RECORDING")
+        self.show_busy(self.camera_jobs.busy())
+
+        self.rec_start_time = time.time()
+        self._update_timer()
+        self.preview = preview.LivePreview(self.master, self.record_preview_label, self.picam2, scale=1,
+                                           budget=RECORD_PREVIEW_BUDGET,
+                                           max_fps=RECORD_PREVIEW_FPS).start()
+
+    def capture_still(self):
+        oid = self.current_oid
+        self.still_label.config(text="Capturing…", fg="black")
+        self.stills.capture(oid)
+        self.stills.then(lambda: self.master.after(0, self.still_saved, oid))
+
+    def still_saved(self, oid):
+        if self.screen != "record" or oid != self.current_oid:
+            return   # back on the home screen, or already the next order
+        ok = os.path.exists(os.path.join(IMAGE_PATH, f"{oid}.jpg"))
+        self.still_label.config(text="Label saved ✓" if ok else "Capture failed",
+                                fg="green" if ok else "red")
 
     def _update_timer(self):
-        try:
-            elapsed = int(time.time() - self.rec_start_time)
-            mm, ss = elapsed // 60, elapsed % 60
-            self.timer_label.config(text=f"({mm:02d}:{ss:02d})")
-        except:
-            pass
-        self.master.after(1000, self._update_timer)
+        elapsed = int(time.time() - self.rec_start_time)
+        mm, ss = elapsed // 60, elapsed % 60
+        self.timer_label.config(text=f"({mm:02d}:{ss:02d})")
+        self.timer_job = self.master.after(1000, self._update_timer)   # cancelled by raise_screen
 
     def stop_recording(self):
+        if self.camera_jobs.busy():
+            return
+        self.stop_preview()
+        self.set_action_text("SAVING…")
+        self.camera_jobs.submit(self.end_recording, done=lambda _: self.show_home(),
+                                error=self.stop_failed)
+
+    def stop_failed(self, exc):
+        """end_recording raised: back to the home screen, and say the order may not be saved."""
+        print(f"[record] {self.current_oid}: stop failed: {exc}")
+        lifecycle.event(self.current_oid, "record_failed", error=str(exc), stage="stop")
+        metrics.gauge("packproof_recording", 0)
+        self.show_home()
+        self.show_alert("Error", f"Saving {self.current_oid} failed.\nRecord it again.")
+
+    def end_recording(self):
+        """Camera lane: stop the encoders, account and queue the recording, re-arm the camera."""
+        # the last frame, before the encoder (or, without LIVE_CONFIG, the camera) stops;
+        # a still taken with the button is kept
+        self.stills.capture(self.current_oid, "stop", now=True, keep=True)
         try:
             if self.picam2:
-                self.picam2.stop_recording()
+                if self.preroll:
+                    self.preroll.detach()          # the encoder goes on filling the pre-roll
+                    if self.proxy_hasher:
+                        self.picam2.stop_encoder(self.proxy_encoder)
+                elif LIVE_CONFIG:
+                    self.picam2.stop_encoder()     # main + proxy; the camera keeps streaming
+                else:
+                    self.picam2.stop_recording()
         except:
             pass
+        metrics.gauge("packproof_recording", 0)
 
+        # a missing file or a failed segments.finish() raises to the lane, and stop_failed tells
+        # the operator; the camera is re-armed either way
         try:
-            add_to_upload_queue(self.current_oid)
-        except:
-            pass
+            # size of the finalized file lets the uploader spot a truncated video
+            outfile = os.path.join(VIDEO_PATH, f"{self.current_oid}.mp4")
+            proxyfile = os.path.join(VIDEO_PATH, f"{self.current_oid}.proxy.mp4")
+            proxy_hash = proxy_size = None
+            if self.proxy_hasher and os.path.exists(proxyfile):
+                proxy_hash, proxy_size = self.proxy_hasher.hexdigest(), os.path.getsize(proxyfile)
+            if self.segments:
+                # segments are queued (and counted in the spool) as they finish; add the manifest
+                content_hash, size = self.segments.finish()
+                kind = "segmented"
+                spool.account(proxy_size or 0)
+            else:
+                content_hash, size, kind = self.hasher.hexdigest(), os.path.getsize(outfile), "video"
+                spool.account(size + (proxy_size or 0))
+            seconds = time.time() - self.rec_start_time + self.preroll_seconds
+            # frames the encoder saw vs. what the sensor should have delivered
+            expected = int(seconds * VIDEO_FPS)
+            if self.picam2 and self.hasher.frames < expected * 0.98:
+                print(f"[record] {self.current_oid}: {self.hasher.frames} of ~{expected} frames encoded")
+            lifecycle.event(self.current_oid, "record_stop", bytes=size, seconds=round(seconds, 1),
+                            frames=self.hasher.frames, expected_frames=expected)
+            # queued after the still is written, so the upload carries it
+            self.stills.then(lambda oid=self.current_oid, profile=self.rec_profile: self.queue_recording(
+                oid, content_hash=content_hash, size=size, proxy_hash=proxy_hash,
+                proxy_size=proxy_size, kind=kind, profile=profile))
+            metrics.inc("packproof_recordings_total")
+            metrics.inc("packproof_recorded_bytes_total", size)
+        finally:
+            try:
+                if self.picam2 and not LIVE_CONFIG:
+                    self.picam2.switch_mode(self.preview_cfg)
+            except:
+                pass
+            if self.preroll:
+                # the always-on encoder gets the next recording's quality now
+                self.use_profile(quality.pick())
 
+    def queue_recording(self, oid, **fields):
+        """Stills worker: queue a stopped recording. The lane has returned by now, so a failure is traced here."""
         try:
-            if self.picam2:
-                self.picam2.switch_mode(self.preview_cfg)
-        except:
-            pass
-
-        self.build_home()
+            add_to_upload_queue(oid, **fields)
+        except Exception as e:
+            print(f"[record] {oid}: queueing failed: {e}")
+            lifecycle.event(oid, "record_failed", error=str(e), stage="queue")
 
     def open_keypad(self):
         if self.keypad_open:
@@ -0,0 +1,204 @@
+"""
+Health counters for uploader.py and main.py, exported for Prometheus.
+
+Each process keeps its own values in memory (inc() / gauge() where things
+happen) and calls start(job). A daemon thread then rewrites
+METRICS_DIR/<job>.prom every WRITE_INTERVAL, in the text format
+node_exporter's textfile collector reads. With serve=True (the uploader)
+the same thread also answers on METRICS_BIND:METRICS_PORT (localhost
+unless PACKPROOF_METRICS_BIND says otherwise; there is no auth):
+
+  /metrics   every .prom file in METRICS_DIR, this process's values fresh
+  /health    the same values as one JSON object
+
+Gauges that describe shared state (queue depth, spool usage) come from
+collector() functions run at write/scrape time: one indexed SQL query and
+one statvfs, never a subprocess.
+"""
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATA_DIR       = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+METRICS_DIR    = os.environ.get("PACKPROOF_METRICS_DIR", f"{DATA_DIR}/metrics")
+METRICS_PORT   = int(os.environ.get("PACKPROOF_METRICS_PORT", "9108"))   # 0 = no HTTP
+METRICS_BIND   = os.environ.get("PACKPROOF_METRICS_BIND", "127.0.0.1")    # 0.0.0.0: reachable from the LAN (no auth)
+WRITE_INTERVAL = 15
+
+# name -> (type, help)
+METRICS = {
+    "packproof_queue_pending":               ("gauge",   "Entries waiting to upload"),
+    "packproof_queue_pending_bytes":         ("gauge",   "Bytes of video waiting to upload"),
+    "packproof_uploads_total":               ("counter", "Upload attempts by result (ok, failed, skipped)"),
+    "packproof_upload_bytes_total":          ("counter", "Bytes of video and proxy uploaded"),
+    "packproof_upload_seconds_total":        ("counter", "Time spent in successful uploads"),
+    "packproof_upload_throughput_bytes":     ("gauge",   "Bytes per second of the last successful upload"),
+    "packproof_last_upload_timestamp_seconds": ("gauge", "Time of the last successful upload"),
+    "packproof_breaker_open":                ("gauge",   "1 while the upload circuit breaker is open"),
+    "packproof_spool_used_bytes":            ("gauge",   "Bytes of videos and images on the card"),
+    "packproof_spool_limit_bytes":           ("gauge",   "Spool budget (spool.limit())"),
+    "packproof_online":                      ("gauge",   "1 if connectivity.state() was online at the last check"),
+    "packproof_recording":                   ("gauge",   "1 while the recorder is recording"),
+    "packproof_spool_full":                  ("gauge",   "1 while the recorder refuses new recordings"),
+    "packproof_recordings_total":            ("counter", "Recordings queued for upload"),
+    "packproof_recorded_bytes_total":        ("counter", "Bytes of video recorded"),
+    "packproof_metrics_timestamp_seconds":   ("gauge",   "When this job's values were written"),
+}
+
+_values = {}       # (name, labels) -> value; labels is a sorted tuple of (key, value)
+_collectors = []
+_lock = threading.Lock()
+_job = None
+
+
+def _key(name, labels):
+    if name not in METRICS:
+        raise KeyError(f"unknown metric {name}")
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        k = _key(name, labels)
+        _values[k] = _values.get(k, 0) + value
+
+
+def gauge(name, value, **labels):
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def collector(fn):
+    """Register fn() -> {name: value}, called at every write/scrape. Usable as a decorator."""
+    _collectors.append(fn)
+    return fn
+
+
+def _collect():
+    for fn in _collectors:
+        try:
+            for name, value in fn().items():
+                gauge(name, value)
+        except Exception as e:
+            print(f"[metrics] collector {fn.__name__} failed: {e}")
+
+
+def render():
+    """This process's values in Prometheus text format."""
+    _collect()
+    gauge("packproof_metrics_timestamp_seconds", round(time.time(), 3))
+    with _lock:
+        items = sorted(_values.items())
+    lines, seen = [], set()
+    for (name, labels), value in items:
+        if name not in seen:
+            seen.add(name)
+            kind, text = METRICS[name]
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        labels = (("job", _job),) + labels
+        lbl = ",".join(f'{k}="{v}"' for k, v in labels)
+        lines.append(f"{name}{{{lbl}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write():
+    """Atomically replace METRICS_DIR/<job>.prom."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = f"{METRICS_DIR}/{_job}.prom"
+    with open(path + ".tmp", "w") as f:
+        f.write(render())
+    os.replace(path + ".tmp", path)
+
+
+def merge(texts):
+    """
+    Several Prometheus texts as one. Every job writes HELP/TYPE for its own
+    families, and Prometheus rejects a second TYPE line for a metric, so the
+    samples are grouped by family and each header is written once.
+    """
+    headers, samples = {}, {}
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                _, kind, name = line.split(" ", 3)[:3]
+                headers.setdefault(name, {}).setdefault(kind, line)
+            elif line and not line.startswith("#"):
+                name = line.split("{", 1)[0].split(" ", 1)[0]
+                samples.setdefault(name, []).append(line)
+    lines = []
+    for name in sorted(samples):
+        lines += [headers[name][k] for k in ("HELP", "TYPE") if k in headers.get(name, {})]
+        lines += samples[name]
+    return "\n".join(lines) + "\n"
+
+
+def scrape():
+    """This process rendered now, plus the last file written by every other job."""
+    parts = [render()]
+    try:
+        names = sorted(os.listdir(METRICS_DIR))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if name.endswith(".prom") and name != f"{_job}.prom":
+            try:
+                with open(f"{METRICS_DIR}/{name}") as f:
+                    parts.append(f.read())
+            except OSError:
+                pass
+    return merge(parts)
+
+
+def health():
+    """scrape() as {'name{labels}': value}."""
+    out = {}
+    for line in scrape().splitlines():
+        if line and not line.startswith("#"):
+            key, _, value = line.rpartition(" ")
+            out[key] = float(value)
+    return out
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body, ctype = scrape().encode(), "text/plain; version=0.0.4"
+        elif self.path.startswith("/health"):
+            body, ctype = json.dumps(health(), indent=1).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(job, serve=False):
+    """Start the textfile writer for `job` (and the HTTP endpoint if serve and METRICS_PORT)."""
+    global _job
+    _job = job
+
+    def writer():
+        while True:
+            try:
+                write()
+            except Exception as e:
+                print(f"[metrics] write failed: {e}")
+            time.sleep(WRITE_INTERVAL)
+    threading.Thread(target=writer, daemon=True).start()
+
+    if serve and METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer((METRICS_BIND, METRICS_PORT), _Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            print(f"[metrics] Serving on {METRICS_BIND}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"[metrics] Port {METRICS_PORT} unavailable: {e}")
@@ -0,0 +1,200 @@
+"""
+In-process MP4 muxer for the H.264 encoder's output (replaces one ffmpeg
+process per recording).
+
+Mp4Output is a picamera2 Output. It writes fragmented MP4:
+
+  ftyp moov            written at the first keyframe (SPS/PPS come with it)
+  moof mdat            one fragment per FRAGMENT_FRAMES frames or keyframe
+  ...
+
+Everything in the file is final once written, so nothing has to be patched
+or moved at the end. If the recorder dies or the power goes, the file plays
+up to the last fragment written. At stop the fragment duration in mvex/mehd
+is filled in for players that show a length up front, and the file is
+fsynced.
+
+Sample times come from the encoder's timestamps (microseconds, sensor
+time), so frames that arrive in a burst (pre-roll) or late (a dropped
+frame) still play at the moment they were captured. The encoder sends
+Annex B (start codes). Samples are stored with 4-byte lengths, and SPS/PPS
+go only into avcC.
+"""
+import os
+import struct
+
+try:
+    from picamera2.outputs import Output
+except Exception:
+    Output = object
+
+TIMESCALE       = 90_000       # track ticks per second
+FRAGMENT_FRAMES = 30           # a fragment at least this often (and at every keyframe)
+
+NAL_SLICE, NAL_IDR, NAL_SPS, NAL_PPS, NAL_AUD = 1, 5, 7, 8, 9
+
+SYNC_SAMPLE     = 0x02000000   # depends on no other sample
+NON_SYNC_SAMPLE = 0x01010000   # depends on others, not a sync sample
+
+MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+def nal_units(data):
+    """Split an Annex B buffer into NAL units (without start codes)."""
+    units = []
+    for part in bytes(data).split(b"\x00\x00\x01"):
+        part = part.rstrip(b"\x00")     # 4-byte start codes and trailing zero bytes
+        if part:
+            units.append(part)
+    return units
+
+
+def box(kind, *payload):
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def full_box(kind, version, flags, *payload):
+    return box(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+def init_segment(sps, pps, width, height):
+    """ftyp + moov for one H.264 track; returns (bytes, offset of the mehd duration)."""
+    ftyp = box(b"ftyp", b"isom", struct.pack(">I", 0x200), b"isomiso5iso6avc1mp41")
+    avcc = box(b"avcC", bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]),
+               struct.pack(">H", len(sps)), sps, b"\x01", struct.pack(">H", len(pps)), pps)
+    avc1 = box(b"avc1", bytes(6), struct.pack(">H", 1), bytes(16),
+               struct.pack(">HHIIIH", width, height, 0x480000, 0x480000, 0, 1),
+               bytes(32), struct.pack(">Hh", 0x18, -1), avcc)
+    stbl = box(b"stbl",
+               full_box(b"stsd", 0, 0, struct.pack(">I", 1), avc1),
+               full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+               full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+               full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+               full_box(b"stco", 0, 0, struct.pack(">I", 0)))
+    minf = box(b"minf",
+               full_box(b"vmhd", 0, 1, bytes(8)),
+               box(b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1))),
+               stbl)
+    mdia = box(b"mdia",
+               full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, TIMESCALE, 0, 0x55C4, 0)),  # "und"
+               full_box(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"vide"), bytes(12), b"VideoHandler\x00"),
+               minf)
+    tkhd = full_box(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, 1, 0, 0), bytes(8),
+                    struct.pack(">hhhH", 0, 0, 0, 0), MATRIX,
+                    struct.pack(">II", width << 16, height << 16))
+    mvhd = full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, TIMESCALE, 0),
+                    struct.pack(">IH", 0x10000, 0x100), bytes(10), MATRIX, bytes(24),
+                    struct.pack(">I", 2))
+    mehd = full_box(b"mehd", 1, 0, struct.pack(">Q", 0))
+    trex = full_box(b"trex", 0, 0, struct.pack(">IIIII", 1, 1, 0, 0, 0))
+    moov = box(b"moov", mvhd, box(b"trak", tkhd, mdia), box(b"mvex", mehd, trex))
+    # mehd's 8-byte duration is the last field before trex
+    return ftyp + moov, len(ftyp) + len(moov) - len(trex) - 8
+
+
+def fragment(sequence, decode_time, samples):
+    """moof + mdat for samples [(data, duration, keyframe), ...]."""
+    entries = b"".join(struct.pack(">III", d, len(s), SYNC_SAMPLE if k else NON_SYNC_SAMPLE)
+                       for s, d, k in samples)
+
+    def moof(data_offset):
+        trun = full_box(b"trun", 0, 0x000701, struct.pack(">Ii", len(samples), data_offset), entries)
+        traf = box(b"traf",
+                   full_box(b"tfhd", 0, 0x020000, struct.pack(">I", 1)),    # default-base-is-moof
+                   full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time)),
+                   trun)
+        return box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", sequence)), traf)
+
+    size = len(moof(0))
+    mdat = b"".join(s for s, _, _ in samples)
+    return moof(size + 8) + struct.pack(">I4s", 8 + len(mdat), b"mdat") + mdat
+
+
+class Mp4Output(Output):
+    """
+    Encoder output writing `path` as fragmented MP4. outputframe() runs on
+    the encoder thread; start()/stop() on the caller's.
+    """
+    def __init__(self, path, size, fps=30):
+        super().__init__()
+        self.path = path
+        self.width, self.height = size
+        self.frame_ticks = TIMESCALE // fps   # duration of the last frame, and of frames without timestamps
+        self.file = None
+        self.mehd_at = None
+        self.pending = []            # [(data, timestamp_us, keyframe)] of the fragment being built
+        self.first_ts = None
+        self.last_ts = None
+        self.decode_time = 0         # ticks up to the start of the pending fragment
+        self.sequence = 0
+        self.frames = 0
+        self.skipped = 0             # frames before the first keyframe
+
+    def start(self):
+        self.file = open(self.path, "wb")
+        if Output is not object:
+            super().start()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if self.file is None:
+            return
+        if timestamp is None:
+            timestamp = (self.last_ts or 0) + self.frame_ticks * 1_000_000 // TIMESCALE
+        units = nal_units(frame)
+        if self.mehd_at is None:
+            sps = next((u for u in units if u[0] & 0x1F == NAL_SPS), None)
+            pps = next((u for u in units if u[0] & 0x1F == NAL_PPS), None)
+            if not (keyframe and sps and pps):
+                self.skipped += 1
+                return
+            header, self.mehd_at = init_segment(sps, pps, self.width, self.height)
+            self.file.write(header)
+            self.file.flush()
+            self.first_ts = timestamp
+        if self.pending and (keyframe or len(self.pending) >= FRAGMENT_FRAMES):
+            self.flush(timestamp)
+        sample = b"".join(struct.pack(">I", len(u)) + u for u in units
+                          if u[0] & 0x1F not in (NAL_SPS, NAL_PPS, NAL_AUD))
+        self.pending.append((sample, timestamp, keyframe))
+        self.last_ts = timestamp
+        self.frames += 1
+
+    def ticks(self, timestamp):
+        return round((timestamp - self.first_ts) * TIMESCALE / 1_000_000)
+
+    def flush(self, next_ts=None):
+        """Write the pending frames as one fragment. Each frame lasts until the next one."""
+        if not self.pending:
+            return
+        ends = [self.ticks(ts) for _, ts, _ in self.pending[1:]]
+        ends.append(self.ticks(next_ts) if next_ts is not None
+                    else self.ticks(self.pending[-1][1]) + self.frame_ticks)
+        samples, start = [], self.decode_time
+        for (data, _, key), end in zip(self.pending, ends):
+            samples.append((data, max(1, end - start), key))
+            start += samples[-1][1]
+        self.sequence += 1
+        self.file.write(fragment(self.sequence, self.decode_time, samples))
+        self.file.flush()
+        self.decode_time = start
+        self.pending = []
+
+    def stop(self):
+        if self.file is None:
+            return
+        try:
+            self.flush()
+            if self.mehd_at is not None:
+                self.file.seek(self.mehd_at)
+                self.file.write(struct.pack(">Q", self.decode_time))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+            self.file = None
+        if Output is not object:
+            super().stop()
+
+    def duration(self):
+        return self.decode_time / TIMESCALE
@@ -0,0 +1,118 @@
+"""
+Pre-roll: the seconds before START RECORDING, kept in memory.
+
+With PACKPROOF_LIVE_CONFIG=1 the camera streams the video configuration all
+the time. main.py attaches one H.264 encoder to it at startup, with
+PrerollOutput as its only output. PrerollOutput keeps the last
+PREROLL_SECONDS of encoded frames in whole GOPs (keyframe to keyframe, one
+per second), never more than PREROLL_MAX_BYTES. At START, attach() hands
+the buffered frames to the recording's outputs and then passes every
+new frame straight through. At STOP, detach() takes the outputs off again.
+The encoder keeps running, and there is never a second encode.
+
+The buffered frames reach the outputs in one burst. mp4mux.Mp4Output
+copes, because it uses the encoder's timestamps. With ffmpeg (segmented
+recording, PACKPROOF_MUXER=ffmpeg) the wall-clock timestamps FfmpegOutput
+uses would squeeze the frames together. RawFfmpegOutput therefore feeds
+ffmpeg raw H.264 at the fixed VIDEO_FPS instead.
+"""
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+
+try:
+    from picamera2.outputs import FfmpegOutput, Output
+except Exception:
+    FfmpegOutput = None
+    Output = object
+
+PREROLL_SECONDS   = float(os.environ.get("PACKPROOF_PREROLL_SECONDS", "3"))    # 0 = off
+PREROLL_MAX_BYTES = int(float(os.environ.get("PACKPROOF_PREROLL_MAX_MB", "4")) * 1024 * 1024)
+
+
+class PrerollOutput(Output):
+    """
+    Ring buffer of encoded frames in front of the recording's outputs.
+    outputframe() runs on the encoder thread; attach()/detach() on the Tk thread.
+    """
+    def __init__(self, seconds=PREROLL_SECONDS, max_bytes=PREROLL_MAX_BYTES):
+        super().__init__()
+        self.span = int(seconds * 1_000_000)        # encoder timestamps are microseconds
+        self.max_bytes = max_bytes
+        self.gops = deque()        # [[(frame, keyframe, timestamp), ...], ...], each starting at a keyframe
+        self.bytes = 0
+        self.sinks = []
+        self.lock = threading.Lock()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if timestamp is None:
+            timestamp = int(time.monotonic() * 1_000_000)
+        with self.lock:
+            for sink in self.sinks:
+                sink.outputframe(frame, keyframe, timestamp)
+            if self.sinks:
+                return
+            if keyframe:
+                self.gops.append([])
+            elif not self.gops:
+                return                   # can't decode without the keyframe before it
+            if not isinstance(frame, bytes):
+                frame = bytes(frame)     # the encoder may reuse its buffer
+            self.gops[-1].append((frame, keyframe, timestamp))
+            self.bytes += len(frame)
+            # drop the oldest GOP while the rest still covers `span`, or the cap is exceeded
+            while len(self.gops) > 1 and (timestamp - self.gops[1][0][2] >= self.span
+                                          or self.bytes > self.max_bytes):
+                self.bytes -= sum(len(f[0]) for f in self.gops.popleft())
+            if self.bytes > self.max_bytes:
+                self.gops.clear()        # one GOP over the cap: start again at the next keyframe
+                self.bytes = 0
+
+    def buffered_seconds(self):
+        with self.lock:
+            if not self.gops:
+                return 0.0
+            return (self.gops[-1][-1][2] - self.gops[0][0][2]) / 1_000_000
+
+    def attach(self, sinks):
+        """
+        Start `sinks`, write the buffered frames to them and from then on
+        every new frame. Returns (seconds, bytes) of pre-roll written.
+        """
+        for sink in sinks:
+            sink.start()
+        with self.lock:
+            frames = [f for gop in self.gops for f in gop]
+            for frame, keyframe, timestamp in frames:
+                for sink in sinks:
+                    sink.outputframe(frame, keyframe, timestamp)
+            seconds = (frames[-1][2] - frames[0][2]) / 1_000_000 if frames else 0.0
+            written = self.bytes
+            self.gops.clear()
+            self.bytes = 0
+            self.sinks = list(sinks)
+        return seconds, written
+
+    def detach(self):
+        """Stop the sinks. Buffering starts again at the next keyframe, so the next
+        recording's pre-roll never shows this one."""
+        with self.lock:
+            sinks, self.sinks = self.sinks, []
+        for sink in sinks:
+            sink.stop()
+
+
+class RawFfmpegOutput(FfmpegOutput or object):
+    """FfmpegOutput that timestamps frames by count (VIDEO_FPS) instead of by arrival."""
+    def __init__(self, output_filename, fps):
+        super().__init__(output_filename)
+        self.fps = fps
+
+    def start(self):
+        cmd = (["ffmpeg", "-loglevel", "warning", "-y",
+                "-f", "h264", "-framerate", str(self.fps), "-i", "-", "-c:v", "copy"]
+               + self.output_filename.split())
+        self.ffmpeg = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        Output.start(self)
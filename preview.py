@@ -0,0 +1,193 @@
+"""
+Camera preview for the Tk UI, cheap enough for a Pi Zero 2 W.
+
+  - frames come from the small lores stream (LORES_SIZE), captured and
+    converted on a worker thread, never on the Tk thread
+  - the worker only fetches a frame when the UI asks for one, and the UI
+    drops a frame that has waited longer than STALE_AFTER (Tk was busy), so
+    nothing is converted just to be thrown away and the picture is never behind
+  - one ImageTk.PhotoImage is created and then updated in place with paste()
+  - the frame interval follows the measured cost of a frame (convert + draw)
+    so the preview stays within `budget` of one core, and never goes above
+    max_fps
+  - the worker thread runs at nice WORKER_NICE, so while recording the
+    camera and encoder threads always get the CPU first
+
+Tap the picture (or set PACKPROOF_PREVIEW_DEBUG=1) for an overlay with the
+achieved fps and the CPU time per frame.
+"""
+import os
+import time
+import threading
+import tkinter as tk
+
+from PIL import Image, ImageTk
+
+import util
+
+try:
+    import cv2     # YUV420 -> RGB in C; without it the preview is greyscale
+except Exception:
+    cv2 = None
+
+LORES_SIZE    = (320, 240)
+SCALE         = 2              # drawn at 2x with nearest-neighbour scaling
+MIN_INTERVAL  = 0              # ms between painting a frame and asking for the next
+MAX_INTERVAL  = 500
+POLL_MS       = 10             # how often the Tk thread looks for the requested frame
+STALE_AFTER   = 0.2            # seconds a captured frame may wait before it is dropped
+DEFAULT_BUDGET = 0.25          # share of one core the preview may use
+WORKER_NICE   = 10
+DEBUG         = os.environ.get("PACKPROOF_PREVIEW_DEBUG", "0") == "1"
+
+
+def to_image(array, stream, size):
+    """Camera array -> PIL image. lores is YUV420 (Y plane first); main is XRGB8888."""
+    if stream == "lores":
+        w, h = size
+        if cv2 is not None:
+            return Image.fromarray(cv2.cvtColor(array, cv2.COLOR_YUV420p2RGB))
+        return Image.fromarray(array[:h, :w])
+    return Image.fromarray(array[..., 2::-1])
+
+
+class LivePreview:
+    """
+    Paints `stream` from picam2 into `label` until stop(). Only the worker
+    thread talks to the camera; only the Tk thread touches widgets.
+    """
+    def __init__(self, master, label, picam2, stream="lores", size=LORES_SIZE,
+                 budget=DEFAULT_BUDGET, scale=SCALE, max_fps=None):
+        self.master = master
+        self.label = label
+        self.picam2 = picam2
+        self.stream = stream
+        self.size = size
+        self.scale = scale
+        self.budget = budget
+        self.min_interval = int(1000 / max_fps) if max_fps else MIN_INTERVAL
+        self.interval = self.min_interval
+        self.photo = None
+        self.running = False
+
+        self.lock = threading.Lock()
+        self.want = threading.Event()
+        self.latest = None             # (captured_at, image, convert_cpu_seconds)
+
+        # stats for the overlay, reset every second
+        self.cost = 0.0                # smoothed CPU seconds per frame
+        self.frames = 0
+        self.dropped = 0
+        self.cpu_sum = 0.0
+        self.window_start = time.perf_counter()
+        self.overlay = None
+        self.label.bind("<Button-1>", lambda e: self.toggle_overlay())
+        if DEBUG:
+            self.toggle_overlay()
+
+    # ---------- worker thread ----------
+    def worker(self):
+        util.lower_thread_priority(WORKER_NICE)
+        while self.running:
+            if not self.want.wait(0.5):
+                continue
+            self.want.clear()
+            try:
+                array = self.picam2.capture_array(self.stream)
+                t0 = time.thread_time()
+                img = to_image(array, self.stream, self.size)
+                if self.scale != 1:
+                    img = img.resize((img.width * self.scale, img.height * self.scale), Image.NEAREST)
+                convert = time.thread_time() - t0
+            except Exception as e:
+                print("[preview] capture failed:", e)
+                time.sleep(0.5)
+                self.want.set()
+                continue
+            with self.lock:
+                self.latest = (time.perf_counter(), img, convert)
+
+    # ---------- Tk thread ----------
+    def start(self):
+        if self.running or not self.picam2:
+            return self
+        self.running = True
+        threading.Thread(target=self.worker, daemon=True).start()
+        self.request()
+        return self
+
+    def stop(self):
+        """Stop painting and blank the label, which its screen keeps for the next preview."""
+        self.running = False
+        self.want.set()
+        try:
+            if self.overlay is not None:
+                self.overlay.destroy()
+            self.label.config(image="")
+        except tk.TclError:
+            pass
+        self.overlay = None
+
+    def request(self):
+        """Ask the worker for one fresh frame, then wait for it."""
+        if self.running:
+            self.want.set()
+            self.master.after(POLL_MS, self.tick)
+
+    def tick(self):
+        if not self.running:
+            return
+        with self.lock:
+            item, self.latest = self.latest, None
+        if not item:
+            self.master.after(POLL_MS, self.tick)
+            return
+        captured_at, img, convert = item
+        if time.perf_counter() - captured_at > STALE_AFTER:
+            self.dropped += 1              # Tk was busy; fetch a fresh one right away
+            self.request()
+            return
+        self.paint(img, convert)
+        self.master.after(self.interval, self.request)
+
+    def paint(self, img, convert):
+        t0 = time.thread_time()
+        try:
+            if self.photo is None or (self.photo.width(), self.photo.height()) != img.size:
+                self.photo = ImageTk.PhotoImage(img)
+                self.label.config(image=self.photo)
+            else:
+                self.photo.paste(img)      # same Tk image, new pixels: no widget reconfigure
+        except tk.TclError:
+            self.stop()                    # label was destroyed with its screen
+            return
+        cost = convert + time.thread_time() - t0
+
+        # fps follows cost: a frame costing c may come every c / budget seconds
+        self.cost = cost if not self.cost else 0.8 * self.cost + 0.2 * cost
+        gap = 1000 * self.cost / self.budget - 1000 * self.cost
+        self.interval = int(min(MAX_INTERVAL, max(self.min_interval, gap)))
+
+        self.frames += 1
+        self.cpu_sum += cost
+        now = time.perf_counter()
+        if now - self.window_start >= 1.0:
+            self.update_overlay(self.frames / (now - self.window_start), self.cpu_sum / self.frames)
+            self.frames, self.dropped, self.cpu_sum, self.window_start = 0, 0, 0.0, now
+
+    def toggle_overlay(self):
+        if self.overlay is None:
+            self.overlay = tk.Label(self.label, text="…", font=("Arial", 18, "bold"),
+                                    bg="black", fg="lime")
+            self.overlay.place(x=8, y=8)
+        else:
+            self.overlay.destroy()
+            self.overlay = None
+
+    def update_overlay(self, fps, cpu):
+        if self.overlay is not None:
+            try:
+                self.overlay.config(text=f"{fps:.1f} fps  cpu {cpu * 1000:.1f} ms/frame  "
+                                         f"every {self.interval} ms  dropped {self.dropped}")
+            except tk.TclError:
+                self.overlay = None
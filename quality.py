@@ -0,0 +1,99 @@
+"""
+Recording quality: which resolution and bitrate the next recording gets.
+
+choose() takes the highest profile between QUALITY_FLOOR and QUALITY_CEILING
+that the kiosk can afford:
+
+  uplink   the pending bytes plus one typical recording at that bitrate
+           upload within MAX_BACKLOG at the measured upload throughput
+  spool    the free spool holds SPOOL_HOURS of recording at that bitrate
+
+Going up a level needs UPGRADE_MARGIN of headroom, so a profile does not
+flip back and forth between recordings. Going down needs none.
+
+The uploader stores an average of its upload throughput in the queue
+database (record_throughput). main.py calls pick() and puts the chosen
+profile in the order's record_start event and queue row.
+"""
+import os
+import time
+
+import queue_db
+import spool
+
+# name -> (main stream size, H.264 bitrate), lowest first
+PROFILES = {
+    "low":      ((640, 480), 1_000_000),
+    "reduced":  ((640, 480), 2_000_000),
+    "standard": ((640, 480), 3_000_000),
+    "high":     ((1280, 720), 5_000_000),
+}
+LEVELS = list(PROFILES)
+
+QUALITY_FLOOR   = os.environ.get("PACKPROOF_QUALITY_FLOOR", "low")
+QUALITY_CEILING = os.environ.get("PACKPROOF_QUALITY_CEILING", "standard")
+
+MAX_BACKLOG    = 2 * 3600       # seconds the uplink may need for the queue
+RECORDING_SECS = 120            # a typical recording
+SPOOL_HOURS    = 4
+UPGRADE_MARGIN = 1.5
+
+THROUGHPUT_KEY     = "upload_bps"
+PROFILE_KEY        = "quality_profile"
+THROUGHPUT_ALPHA   = 0.3        # weight of the newest upload in the average
+THROUGHPUT_MIN_BYTES = 256 * 1024          # smaller uploads measure latency, not bandwidth
+THROUGHPUT_MAX_AGE = 24 * 3600  # older than this: unknown
+
+
+def record_throughput(size, seconds):
+    """Uploader, after a successful upload: fold its bytes/second into the average."""
+    if size < THROUGHPUT_MIN_BYTES or seconds <= 0:
+        return
+    rate = size / seconds
+    old = throughput()
+    if old:
+        rate = THROUGHPUT_ALPHA * rate + (1 - THROUGHPUT_ALPHA) * old
+    queue_db.meta_set(THROUGHPUT_KEY, f"{rate:.0f} {time.time():.0f}")
+
+
+def throughput():
+    """Average upload bytes/second, or None if nothing was measured lately."""
+    value = queue_db.meta_get(THROUGHPUT_KEY)
+    if not value:
+        return None
+    rate, at = value.split()
+    if time.time() - float(at) > THROUGHPUT_MAX_AGE:
+        return None
+    return float(rate)
+
+
+def choose(upload_bps, pending_bytes, free_bytes, current=None,
+           floor=QUALITY_FLOOR, ceiling=QUALITY_CEILING):
+    """Returns (profile name, reason it is not higher)."""
+    lo, hi = LEVELS.index(floor), LEVELS.index(ceiling)
+    cur = LEVELS.index(current) if current in PROFILES else hi
+    reason = "ceiling"
+    for i in range(hi, lo - 1, -1):
+        rate = PROFILES[LEVELS[i]][1] / 8
+        margin = UPGRADE_MARGIN if i > cur else 1.0
+        if free_bytes < rate * SPOOL_HOURS * 3600 * margin:
+            reason = "spool"
+        elif upload_bps and (pending_bytes + rate * RECORDING_SECS) * margin > upload_bps * MAX_BACKLOG:
+            reason = "uplink"
+        else:
+            return LEVELS[i], reason
+    return LEVELS[lo], reason
+
+
+def pick():
+    """Profile for the next recording from the current uplink, queue and spool."""
+    upload_bps = throughput()
+    _, pending_bytes = queue_db.pending_stats()
+    used = spool.used_bytes()
+    free = max(0, spool.limit(used) - used)
+    name, reason = choose(upload_bps, pending_bytes, free, queue_db.meta_get(PROFILE_KEY))
+    if name != queue_db.meta_get(PROFILE_KEY):
+        print(f"[quality] {name} ({reason}: uplink {(upload_bps or 0) * 8 / 1e6:.1f} Mbit/s, "
+              f"{pending_bytes >> 20} MB pending, {free >> 20} MB spool free)")
+        queue_db.meta_set(PROFILE_KEY, name)
+    return name
@@ -0,0 +1,436 @@
+"""
+Upload queue shared by main.py (recorder) and uploader.py.
+
+SQLite in WAL mode, so both processes can read and write without losing
+each other's updates. Every state change is one indexed row update; old
+uploaded rows are moved out by compact().
+
+Entries are returned as dicts with the order id under "id", the same shape
+the old upload_log.json entries had.
+
+notify() / listen() / wait() are the wake-up channel from the recorder to
+the uploader: a Unix datagram socket, so the uploader can sleep in
+select() until there is work instead of polling the database.
+"""
+import os
+import json
+import time
+import select
+import socket
+import sqlite3
+import threading
+
+DATA_DIR     = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+DB_FILE      = f"{DATA_DIR}/upload_queue.db"
+LOG_FILE     = f"{DATA_DIR}/upload_log.json"     # legacy queue, migrated once
+ARCHIVE_FILE = f"{DATA_DIR}/upload_archive.log"
+NOTIFY_SOCK  = f"{DATA_DIR}/uploader.sock"
+
+ARCHIVE_AFTER_DAYS = 30
+
+# column -> declaration; columns missing from an older database are added on open
+COLUMNS = {
+    "seq":         "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "order_id":    "TEXT NOT NULL",
+    "state":       "TEXT NOT NULL DEFAULT 'pending'",   # pending | uploaded
+    "created_at":  "REAL",
+    "updated_at":  "REAL",
+    "uploaded_at": "REAL",
+    "upload_id":   "TEXT",
+    "offset":      "INTEGER NOT NULL DEFAULT 0",
+    "attempts":    "INTEGER NOT NULL DEFAULT 0",
+    "next_attempt_at": "REAL NOT NULL DEFAULT 0",
+    "last_error":  "TEXT",
+    "last_attempt_at": "REAL",
+    "content_hash": "TEXT",     # sha256 of the encoded stream, computed while recording
+    "size":        "INTEGER",   # bytes of the finished video file
+    "lease_until": "REAL NOT NULL DEFAULT 0",     # uploader or spool is working on the files
+    "lease_owner": "TEXT",
+    "kept":        "INTEGER NOT NULL DEFAULT 0",  # uploaded, files still on disk (retention)
+    "downscaled":  "INTEGER NOT NULL DEFAULT 0",
+    # low-bitrate proxy, uploaded before the full video: NULL (none) | pending | uploaded
+    "proxy_state": "TEXT",
+    "proxy_hash":  "TEXT",
+    "proxy_size":  "INTEGER",
+    # upload order (schedule.order_by): higher priority first, deadline as epoch seconds
+    "priority":    "INTEGER NOT NULL DEFAULT 0",
+    "deadline":    "REAL",
+    # segmented recordings: one "segment" row per finished segment (order_id
+    # "<order>#<index>", parent = order) and one "segmented" row for the
+    # order itself, due once all its segments are uploaded
+    "kind":        "TEXT NOT NULL DEFAULT 'video'",   # video | segment | segmented
+    "parent":      "TEXT",
+    "seg_index":   "INTEGER",
+    "profile":     "TEXT",      # recording quality (quality.PROFILES)
+}
+
+INDEXES = [
+    # at most one pending row per order; makes enqueue's duplicate check an index probe
+    "CREATE UNIQUE INDEX IF NOT EXISTS queue_pending_order ON queue(order_id) WHERE state = 'pending'",
+    "CREATE INDEX IF NOT EXISTS queue_order ON queue(order_id)",
+    "CREATE INDEX IF NOT EXISTS queue_state ON queue(state, seq)",
+    "CREATE INDEX IF NOT EXISTS queue_due ON queue(state, next_attempt_at)",
+    "CREATE INDEX IF NOT EXISTS queue_parent ON queue(parent, state)",
+]
+
+# a segmented order waits for its segments (its proxy may go ahead)
+_NOT_WAITING = ("NOT (kind = 'segmented' AND proxy_state IS NOT 'pending' AND EXISTS "
+                "(SELECT 1 FROM queue s WHERE s.parent = queue.order_id AND s.state = 'pending'))")
+
+_local = threading.local()
+
+
+def connect():
+    """Per-thread connection (sqlite3 connections must not be shared between threads)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(DB_FILE, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _ensure_schema(conn)
+        _local.conn = conn
+    return conn
+
+
+def _ensure_schema(conn):
+    cols = ", ".join(f'"{name}" {decl}' for name, decl in COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS queue ({cols})")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    have = {r["name"] for r in conn.execute("PRAGMA table_info(queue)")}
+    for name, decl in COLUMNS.items():
+        if name not in have:
+            conn.execute(f'ALTER TABLE queue ADD COLUMN "{name}" {decl}')
+    for sql in INDEXES:
+        conn.execute(sql)
+    _migrate_json(conn)
+
+
+def _migrate_json(conn):
+    """One-time import of upload_log.json; the file is renamed afterwards."""
+    if not os.path.exists(LOG_FILE):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            conn.execute("COMMIT")
+            return
+        try:
+            with open(LOG_FILE, "r") as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+        now = time.time()
+        for state in ("uploaded", "pending"):
+            for e in data.get(state, []):
+                if not e.get("id"):
+                    continue
+                conn.execute(
+                    "INSERT OR IGNORE INTO queue (order_id, state, created_at, updated_at, "
+                    "uploaded_at, upload_id, \"offset\") VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (e["id"], state, now, now, now if state == "uploaded" else None,
+                     e.get("upload_id"), e.get("offset", 0)))
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    os.replace(LOG_FILE, LOG_FILE + ".migrated")
+    print(f"[queue] Migrated {LOG_FILE} to {DB_FILE}")
+
+
+def _entry(row):
+    e = dict(row)
+    e["id"] = e.pop("order_id")
+    return e
+
+
+def enqueue(order_id, content_hash=None, size=None, proxy_hash=None, proxy_size=None,
+            kind="video", profile=None):
+    """
+    Add order_id as pending, with its proxy pending too if one was recorded.
+    Returns False if it is already pending; a re-recording with a new hash
+    then replaces the old one and drops its half-finished upload session.
+    """
+    now = time.time()
+    proxy_state = "pending" if proxy_size else None
+    conn = connect()
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO queue (order_id, state, created_at, updated_at, content_hash, size, "
+        "proxy_state, proxy_hash, proxy_size, kind, profile) "
+        "VALUES (?, 'pending', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (order_id, now, now, content_hash, size, proxy_state, proxy_hash, proxy_size, kind, profile))
+    if cur.rowcount == 1:
+        return True
+    if content_hash:
+        conn.execute(
+            "UPDATE queue SET content_hash = ?, size = ?, upload_id = NULL, \"offset\" = 0, "
+            "proxy_state = ?, proxy_hash = ?, proxy_size = ?, kind = ?, profile = ?, updated_at = ? "
+            "WHERE order_id = ? AND state = 'pending' AND content_hash IS NOT ?",
+            (content_hash, size, proxy_state, proxy_hash, proxy_size, kind, profile, now, order_id,
+             content_hash))
+    return False
+
+
+def segment_id(order_id, index):
+    return f"{order_id}#{index:05d}"
+
+
+def enqueue_segment(order_id, index, content_hash, size):
+    """Queue one finished segment of a recording that is still going on."""
+    now = time.time()
+    cur = connect().execute(
+        "INSERT OR IGNORE INTO queue (order_id, state, created_at, updated_at, content_hash, size, "
+        "kind, parent, seg_index) VALUES (?, 'pending', ?, ?, ?, ?, 'segment', ?, ?)",
+        (segment_id(order_id, index), now, now, content_hash, size, order_id, index))
+    return cur.rowcount == 1
+
+
+def drop_segments(order_id):
+    """Forget pending segments of order_id (it is being recorded again)."""
+    connect().execute("DELETE FROM queue WHERE parent = ? AND state = 'pending'", (order_id,))
+
+
+def pending():
+    """Pending entries in the order they were queued."""
+    rows = connect().execute("SELECT * FROM queue WHERE state = 'pending' ORDER BY seq")
+    return [_entry(r) for r in rows]
+
+
+def pending_stats():
+    """(orders, bytes) still to upload; bytes count full videos and segments, not proxies."""
+    row = connect().execute(
+        "SELECT COALESCE(SUM(kind != 'segment'), 0) AS n, "
+        "COALESCE(SUM(CASE WHEN kind != 'segmented' THEN size END), 0) AS b "
+        "FROM queue WHERE state = 'pending'").fetchone()
+    return row["n"], row["b"]
+
+
+def due(now, limit=None, order_by=None):
+    """
+    Pending entries whose backoff has expired, sorted by order_by (see
+    schedule.order_by). The default sends entries with a proxy still to send
+    first, then fewest attempts, then queue order.
+    """
+    order_by = order_by or "proxy_state IS 'pending' DESC, attempts, seq"
+    sql = ("SELECT * FROM queue WHERE state = 'pending' AND next_attempt_at <= ? "
+           f"AND lease_until <= ? AND {_NOT_WAITING} ORDER BY {order_by}")
+    args = (now, now)
+    if limit is not None:
+        sql += " LIMIT ?"
+        args += (limit,)
+    return [_entry(r) for r in connect().execute(sql, args)]
+
+
+def next_due(exclude=()):
+    """
+    Earliest next_attempt_at over pending entries not in exclude, or None if
+    there are none. A segmented order still waiting for segments has no time
+    of its own; the segment upload that finishes last wakes the uploader.
+    """
+    exclude = list(exclude)
+    marks = ", ".join("?" * len(exclude))
+    row = connect().execute(
+        "SELECT MIN(MAX(next_attempt_at, lease_until)) AS t FROM queue WHERE state = 'pending' "
+        f"AND order_id NOT IN ({marks}) AND {_NOT_WAITING}", exclude).fetchone()
+    return row["t"]
+
+
+def record_failure(order_id, attempts, retry_at, error=None):
+    update(order_id, attempts=attempts, next_attempt_at=retry_at, last_error=error)
+
+
+def get(order_id):
+    """Latest entry for order_id, or None."""
+    row = connect().execute(
+        "SELECT * FROM queue WHERE order_id = ? ORDER BY seq DESC LIMIT 1", (order_id,)).fetchone()
+    return _entry(row) if row else None
+
+
+def update(order_id, **fields):
+    """Set columns on the pending entry for order_id."""
+    if not fields:
+        return
+    fields["updated_at"] = time.time()
+    cols = ", ".join(f'"{k}" = ?' for k in fields)
+    connect().execute(f"UPDATE queue SET {cols} WHERE order_id = ? AND state = 'pending'",
+                      (*fields.values(), order_id))
+
+
+def prioritize(order_id, priority=1, deadline=None):
+    """Move a pending entry up the upload order. False if order_id is not pending."""
+    cur = connect().execute(
+        "UPDATE queue SET priority = ?, deadline = ?, updated_at = ? "
+        "WHERE order_id = ? AND state = 'pending'", (priority, deadline, time.time(), order_id))
+    return cur.rowcount == 1
+
+
+def mark_uploaded(order_id, kept=False):
+    """
+    Move order_id from pending to uploaded. True only for the call that made
+    the change. kept=True records that its files stay on disk for retention.
+    """
+    now = time.time()
+    cur = connect().execute(
+        "UPDATE queue SET state = 'uploaded', uploaded_at = ?, updated_at = ?, kept = ?, "
+        "lease_until = 0 WHERE order_id = ? AND state = 'pending'",
+        (now, now, int(kept), order_id))
+    return cur.rowcount == 1
+
+
+def claim(order_id, seconds, owner):
+    """Lease a pending entry's files for `seconds`. False if someone else holds the lease."""
+    now = time.time()
+    cur = connect().execute(
+        "UPDATE queue SET lease_until = ?, lease_owner = ? WHERE order_id = ? "
+        "AND state = 'pending' AND lease_until <= ?", (now + seconds, owner, order_id, now))
+    return cur.rowcount == 1
+
+
+def release(order_id):
+    connect().execute("UPDATE queue SET lease_until = 0 WHERE order_id = ? AND state = 'pending'",
+                      (order_id,))
+
+
+def release_owned(owner):
+    """Drop leases left behind by a previous run of `owner`."""
+    connect().execute("UPDATE queue SET lease_until = 0 WHERE lease_owner = ? AND lease_until > 0",
+                      (owner,))
+
+
+def kept_uploads(uploaded_before=None):
+    """Uploaded entries whose files are still on disk, oldest upload first."""
+    sql = "SELECT * FROM queue WHERE state = 'uploaded' AND kept = 1"
+    args = ()
+    if uploaded_before is not None:
+        sql += " AND uploaded_at < ?"
+        args = (uploaded_before,)
+    return [_entry(r) for r in connect().execute(sql + " ORDER BY uploaded_at", args)]
+
+
+def mark_evicted(order_id):
+    connect().execute("UPDATE queue SET kept = 0 WHERE order_id = ? AND state = 'uploaded'",
+                      (order_id,))
+
+
+def oldest_pending(limit=10):
+    """Pending single-file videos, oldest recording first."""
+    rows = connect().execute("SELECT * FROM queue WHERE state = 'pending' AND kind = 'video' "
+                             "ORDER BY created_at LIMIT ?", (limit,))
+    return [_entry(r) for r in rows]
+
+
+# ---------------------------------------
+# Counters shared by both processes
+# ---------------------------------------
+def meta_get(key, default=None):
+    row = connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def meta_set(key, value):
+    connect().execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                      "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+
+def meta_add(key, delta):
+    """Atomically add delta to a numeric meta value (missing counts as 0)."""
+    connect().execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                      "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + ?",
+                      (key, str(delta), delta))
+
+
+def compact(days=ARCHIVE_AFTER_DAYS):
+    """Move uploaded rows older than `days` to ARCHIVE_FILE (one JSON line each)."""
+    conn = connect()
+    cutoff = time.time() - days * 86400
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("SELECT * FROM queue WHERE state = 'uploaded' AND uploaded_at < ? "
+                            "ORDER BY seq", (cutoff,)).fetchall()
+        if rows:
+            with open(ARCHIVE_FILE, "a") as f:
+                for r in rows:
+                    f.write(json.dumps({"id": r["order_id"], "created_at": r["created_at"],
+                                        "uploaded_at": r["uploaded_at"]}) + "\n")
+            conn.execute("DELETE FROM queue WHERE state = 'uploaded' AND uploaded_at < ?", (cutoff,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if rows:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"[queue] Archived {len(rows)} uploaded entries")
+    return len(rows)
+
+
+# ---------------------------------------
+# Wake-up channel
+# ---------------------------------------
+def notify(msg="work"):
+    """Wake the uploader. Never blocks; does nothing if the uploader is not listening."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        s.setblocking(False)
+        s.sendto(msg.encode(), NOTIFY_SOCK)
+    except OSError:
+        pass
+    finally:
+        s.close()
+
+
+def listen():
+    """Bind the uploader's end of the channel."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        os.unlink(NOTIFY_SOCK)
+    except FileNotFoundError:
+        pass
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    s.bind(NOTIFY_SOCK)
+    s.setblocking(False)
+    return s
+
+
+def wait(sock, timeout):
+    """Sleep until a notify() arrives or timeout passes; returns the drained messages."""
+    select.select([sock], [], [], timeout)
+    msgs = []
+    while True:
+        try:
+            msgs.append(sock.recv(256).decode())
+        except BlockingIOError:
+            return msgs
+
+
+# ---------------------------------------
+# Command line
+# ---------------------------------------
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Inspect or reorder the PackProof upload queue")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="pending entries")
+    p = sub.add_parser("prioritize", help="upload an order ahead of the rest (e.g. a dispute)")
+    p.add_argument("order_id")
+    p.add_argument("--priority", type=int, default=1, help="higher goes first; 0 = normal")
+    p.add_argument("--within", type=float, help="deadline, minutes from now")
+    args = ap.parse_args()
+
+    if args.cmd == "list":
+        for e in pending():
+            size = f"{e['size'] >> 20} MB" if e["size"] else "?"
+            deadline = f" due in {(e['deadline'] - time.time()) / 60:.0f} min" if e["deadline"] else ""
+            print(f"{e['id']:<24}{size:>9}  {e['profile'] or '':<9} attempts {e['attempts']}  "
+                  f"priority {e['priority']}{deadline}")
+    elif args.cmd == "prioritize":
+        deadline = time.time() + args.within * 60 if args.within is not None else None
+        if not prioritize(args.order_id, args.priority, deadline):
+            raise SystemExit(f"{args.order_id} is not pending")
+        notify("priority")
+        print(f"{args.order_id}: priority {args.priority}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Retry scheduling for uploader.py.
+
+  backoff_delay()  per-entry exponential backoff with jitter
+  CircuitBreaker   stops all uploads after repeated failures, then lets one
+                   probe upload through before resuming
+  WarmState        remembers when the server last answered, so the wake-up
+                   GET is only sent to a server that may have gone cold
+  order_by()       which due entry to upload next (UPLOAD_POLICY)
+"""
+import os
+import time
+import random
+import threading
+
+BACKOFF_BASE = float(os.environ.get("PACKPROOF_BACKOFF_BASE", "5"))   # seconds before the first retry
+BACKOFF_MAX  = 30 * 60
+
+BREAKER_THRESHOLD    = 5  # consecutive failed uploads that open the breaker
+BREAKER_COOLDOWN     = 60
+BREAKER_MAX_COOLDOWN = 15 * 60
+
+WARM_WINDOW = 5 * 60      # server counts as awake this long after any reply
+
+# fifo | shortest | newest; see order_by()
+UPLOAD_POLICY    = os.environ.get("PACKPROOF_POLICY", "fifo")
+DEADLINE_HORIZON = 30 * 60   # entries due within this many seconds jump the queue
+
+
+def backoff_delay(attempts):
+    """Seconds to wait after the `attempts`-th failure: doubling, capped, with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """
+    closed    uploads run normally
+    open      no uploads until the cooldown has passed
+    half-open one probe upload; success closes, failure re-opens with a
+              doubled cooldown
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return "closed"
+        return "half-open" if time.time() >= self.open_until else "open"
+
+    def slots(self, free):
+        """How many of `free` worker slots may start an upload now. Changes nothing."""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return free
+            if state == "half-open" and not self.probing and free:
+                return 1
+            return 0
+
+    def begin_probe(self):
+        """Call for each upload actually started; in half-open it is the probe."""
+        with self.lock:
+            if self.state != "closed":
+                self.probing = True
+
+    def retry_in(self):
+        """Seconds until the breaker lets a probe through (0 if closed)."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.open_until - time.time())
+
+    def record(self, ok):
+        """ok: True/False for an upload the server took part in, None for one that never reached it."""
+        with self.lock:
+            was_probe, self.probing = self.probing, False
+            if ok is None:
+                return
+            if ok:
+                if self.failures >= self.threshold:
+                    print("[breaker] Closed")
+                self.failures = 0
+                self.cooldown = self.base_cooldown
+                return
+            self.failures += 1
+            if was_probe:
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            if self.failures >= self.threshold:
+                self.open_until = time.time() + self.cooldown
+                print(f"[breaker] Open for {self.cooldown:.0f}s after {self.failures} failures")
+
+
+class WarmState:
+    """Time of the last reply from the server, and of the last request that got no connection."""
+    def __init__(self, window=WARM_WINDOW):
+        self.window = window
+        self.last_reply = 0.0
+        self.last_answer = 0.0           # any HTTP response, 5xx included
+        self.last_unreachable = 0.0      # refused, no route, DNS failure, connect timeout
+
+    def touch(self):
+        self.last_reply = time.time()
+
+    def answered(self):
+        self.last_answer = time.time()
+
+    def unreachable(self):
+        self.last_unreachable = time.time()
+
+    def is_warm(self):
+        return time.time() - self.last_reply < self.window
+
+    def reachable(self):
+        """False while the newest request to the server could not connect at all."""
+        return self.last_unreachable <= self.last_answer
+
+
+# ---------------------------------------
+# Upload order
+# ---------------------------------------
+# last key of the ORDER BY for each policy; sizes are the queue's size column
+POLICIES = {
+    "fifo":     "seq",
+    "shortest": "size IS NULL, size, seq",    # unknown size (old entries) last
+    "newest":   "seq DESC",
+}
+
+
+def order_by(policy=UPLOAD_POLICY, now=None):
+    """
+    ORDER BY clause for queue_db.due(). Whatever the policy:
+      1. entries with a proxy still to send
+      2. higher priority (e.g. a disputed order)
+      3. deadlines within DEADLINE_HORIZON, earliest first
+      4. fewest attempts, so entries that keep failing never hold up fresh ones
+    then the policy's own order.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"unknown upload policy {policy!r} (have {', '.join(POLICIES)})")
+    now = time.time() if now is None else now
+    urgent = float(now + DEADLINE_HORIZON)
+    return ("proxy_state IS 'pending' DESC, priority DESC, "
+            f"(deadline IS NULL OR deadline > {urgent!r}), deadline, attempts, {POLICIES[policy]}")
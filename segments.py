@@ -0,0 +1,125 @@
+"""
+Segmented recording (PACKPROOF_SEGMENT_SECONDS > 0).
+
+ffmpeg's segment muxer cuts the encoded stream into SEGMENT_SECONDS long
+MPEG-TS files in VIDEO_PATH/<order>.seg/ while the recording runs.
+SegmentWatcher queues every segment for upload the moment ffmpeg closes
+it, so the uploader sends them while the camera is still recording. At
+stop, finish() writes manifest.json. The order's "segmented" queue entry
+sends it to the server once every segment is uploaded, and the server
+concatenates the segments (TS segments join byte for byte) into the
+finished video.
+
+Done that way, a long recording is on the server about one segment after
+STOP instead of one full upload after it.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+import lifecycle
+import queue_db
+import spool
+from util import file_sha256
+
+SEGMENT_SECONDS = int(os.environ.get("PACKPROOF_SEGMENT_SECONDS", "0"))   # 0 = one mp4
+LIST_FILE       = "segments.csv"       # written by ffmpeg as each segment is closed
+MANIFEST_FILE   = "manifest.json"
+POLL_INTERVAL   = 0.5
+
+
+def ffmpeg_target(seg_dir, seconds=SEGMENT_SECONDS):
+    """Output "filename" for FfmpegOutput; picamera2 splits it into ffmpeg's output arguments."""
+    return (f"-f segment -segment_time {seconds} -segment_format mpegts "
+            f"-segment_list {seg_dir}/{LIST_FILE} -segment_list_type csv "
+            f"{seg_dir}/%05d.ts")
+
+
+def clear(order_id):
+    """Remove an earlier recording's segments and their queue entries."""
+    queue_db.drop_segments(order_id)
+    seg_dir = spool.segment_dir(order_id)
+    freed = 0
+    try:
+        for e in os.scandir(seg_dir):
+            freed += e.stat().st_size
+            os.remove(e.path)
+    except FileNotFoundError:
+        pass
+    spool.account(-freed)
+    os.makedirs(seg_dir, exist_ok=True)
+    return seg_dir
+
+
+class SegmentWatcher:
+    """Follows ffmpeg's segment list for one recording and queues each finished segment."""
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.seg_dir = spool.segment_dir(order_id)
+        self.segments = []
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(POLL_INTERVAL):
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"[segments] {self.order_id}: {e}")
+
+    def scan(self):
+        """Queue segments listed since the last scan."""
+        try:
+            with open(f"{self.seg_dir}/{LIST_FILE}") as f:
+                lines = [l.strip() for l in f if l.strip()]
+        except FileNotFoundError:
+            return
+        with self.lock:
+            for line in lines[len(self.segments):]:
+                name, start, end = line.split(",")[:3]
+                index = int(name.split(".")[0])
+                path = f"{self.seg_dir}/{name}"
+                size = os.path.getsize(path)
+                seg = {"index": index, "file": name, "bytes": size, "sha256": file_sha256(path),
+                       "start": float(start), "end": float(end)}
+                self.segments.append(seg)
+                spool.account(size)
+                queue_db.enqueue_segment(self.order_id, index, seg["sha256"], size)
+                queue_db.notify(queue_db.segment_id(self.order_id, index))
+                lifecycle.event(self.order_id, "segment", index=index, bytes=size,
+                                seconds=round(seg["end"] - seg["start"], 2))
+
+    def finish(self):
+        """
+        After the encoder has stopped (ffmpeg has closed the last segment):
+        queue what is left and write the manifest. Returns (manifest sha256,
+        total segment bytes) for the order's queue entry.
+        """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.scan()
+        manifest = {"name": self.order_id, "segment_seconds": SEGMENT_SECONDS,
+                    "created_at": time.time(), "segments": self.segments,
+                    "bytes": sum(s["bytes"] for s in self.segments)}
+        data = json.dumps(manifest, indent=1).encode()
+        path = f"{self.seg_dir}/{MANIFEST_FILE}"
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        try:
+            listed = os.path.getsize(f"{self.seg_dir}/{LIST_FILE}")
+        except FileNotFoundError:
+            listed = 0
+        spool.account(len(data) + listed)
+        return hashlib.sha256(data).hexdigest(), manifest["bytes"]
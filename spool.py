@@ -0,0 +1,217 @@
+"""
+Disk budget for the video/image spool (VIDEO_PATH, IMAGE_PATH).
+
+Used bytes are tracked incrementally in the queue database: main.py adds
+each finished recording, uploader.py and evict() subtract what they
+delete. rescan() (run once at recorder start) corrects any drift.
+
+The spool may grow to limit(): SPOOL_MAX_BYTES if set, and never past
+RESERVE_BYTES of free space on the card. Above HIGH_WATERMARK of that
+limit evict() frees space until usage is back under LOW_WATERMARK,
+running the steps of EVICTION_POLICY in order:
+
+  uploaded   delete files kept after upload, oldest upload first
+  downscale  re-encode old pending videos at low resolution
+  refuse     nothing left to free; has_room() refuses new recordings
+"""
+import os
+import time
+import subprocess
+
+import lifecycle
+import queue_db
+
+DATA_DIR   = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+VIDEO_PATH = f"{DATA_DIR}/videos"
+IMAGE_PATH = f"{DATA_DIR}/images"
+
+SPOOL_MAX_BYTES = int(os.environ.get("PACKPROOF_SPOOL_MAX_MB", "0")) * 1024 * 1024   # 0 = disk only
+RESERVE_BYTES   = 300 * 1024 * 1024     # always leave this much free on the card
+HIGH_WATERMARK  = 0.90
+LOW_WATERMARK   = 0.75
+
+# keep uploaded files for disputes until space is needed or they are this old
+KEEP_UPLOADED        = os.environ.get("PACKPROOF_KEEP_UPLOADED", "1") != "0"
+RETAIN_UPLOADED_DAYS = 7
+
+EVICTION_POLICY = os.environ.get("PACKPROOF_EVICTION", "uploaded,downscale,refuse").split(",")
+DOWNSCALE_AFTER = 3600                  # only pending videos at least this old (seconds)
+DOWNSCALE_CMD   = ["ffmpeg", "-y", "-loglevel", "error", "-i", "{src}",
+                   "-vf", "scale=320:-2", "-c:v", "h264_v4l2m2m", "-b:v", "500k",
+                   "-an", "-movflags", "+faststart", "{dst}"]
+
+USED_KEY = "spool_bytes"
+
+
+def segment_dir(order_id):
+    """Segments and manifest of a segmented recording."""
+    return f"{VIDEO_PATH}/{order_id}.seg"
+
+
+def files_for(order_id):
+    files = [f"{VIDEO_PATH}/{order_id}.mp4", f"{VIDEO_PATH}/{order_id}.proxy.mp4",
+             f"{IMAGE_PATH}/{order_id}.jpg"]
+    try:
+        files += [e.path for e in os.scandir(segment_dir(order_id))]
+    except FileNotFoundError:
+        pass
+    return files
+
+
+def rescan():
+    """Recount the spool from disk and store the result."""
+    total = 0
+    dirs = [VIDEO_PATH, IMAGE_PATH]
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as it:
+                for e in it:
+                    if e.is_file():
+                        total += e.stat().st_size
+                    elif e.is_dir() and e.name.endswith(".seg"):
+                        dirs.append(e.path)
+        except FileNotFoundError:
+            pass
+    queue_db.meta_set(USED_KEY, total)
+    return total
+
+
+def used_bytes():
+    value = queue_db.meta_get(USED_KEY)
+    return rescan() if value is None else max(0, int(value))
+
+
+def account(delta):
+    """Record bytes added to (positive) or removed from (negative) the spool."""
+    if delta:
+        queue_db.meta_add(USED_KEY, int(delta))
+
+
+def free_bytes():
+    st = os.statvfs(VIDEO_PATH)
+    return st.f_bavail * st.f_frsize
+
+
+def limit(used=None):
+    used = used_bytes() if used is None else used
+    cap = used + max(0, free_bytes() - RESERVE_BYTES)
+    return min(cap, SPOOL_MAX_BYTES) if SPOOL_MAX_BYTES else cap
+
+
+def usage():
+    """Fraction of the spool budget in use (can exceed 1.0 when the disk filled up)."""
+    used = used_bytes()
+    lim = limit(used)
+    return used / lim if lim else 1.0
+
+
+def has_room(expected_bytes):
+    """Cheap check before recording: one statvfs and one indexed read."""
+    used = used_bytes()
+    return used + expected_bytes <= limit(used)
+
+
+def remove_files(order_id):
+    freed = 0
+    for path in files_for(order_id):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+    try:
+        os.rmdir(segment_dir(order_id))
+    except OSError:
+        pass
+    account(-freed)
+    return freed
+
+
+# ---------------------------------------
+# Eviction
+# ---------------------------------------
+def expire_kept():
+    """Retention: drop kept uploads older than RETAIN_UPLOADED_DAYS."""
+    cutoff = time.time() - RETAIN_UPLOADED_DAYS * 86400
+    for e in queue_db.kept_uploads(uploaded_before=cutoff):
+        freed = remove_files(e["id"])
+        queue_db.mark_evicted(e["id"])
+        lifecycle.event(e["id"], "deleted", reason="expired", bytes=freed)
+
+
+def evict_uploaded(target):
+    freed = 0
+    for e in queue_db.kept_uploads():
+        if used_bytes() <= target:
+            break
+        removed = remove_files(e["id"])
+        freed += removed
+        queue_db.mark_evicted(e["id"])
+        lifecycle.event(e["id"], "deleted", reason="evicted", bytes=removed)
+        print(f"[spool] Evicted uploaded {e['id']}")
+    return freed
+
+
+def downscale(entry):
+    """Re-encode one pending video in place. Holds the entry's lease so the uploader leaves it alone."""
+    src = f"{VIDEO_PATH}/{entry['id']}.mp4"
+    dst = f"{VIDEO_PATH}/{entry['id']}.small.mp4"
+    if not queue_db.claim(entry["id"], 3600, "spool"):
+        return 0
+    try:
+        before = os.path.getsize(src)
+        cmd = [a.format(src=src, dst=dst) for a in DOWNSCALE_CMD]
+        if subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+            print(f"[spool] Downscale of {entry['id']} failed")
+            return 0
+        after = os.path.getsize(dst)
+        os.replace(dst, src)
+        account(after - before)
+        # new file: drop the old hash and any half-finished upload of the original
+        queue_db.update(entry["id"], size=after, content_hash=None, upload_id=None,
+                        offset=0, downscaled=1)
+        print(f"[spool] Downscaled {entry['id']}: {before >> 20} -> {after >> 20} MB")
+        lifecycle.event(entry["id"], "downscaled", bytes=before, to=after)
+        return before - after
+    except OSError as e:
+        print(f"[spool] Downscale of {entry['id']} failed: {e}")
+        return 0
+    finally:
+        if os.path.exists(dst):
+            os.remove(dst)
+        queue_db.release(entry["id"])
+
+
+def evict_downscale(target):
+    freed = 0
+    cutoff = time.time() - DOWNSCALE_AFTER
+    for e in queue_db.oldest_pending(limit=20):
+        if used_bytes() <= target or e["created_at"] > cutoff:
+            break
+        if not e["downscaled"]:
+            freed += downscale(e)
+    return freed
+
+
+def evict():
+    """
+    Apply retention, then the eviction policy if usage is above HIGH_WATERMARK.
+    Returns "full" if usage is still above it and the policy ends in
+    "refuse", otherwise "ok".
+    """
+    expire_kept()
+    lim = limit()
+    if used_bytes() > HIGH_WATERMARK * lim:
+        target = LOW_WATERMARK * lim
+        print(f"[spool] {used_bytes() >> 20} of {lim >> 20} MB used, evicting")
+        for step in EVICTION_POLICY:
+            if used_bytes() <= target:
+                break
+            if step == "uploaded":
+                evict_uploaded(target)
+            elif step == "downscale":
+                evict_downscale(target)
+    if "refuse" in EVICTION_POLICY and used_bytes() > HIGH_WATERMARK * limit():
+        return "full"
+    return "ok"
@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the PackProof backend.
+
+Implements the endpoints uploader.py talks to so uploads can be tested
+without the real server:
+
+  GET  /                                  wake-up ping
+  GET  /generate_204                      204, for connectivity.py's probe
+                                          (PACKPROOF_PROBE_URL)
+  GET  /api/videos/exists?key=<sha256>    {exists} for a finished Idempotency-Key
+  POST /api/videos/add                    single multipart upload (variant=proxy for
+                                          the low-bitrate preview, stored as <name>.proxy.mp4)
+  POST /api/videos/uploads                open resumable session {name, size}
+  GET  /api/videos/uploads/<id>           session state {offset, size, ranges}
+  PUT  /api/videos/uploads/<id>           one part, Content-Range: bytes a-b/total,
+                                          optional X-Part-Sha256; parts may arrive
+                                          in any order and over several connections
+  POST /api/videos/uploads/<id>/complete  finish (optional sha256 field, imageFile part)
+  POST /api/videos/segments               one segment of a segmented recording
+                                          (name, index, sha256, segment part)
+  POST /api/videos/segments/complete      manifest field (segments.py); joins the
+                                          segments into <name>.ts (<name>.mp4 with
+                                          ffmpeg on PATH), or 409 {missing: [...]}
+
+Uploads and session opens may carry an Idempotency-Key header: a repeated
+upload of a finished key is answered 200 without storing it again, and a
+session open for an unfinished key returns the existing session.
+
+Run:
+  python3 standin_server.py --port 8080 --store /tmp/standin
+  PACKPROOF_SERVER=http://127.0.0.1:8080 python3 uploader.py
+
+With --latency the server is put behind ImpairProxy, a TCP proxy that
+delays traffic and limits in-flight bytes per connection like a long-haul
+link (see bench_upload.py streams); --loss adds retransmit stalls.
+
+--cold-start, --error-rate and --hang-rate make it misbehave like the real
+backend (see Faults and bench_upload.py drain).
+"""
+import os, re, json, time, uuid, math, socket, random, shutil, hashlib, argparse, threading, subprocess
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from util import file_sha256
+
+READ_BLOCK = 64 * 1024
+
+
+# ---------------------------------------
+# Multipart parsing (streams parts to disk)
+# ---------------------------------------
+def iter_multipart(rfile, length, boundary, part_dir):
+    """
+    Parse a multipart body of `length` bytes from rfile.
+    Yields (field_name, filename, value) where value is the text for plain
+    fields and a path under part_dir for file fields.
+    """
+    delim = b"\r\n--" + boundary
+    remaining = length
+    buf = b"\r\n"      # lets the first boundary match the same delimiter
+
+    def fill():
+        nonlocal buf, remaining
+        if remaining <= 0:
+            return False
+        chunk = rfile.read(min(READ_BLOCK, remaining))
+        if not chunk:
+            remaining = 0
+            return False
+        remaining -= len(chunk)
+        buf += chunk
+        return True
+
+    # skip preamble up to the first boundary
+    while delim not in buf:
+        if not fill():
+            return
+    buf = buf[buf.index(delim) + len(delim):]
+
+    while True:
+        while len(buf) < 2 and fill():
+            pass
+        if buf.startswith(b"--"):
+            break
+        while b"\r\n\r\n" not in buf:
+            if not fill():
+                return
+        head, buf = buf.split(b"\r\n\r\n", 1)
+        headers = head.decode("utf-8", "replace")
+        name = re.search(r'name="([^"]*)"', headers)
+        filename = re.search(r'filename="([^"]*)"', headers)
+        name = name.group(1) if name else ""
+
+        out = None
+        text = b""
+        if filename:
+            path = os.path.join(part_dir, f"{uuid.uuid4().hex}.part")
+            out = open(path, "wb")
+
+        # copy data until the next delimiter, keeping a tail that may hold a split delimiter
+        while True:
+            idx = buf.find(delim)
+            if idx >= 0:
+                data, buf = buf[:idx], buf[idx + len(delim):]
+                if out:
+                    out.write(data)
+                else:
+                    text += data
+                break
+            keep = len(delim)
+            if len(buf) > keep:
+                data, buf = buf[:-keep], buf[-keep:]
+                if out:
+                    out.write(data)
+                else:
+                    text += data
+            if not fill():
+                break
+
+        if out:
+            out.close()
+            yield name, filename.group(1), path
+        else:
+            yield name, None, text.decode("utf-8", "replace")
+
+
+def add_range(ranges, start, end):
+    """Merge [start, end) into a sorted list of disjoint [a, b) spans."""
+    merged = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if merged and a <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+
+# ---------------------------------------
+# Server state
+# ---------------------------------------
+class Store:
+    def __init__(self, root):
+        self.root = root
+        self.parts = os.path.join(root, "parts")
+        self.done = os.path.join(root, "done")
+        os.makedirs(self.parts, exist_ok=True)
+        os.makedirs(self.done, exist_ok=True)
+        self.segments = os.path.join(root, "segments")
+        os.makedirs(self.segments, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.keys = {}          # Idempotency-Key -> name (finished) or session id
+        self.stats = {"uploads": 0, "parts": 0, "bytes": 0, "done_at": {}}
+
+    def finish(self, name, video_path, image_path=None, key=None, variant="full", ext="mp4"):
+        if variant == "proxy":
+            name = f"{name}.proxy"
+        shutil.move(video_path, os.path.join(self.done, f"{name}.{ext}"))
+        if image_path:
+            shutil.move(image_path, os.path.join(self.done, f"{name}.jpg"))
+        with self.lock:
+            self.stats["uploads"] += 1
+            self.stats["done_at"][name] = time.time()
+            if key:
+                self.keys[key] = {"name": name}
+
+
+class Faults:
+    """
+    Backend misbehaviour, decided per request:
+      cold_start  seconds the first request waits while the server boots; with
+                  idle_sleep it goes cold again after that many idle seconds
+      error_rate  fraction of requests answered 503 without reading the body
+      hang_rate   fraction of requests held for `hang` seconds and then
+                  dropped without a reply (the client times out or is reset)
+    """
+    def __init__(self, cold_start=0, idle_sleep=0, error_rate=0, hang_rate=0, hang=20, seed=None):
+        self.cold_start = cold_start
+        self.idle_sleep = idle_sleep
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.awake_at = None
+        self.last_request = 0.0
+        self.counts = {"cold": 0, "503": 0, "hang": 0}
+
+    def before(self):
+        """Wait out a cold start; then None (serve it), "503" or "hang"."""
+        with self.lock:
+            now = time.time()
+            asleep = self.awake_at is None or (
+                self.idle_sleep and now >= self.awake_at and now - self.last_request > self.idle_sleep)
+            if self.cold_start and asleep:
+                self.awake_at = now + self.cold_start
+                self.counts["cold"] += 1
+            self.last_request = now
+            wait = max(0.0, (self.awake_at or 0) - now)
+            r = self.rng.random()
+            fault = "503" if r < self.error_rate else \
+                    "hang" if r < self.error_rate + self.hang_rate else None
+            if fault:
+                self.counts[fault] += 1
+        time.sleep(wait)
+        return fault
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+    faults = None
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def reply(self, code, body=None):
+        data = json.dumps(body if body is not None else {}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body_length(self):
+        return int(self.headers.get("Content-Length", 0))
+
+    def read_json(self):
+        return json.loads(self.rfile.read(self.body_length()) or b"{}")
+
+    def read_multipart(self):
+        ctype = self.headers.get("Content-Type", "")
+        m = re.search(r"boundary=(\"?)([^\";]+)\1", ctype)
+        if not m:
+            self.rfile.read(self.body_length())
+            return {}, {}
+        fields, files = {}, {}
+        for name, filename, value in iter_multipart(self.rfile, self.body_length(),
+                                                     m.group(2).encode(), self.store.parts):
+            if filename is None:
+                fields[name] = value
+            else:
+                files[name] = value
+        return fields, files
+
+    def inject(self):
+        """Apply Faults to this request; True if it has been dealt with."""
+        if not self.faults or self.path == "/stats":
+            return False
+        fault = self.faults.before()
+        if fault == "503":
+            self.close_connection = True
+            self.reply(503, {"error": "injected"})
+            return True
+        if fault == "hang":
+            time.sleep(self.faults.hang)
+            self.close_connection = True
+            return True
+        return False
+
+    @staticmethod
+    def session_state(s):
+        r = s["ranges"]
+        offset = r[0][1] if r and r[0][0] == 0 else 0
+        return {"offset": offset, "size": s["size"], "ranges": r}
+
+    def session_path(self):
+        m = re.fullmatch(r"/api/videos/uploads/([0-9a-f]+)(/complete)?", self.path)
+        if not m:
+            return None, False
+        return m.group(1), bool(m.group(2))
+
+    # ---------------- GET ----------------
+    def do_GET(self):
+        if self.path == "/generate_204":
+            # connectivity probe (PACKPROOF_PROBE_URL): the "internet", never faulted
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.inject():
+            return
+        if self.path == "/":
+            return self.reply(200, {"ok": True})
+        if self.path == "/stats":
+            with self.store.lock:
+                stats = json.loads(json.dumps(self.store.stats))
+            if self.faults:
+                stats["faults"] = dict(self.faults.counts)
+            return self.reply(200, stats)
+        if self.path.startswith("/api/videos/exists"):
+            key = parse_qs(urlparse(self.path).query).get("key", [""])[0]
+            with self.store.lock:
+                done = "name" in self.store.keys.get(key, {})
+            return self.reply(200, {"exists": done})
+
+        sid, _ = self.session_path()
+        with self.store.lock:
+            s = self.store.sessions.get(sid)
+            if not s:
+                return self.reply(404, {"error": "no such upload"})
+            return self.reply(200, self.session_state(s))
+
+    # ---------------- POST ----------------
+    def do_POST(self):
+        if self.inject():
+            return
+        key = self.headers.get("Idempotency-Key")
+
+        if self.path == "/api/videos/add":
+            fields, files = self.read_multipart()
+            name = fields.get("name")
+            if not name or "videoFile" not in files:
+                return self.reply(400, {"error": "name and videoFile required"})
+            with self.store.lock:
+                dup = key and "name" in self.store.keys.get(key, {})
+            if dup:
+                for path in files.values():
+                    os.remove(path)
+                return self.reply(200, {"name": name, "duplicate": True})
+            self.store.finish(name, files["videoFile"], files.get("imageFile"), key,
+                              fields.get("variant", "full"))
+            return self.reply(201, {"name": name})
+
+        if self.path == "/api/videos/segments":
+            return self.add_segment()
+        if self.path == "/api/videos/segments/complete":
+            return self.join_segments(key)
+
+        if self.path == "/api/videos/uploads":
+            req = self.read_json()
+            with self.store.lock:
+                known = self.store.keys.get(key) if key else None
+                if known and known.get("session") in self.store.sessions:
+                    sid = known["session"]
+                    return self.reply(200, dict(self.session_state(self.store.sessions[sid]),
+                                                upload_id=sid))
+            sid = uuid.uuid4().hex
+            path = os.path.join(self.store.parts, f"{sid}.bin")
+            with open(path, "wb") as f:
+                f.truncate(int(req["size"]))
+            with self.store.lock:
+                self.store.sessions[sid] = {"name": req["name"], "size": int(req["size"]),
+                                            "ranges": [], "path": path, "key": key}
+                if key:
+                    self.store.keys[key] = {"session": sid}
+            return self.reply(201, {"upload_id": sid, "offset": 0})
+
+        sid, complete = self.session_path()
+        if not complete:
+            return self.reply(404, {"error": "not found"})
+        fields, files = self.read_multipart()
+        with self.store.lock:
+            s = self.store.sessions.get(sid)
+            if not s:
+                return self.reply(404, {"error": "no such upload"})
+            if s["size"] and s["ranges"] != [[0, s["size"]]]:
+                return self.reply(409, self.session_state(s))
+            del self.store.sessions[sid]
+
+        digest = file_sha256(s["path"])
+        if fields.get("sha256") and fields["sha256"] != digest:
+            os.remove(s["path"])
+            return self.reply(422, {"error": "sha256 mismatch", "sha256": digest})
+        self.store.finish(s["name"], s["path"], files.get("imageFile"), s["key"])
+        return self.reply(201, {"name": s["name"], "sha256": digest})
+
+    # ---------------- segments ----------------
+    def segment_path(self, name, index):
+        return os.path.join(self.store.segments, re.sub(r"[^\w.-]", "_", name), f"{int(index):05d}.ts")
+
+    def add_segment(self):
+        fields, files = self.read_multipart()
+        if not fields.get("name") or "index" not in fields or "segment" not in files:
+            return self.reply(400, {"error": "name, index and segment required"})
+        if fields.get("sha256") and file_sha256(files["segment"]) != fields["sha256"]:
+            os.remove(files["segment"])
+            return self.reply(422, {"error": "sha256 mismatch"})
+        path = self.segment_path(fields["name"], fields["index"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(files["segment"], path)      # a repeat replaces the earlier copy
+        with self.store.lock:
+            self.store.stats["parts"] += 1
+            self.store.stats["bytes"] += os.path.getsize(path)
+        return self.reply(201, {"name": fields["name"], "index": int(fields["index"])})
+
+    def join_segments(self, key):
+        fields, files = self.read_multipart()
+        with self.store.lock:
+            dup = key and "name" in self.store.keys.get(key, {})
+        if dup:
+            for path in files.values():
+                os.remove(path)
+            return self.reply(200, {"duplicate": True})
+        manifest = json.loads(fields.get("manifest") or "{}")
+        name = fields.get("name") or manifest.get("name")
+        segs = sorted(manifest.get("segments", []), key=lambda s: s["index"])
+        missing = [s["index"] for s in segs if not os.path.exists(self.segment_path(name, s["index"]))
+                   or (s.get("sha256") and file_sha256(self.segment_path(name, s["index"])) != s["sha256"])]
+        if not name or missing:
+            return self.reply(409, {"error": "segments missing", "missing": missing})
+
+        joined = os.path.join(self.store.parts, f"{uuid.uuid4().hex}.ts")
+        with open(joined, "wb") as out:
+            for s in segs:
+                with open(self.segment_path(name, s["index"]), "rb") as f:
+                    shutil.copyfileobj(f, out)
+        ext = "ts"
+        if shutil.which("ffmpeg"):
+            mp4 = joined[:-3] + ".mp4"
+            cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", joined, "-c", "copy", mp4]
+            if subprocess.run(cmd).returncode == 0:
+                os.remove(joined)
+                joined, ext = mp4, "mp4"
+        shutil.rmtree(os.path.dirname(self.segment_path(name, 0)), ignore_errors=True)
+        self.store.finish(name, joined, files.get("imageFile"), key, ext=ext)
+        return self.reply(201, {"name": name, "segments": len(segs)})
+
+    # ---------------- PUT ----------------
+    def do_PUT(self):
+        if self.inject():
+            return
+        sid, complete = self.session_path()
+        m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", self.headers.get("Content-Range", ""))
+        data = self.rfile.read(self.body_length())
+        if complete or not m:
+            return self.reply(400, {"error": "Content-Range required"})
+        start, end = int(m.group(1)), int(m.group(2))
+        part_hash = self.headers.get("X-Part-Sha256")
+        if end - start + 1 != len(data):
+            return self.reply(400, {"error": "short part"})
+        if part_hash and hashlib.sha256(data).hexdigest() != part_hash:
+            return self.reply(400, {"error": "part sha256 mismatch"})
+
+        with self.store.lock:
+            s = self.store.sessions.get(sid)
+            if not s:
+                return self.reply(404, {"error": "no such upload"})
+            path = s["path"]
+            if end >= s["size"]:
+                return self.reply(416, self.session_state(s))
+
+        # parts of one session may be written concurrently, each at its own offset
+        with open(path, "r+b") as f:
+            f.seek(start)
+            f.write(data)
+
+        with self.store.lock:
+            s["ranges"] = add_range(s["ranges"], start, end + 1)
+            self.store.stats["parts"] += 1
+            self.store.stats["bytes"] += len(data)
+            return self.reply(200, self.session_state(s))
+
+
+# ---------------------------------------
+# Network impairment proxy
+# ---------------------------------------
+class ImpairProxy:
+    """
+    TCP proxy that forwards to 127.0.0.1:upstream_port with:
+      latency   one-way delay in seconds, each direction
+      window    max bytes in flight per connection and direction, so a single
+                stream tops out near window / latency like TCP on a long link
+      bandwidth optional total bytes/s shared by all connections
+      loss      packet loss rate; a chunk containing a lost 1448-byte segment
+                is delivered one retransmit timeout late, and everything behind
+                it on the connection waits, as with a TCP retransmit
+    """
+    def __init__(self, upstream_port, latency=0.05, window=64 * 1024, bandwidth=None,
+                 host="127.0.0.1", port=0, loss=0.0):
+        self.upstream_port = upstream_port
+        self.latency = latency
+        self.window = window
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.rto = max(0.2, 4 * latency)     # Linux minimum RTO is 200 ms
+        self.link_lock = threading.Lock()
+        self.link_free_at = 0.0
+        self.sock = socket.create_server((host, port))
+        self.port = self.sock.getsockname()[1]
+
+    def serve_forever(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.sock.close()
+
+    def handle(self, client):
+        try:
+            upstream = socket.create_connection(("127.0.0.1", self.upstream_port))
+        except OSError:
+            client.close()
+            return
+        pipes = [threading.Thread(target=self.pipe, args=(src, dst), daemon=True)
+                 for src, dst in ((client, upstream), (upstream, client))]
+        for t in pipes:
+            t.start()
+        for t in pipes:
+            t.join()
+        client.close()
+        upstream.close()
+
+    def reserve_link(self, n):
+        """Block until the shared link has carried n bytes at `bandwidth`."""
+        if not self.bandwidth:
+            return
+        with self.link_lock:
+            now = time.time()
+            start = max(now, self.link_free_at)
+            self.link_free_at = start + n / self.bandwidth
+        time.sleep(max(0.0, start - now))
+
+    def loss_delay(self, n):
+        if not self.loss:
+            return 0.0
+        p_chunk = 1 - (1 - self.loss) ** math.ceil(n / 1448)
+        return self.rto if random.random() < p_chunk else 0.0
+
+    def pipe(self, src, dst):
+        line = deque()                # (deliver_at, data)
+        cond = threading.Condition()
+        state = {"inflight": 0, "eof": False}
+
+        def writer():
+            while True:
+                with cond:
+                    while not line and not state["eof"]:
+                        cond.wait()
+                    if not line:
+                        break
+                    deliver_at, data = line.popleft()
+                time.sleep(max(0.0, deliver_at - time.time()))
+                self.reserve_link(len(data))
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    break
+                with cond:
+                    state["inflight"] -= len(data)
+                    cond.notify_all()
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+        w = threading.Thread(target=writer, daemon=True)
+        w.start()
+        while True:
+            with cond:
+                while state["inflight"] >= self.window:
+                    cond.wait()
+                room = self.window - state["inflight"]
+            try:
+                data = src.recv(min(room, 16 * 1024))
+            except OSError:
+                data = b""
+            with cond:
+                if not data:
+                    state["eof"] = True
+                    cond.notify_all()
+                    break
+                state["inflight"] += len(data)
+                line.append((time.time() + self.latency + self.loss_delay(len(data)), data))
+                cond.notify_all()
+        w.join()
+
+
+def make_server(host="127.0.0.1", port=8080, store_dir="/tmp/standin", verbose=False, faults=None):
+    handler = type("StandinHandler", (Handler,), {"store": Store(store_dir), "faults": faults})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in for the PackProof upload API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--store", default="/tmp/standin")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    ap.add_argument("--latency", type=float, default=0, help="one-way delay (s) via ImpairProxy")
+    ap.add_argument("--window", type=int, default=64 * 1024, help="per-connection bytes in flight")
+    ap.add_argument("--bandwidth", type=float, default=0, help="total link bytes/s (0 = unlimited)")
+    ap.add_argument("--loss", type=float, default=0, help="packet loss rate via ImpairProxy")
+    ap.add_argument("--cold-start", type=float, default=0, help="seconds the first request waits")
+    ap.add_argument("--idle-sleep", type=float, default=0, help="go cold again after this idle time")
+    ap.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered 503")
+    ap.add_argument("--hang-rate", type=float, default=0, help="fraction of requests never answered")
+    ap.add_argument("--hang", type=float, default=20, help="seconds a hung request is held")
+    args = ap.parse_args()
+
+    faults = None
+    if args.cold_start or args.error_rate or args.hang_rate:
+        faults = Faults(args.cold_start, args.idle_sleep, args.error_rate, args.hang_rate, args.hang)
+    impaired = args.latency or args.bandwidth or args.loss
+    if impaired:
+        server = make_server(args.host, 0, args.store, args.verbose, faults)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ImpairProxy(server.server_address[1], args.latency, args.window,
+                    args.bandwidth or None, args.host, args.port, args.loss).start()
+    else:
+        server = make_server(args.host, args.port, args.store, args.verbose, faults)
+    print(f"Stand-in server on http://{args.host}:{args.port} (store: {args.store})")
+    try:
+        if impaired:
+            threading.Event().wait()
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Stills of the shipping label, taken while the H.264 encoder keeps running.
+
+A still is the camera's main stream (the recording's resolution), taken from
+a completed request with capture_request(), the way picamera2 takes stills
+during video. The encoder gets the same frame as always. The request is
+copied out and released at once, so the camera never runs short of
+buffers. The JPEG is encoded by one worker thread at nice WORKER_NICE and
+written atomically as IMAGE_PATH/<order>.jpg, which the uploader sends
+with the video.
+
+capture() grabs the frame on the worker too. The capture at STOP uses
+capture(now=True), which grabs the frame before the caller stops the
+encoder (at most one frame time) and then also leaves the encoding to the
+worker. A later still of the same order replaces the earlier one, and
+capture(keep=True) does not replace one taken by hand. then(fn) runs fn on
+the worker after the stills queued before it: main.py queues the order for
+upload that way, so the uploader never starts before its JPEG is written.
+"""
+import os
+import time
+import queue
+import threading
+
+from PIL import Image
+
+import lifecycle
+import spool
+import util
+
+JPEG_QUALITY = 90
+WORKER_NICE  = 10
+
+# main stream format -> numpy slice to RGB (picamera2 names formats by word order)
+TO_RGB = {
+    "XBGR8888": lambda a: a[..., :3],
+    "XRGB8888": lambda a: a[..., 2::-1],
+    "BGR888":   lambda a: a,
+    "RGB888":   lambda a: a[..., ::-1],
+}
+
+
+class StillCapture:
+    """One worker thread for all stills; capture() may be called from the Tk thread."""
+    def __init__(self, picam2, image_path=spool.IMAGE_PATH):
+        self.picam2 = picam2
+        self.image_path = image_path
+        self.jobs = queue.Queue()
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def capture(self, order_id, reason="button", now=False, keep=False):
+        """Queue a still of order_id; with now=True the frame is taken before returning."""
+        if not self.picam2:
+            return
+        frame = None
+        if now:
+            try:
+                frame = self.grab()
+            except Exception as e:
+                print(f"[still] {order_id}: capture failed: {e}")
+                return
+        self.jobs.put((order_id, reason, frame, keep))
+
+    def then(self, fn):
+        """Run fn() on the worker once the stills queued so far are written (or failed)."""
+        self.jobs.put(fn)
+
+    def grab(self):
+        """The next frame of the main stream as an RGB array (a copy; the request is released)."""
+        fmt = self.picam2.camera_configuration()["main"]["format"]
+        request = self.picam2.capture_request()
+        try:
+            array = request.make_array("main")
+        finally:
+            request.release()
+        return TO_RGB.get(fmt, TO_RGB["XBGR8888"])(array)
+
+    def worker(self):
+        util.lower_thread_priority(WORKER_NICE)
+        while True:
+            job = self.jobs.get()
+            try:
+                if callable(job):
+                    job()
+                else:
+                    self.save(*job)
+            except Exception as e:
+                print(f"[still] {e}")
+
+    def save(self, order_id, reason, frame, keep):
+        path = f"{self.image_path}/{order_id}.jpg"
+        if keep and os.path.exists(path):
+            return
+        t0 = time.monotonic()
+        if frame is None:
+            frame = self.grab()
+        img = Image.fromarray(frame)
+        os.makedirs(self.image_path, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            img.save(f, "JPEG", quality=JPEG_QUALITY)
+            size = f.tell()
+        try:
+            old = os.path.getsize(path)
+        except FileNotFoundError:
+            old = 0
+        os.replace(path + ".tmp", path)
+        spool.account(size - old)
+        ms = round((time.monotonic() - t0) * 1000)
+        print(f"[still] {order_id}: {img.width}x{img.height}, {size >> 10} KB in {ms} ms ({reason})")
+        lifecycle.event(order_id, "still", reason=reason, bytes=size,
+                        size=f"{img.width}x{img.height}", ms=ms)
@@ -0,0 +1,57 @@
+"""
+uploader.main() against a real queue in a temporary PACKPROOF_DIR.
+upload_entry is replaced by a recorder of the ids it is given; nothing
+talks to a server.
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+
+os.environ["PACKPROOF_DIR"] = tempfile.mkdtemp(prefix="pp-test-")
+os.environ["PACKPROOF_METRICS_PORT"] = "0"
+os.environ["PACKPROOF_PROBE_URL"] = "http://127.0.0.1:9/generate_204"   # nothing listens: offline
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import queue_db
+import schedule
+import uploader
+
+
+def test_half_open_breaker_with_nothing_due_still_probes(monkeypatch):
+    # open after one failure, already past the cooldown: half-open from the first pass
+    class HalfOpen(schedule.CircuitBreaker):
+        def __init__(self):
+            super().__init__(threshold=1, cooldown=1)
+            self.failures, self.open_until = 1, time.time() - 1
+            breakers.append(self)
+
+    breakers, submitted, passes = [], [], []
+    real_wait = uploader.wait_for_work
+    monkeypatch.setattr(schedule, "CircuitBreaker", HalfOpen)
+    monkeypatch.setattr(uploader, "upload_entry", lambda entry: submitted.append(entry["id"]) or True)
+    monkeypatch.setattr(uploader, "wake_in_background", lambda: None)
+    monkeypatch.setattr(uploader, "wait_for_work", lambda *a: passes.append(1) or real_wait(*a))
+
+    os.makedirs(uploader.VIDEO_PATH, exist_ok=True)
+    with open(f"{uploader.VIDEO_PATH}/a.mp4", "wb") as f:
+        f.write(b"\0")
+    queue_db.enqueue("a", content_hash="0" * 64, size=1)
+    queue_db.record_failure("a", 1, time.time() + 2)      # backed off: not due on the first passes
+    threading.Thread(target=uploader.main, daemon=True).start()
+
+    time.sleep(1)
+    assert breakers and breakers[0].state == "half-open" and not submitted
+    assert len(passes) < 10, f"{len(passes)} passes while nothing was due"
+
+    queue_db.notify("online")                             # what connectivity sends on reconnect
+    deadline = time.time() + 10
+    while not submitted and time.time() < deadline:
+        time.sleep(0.05)
+    assert submitted == ["a"]
+
+    deadline = time.time() + 5
+    while breakers[0].state != "closed" and time.time() < deadline:
+        time.sleep(0.05)
+    assert breakers[0].state == "closed"
@@ -1,36 +1,371 @@
 import os
-import time
 import json
+import time
+import uuid
+import hashlib
+import threading
+import traceback
 import requests
+from urllib3.exceptions import NewConnectionError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import connectivity
+import lifecycle
+import metrics
+import quality
+import queue_db
+import schedule
+import segments
+import spool
+from util import file_sha256
 
-VIDEO_PATH = "/home/neonflake/packproof/videos"
-IMAGE_PATH = "/home/neonflake/packproof/images"
-LOG_FILE   = "/home/neonflake/packproof/upload_log.json"
+DATA_DIR   = os.environ.get("PACKPROOF_DIR", "/home/neonflake/packproof")
+VIDEO_PATH = f"{DATA_DIR}/videos"
+IMAGE_PATH = f"{DATA_DIR}/images"
 
-API_URL = "https://visitwise.claricall.space/api/videos/add"
-WAKE_URL = "https://visitwise.claricall.space"
+SERVER_URL = os.environ.get("PACKPROOF_SERVER", "https://visitwise.claricall.space")
+API_URL = f"{SERVER_URL}/api/videos/add"
+WAKE_URL = SERVER_URL
+RESUME_URL = f"{SERVER_URL}/api/videos/uploads"
+EXISTS_URL = f"{SERVER_URL}/api/videos/exists"
+SEGMENTS_URL = f"{SERVER_URL}/api/videos/segments"
 
 WAKEUP_TIMEOUT = 15
 UPLOAD_TIMEOUT = 600   # 10 minutes
 
-def load_queue():
-    if not os.path.exists(LOG_FILE):
-        return {"pending": [], "uploaded": []}
-    with open(LOG_FILE, "r") as f:
-        return json.load(f)
+# "single" = one multipart POST, "chunked" = resumable parts via RESUME_URL
+UPLOAD_MODE  = os.environ.get("PACKPROOF_UPLOAD_MODE", "single")
+CHUNK_SIZE   = 1024 * 1024
+PART_TIMEOUT = 60
+PART_RETRIES = 5
+STREAM_BLOCK = 256 * 1024   # read size for streamed multipart bodies
+
+# chunked mode: files of PARALLEL_MIN_SIZE or more send parts over several connections
+PARALLEL_STREAMS  = int(os.environ.get("PACKPROOF_STREAMS", "4"))
+PARALLEL_MIN_SIZE = 16 * 1024 * 1024
+
+# parallel uploads: worker threads, and a global cap on open HTTP requests
+UPLOAD_WORKERS  = int(os.environ.get("PACKPROOF_UPLOAD_WORKERS", "3"))
+MAX_CONNECTIONS = int(os.environ.get("PACKPROOF_MAX_CONNECTIONS", "4"))
+COMPACT_EVERY   = 3600   # seconds between archiving old uploaded rows
+LEASE_SECONDS   = 3600   # how long an upload holds its entry against spool eviction
+UPLOAD_POLICY   = schedule.UPLOAD_POLICY   # fifo | shortest | newest
+
+# the recorder wakes us through queue_db.notify(); polling is only a safety net
+NOTIFY        = os.environ.get("PACKPROOF_NOTIFY", "1") != "0"
+FALLBACK_POLL = 60
+POLL_INTERVAL = 5        # used when NOTIFY is off
+
+# while connectivity.py says offline/captive AND the server itself could not
+# be connected to, hold new attempts (and their backoff) until either comes
+# back; one attempt per OFFLINE_RETRY still goes out to find out
+OFFLINE_RETRY = 300
+
+CONNECTION_SLOTS = threading.BoundedSemaphore(MAX_CONNECTIONS)
+SERVER = schedule.WarmState()
+
+class MultipartStream:
+    """
+    multipart/form-data body that reads file parts from disk in STREAM_BLOCK
+    pieces while it is being sent. requests takes the length from __len__
+    and iterates the object, so memory use does not grow with the file size.
+
+    fields: list of (name, value) for text fields or
+            (name, (filename, path, content_type)) for files.
+    """
+    def __init__(self, fields):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.parts = []
+        for name, value in fields:
+            if isinstance(value, tuple):
+                filename, path, ctype = value
+                head = (f'--{self.boundary}\r\n'
+                        f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                        f'Content-Type: {ctype}\r\n\r\n')
+                self.parts.append((head.encode(), path))
+            else:
+                head = (f'--{self.boundary}\r\n'
+                        f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}')
+                self.parts.append((head.encode(), None))
+        self.tail = f"--{self.boundary}--\r\n".encode()
+
+    def __len__(self):
+        total = len(self.tail)
+        for head, path in self.parts:
+            total += len(head) + 2
+            if path:
+                total += os.path.getsize(path)
+        return total
 
-def save_queue(data):
-    with open(LOG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    def __iter__(self):
+        for head, path in self.parts:
+            yield head
+            if path:
+                with open(path, "rb") as f:
+                    while True:
+                        block = f.read(STREAM_BLOCK)
+                        if not block:
+                            break
+                        yield block
+            yield b"\r\n"
+        yield self.tail
+
+_local = threading.local()
+
+def http(method, url, **kwargs):
+    """
+    requests.request, but waits for one of the MAX_CONNECTIONS slots first.
+    Each thread keeps its own Session so parts reuse their TCP/TLS connection.
+    """
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    try:
+        with CONNECTION_SLOTS:
+            r = _local.session.request(method, url, **kwargs)
+    except requests.ConnectionError as e:
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        if isinstance(e, requests.ConnectTimeout) or isinstance(reason, NewConnectionError):
+            SERVER.unreachable()     # no connection at all, not a dropped one
+        raise
+    SERVER.answered()
+    if r.status_code < 500:
+        SERVER.touch()
+    return r
+
+def post_multipart(url, fields, timeout, headers=None):
+    body = MultipartStream(fields)
+    headers = dict(headers or {}, **{"Content-Type": body.content_type})
+    return http("POST", url, data=body, headers=headers, timeout=timeout)
+
+def idempotency_headers(entry, key="content_hash"):
+    """The recording's content hash lets the server recognise a repeated upload."""
+    if entry.get(key):
+        return {"Idempotency-Key": entry[key]}
+    return {}
+
+def already_uploaded(entry):
+    """
+    Ask the server whether it already has this recording. Only done for
+    entries that were attempted before (e.g. power lost after a successful
+    POST but before it was marked uploaded); any error means "don't know".
+    """
+    if not entry.get("content_hash") or not entry.get("last_attempt_at"):
+        return False
+    try:
+        r = http("GET", EXISTS_URL, params={"key": entry["content_hash"], "name": entry["id"]},
+                 timeout=PART_TIMEOUT)
+        return r.status_code == 200 and r.json().get("exists") is True
+    except Exception:
+        return False
 
 def wake_up_server():
     try:
         print("âš¡ Waking server...")
-        requests.get(WAKE_URL, timeout=WAKEUP_TIMEOUT)
+        http("GET", WAKE_URL, timeout=WAKEUP_TIMEOUT)
         print("âœ… Server awake")
     except:
         print("âš  Server wake-up slow, continuing...")
 
+def save_progress(entry):
+    """Persist the resume state of one pending entry."""
+    queue_db.update(entry["id"], upload_id=entry.get("upload_id"), offset=entry.get("offset", 0))
+
+
+def open_session(entry, size):
+    """
+    Return (upload_id, state) for entry, reusing a persisted session if the
+    server still has it. state holds "offset" (contiguous bytes received) and
+    "ranges" ([start, end) spans received).
+    """
+    upload_id = entry.get("upload_id")
+    if upload_id:
+        r = http("GET", f"{RESUME_URL}/{upload_id}", timeout=PART_TIMEOUT)
+        if r.status_code == 200:
+            return upload_id, r.json()
+        print(f"[upload] Session {upload_id} gone ({r.status_code}), starting over")
+
+    r = http("POST", RESUME_URL, json={"name": entry["id"], "size": size},
+             headers=idempotency_headers(entry), timeout=PART_TIMEOUT)
+    r.raise_for_status()
+    # with an Idempotency-Key the server may hand back an unfinished session for the same recording
+    state = r.json()
+    return state["upload_id"], {"offset": state.get("offset", 0), "ranges": state.get("ranges", [])}
+
+def missing_parts(state, size):
+    """Offsets of the CHUNK_SIZE parts the server does not fully have yet."""
+    ranges = state.get("ranges") or [[0, state.get("offset", 0)]]
+    todo = []
+    for start in range(0, size, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, size)
+        if not any(a <= start and end <= b for a, b in ranges):
+            todo.append(start)
+    return todo
+
+def send_part(upload_id, video, offset, size):
+    """PUT the CHUNK_SIZE part at offset; returns the server's session state after it."""
+    with open(video, "rb") as f:
+        f.seek(offset)
+        data = f.read(CHUNK_SIZE)
+    end = offset + len(data) - 1
+    headers = {
+        "Content-Range": f"bytes {offset}-{end}/{size}",
+        "X-Part-Sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+    for attempt in range(PART_RETRIES):
+        try:
+            r = http("PUT", f"{RESUME_URL}/{upload_id}", data=data, headers=headers,
+                     timeout=PART_TIMEOUT)
+            if r.status_code in [200, 201]:
+                return r.json()
+            print(f"[upload] Part {offset} got {r.status_code}")
+        except requests.exceptions.RequestException as e:
+            print(f"[upload] Part {offset} failed: {e}")
+        time.sleep(min(2 ** attempt, 30))
+
+    raise IOError(f"part at {offset} failed {PART_RETRIES} times")
+
+def send_parts(entry, upload_id, video, size, parts):
+    """Send parts sequentially, or over PARALLEL_STREAMS connections for big files."""
+    streams = PARALLEL_STREAMS if size >= PARALLEL_MIN_SIZE else 1
+
+    def one(offset):
+        state = send_part(upload_id, video, offset, size)
+        entry["offset"] = max(entry.get("offset", 0), state["offset"])
+        save_progress(entry)
+
+    if streams <= 1 or len(parts) <= 1:
+        for offset in parts:
+            one(offset)
+        return
+
+    print(f"[upload] {entry['id']}: {len(parts)} parts over {streams} streams")
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        for fut in [pool.submit(one, offset) for offset in parts]:
+            fut.result()   # re-raises the first failed part
+
+def upload_entry_chunked(entry, image):
+    invoice_id = entry["id"]
+    video = f"{VIDEO_PATH}/{invoice_id}.mp4"
+    size = os.path.getsize(video)
+
+    upload_id, state = open_session(entry, size)
+    if upload_id != entry.get("upload_id") or state["offset"] != entry.get("offset", 0):
+        entry["upload_id"], entry["offset"] = upload_id, state["offset"]
+        save_progress(entry)
+
+    parts = missing_parts(state, size)
+    if state["offset"] or state.get("ranges"):
+        print(f"[upload] Resuming {invoice_id}: {len(parts)} parts left")
+    send_parts(entry, upload_id, video, size, parts)
+
+    digest = file_sha256(video)
+    fields = [("name", invoice_id), ("sha256", digest)]
+    if os.path.exists(image):
+        fields.append(("imageFile", ("image.jpg", image, "image/jpeg")))
+    response = post_multipart(f"{RESUME_URL}/{upload_id}/complete", fields, UPLOAD_TIMEOUT)
+
+    print("âœ… Status:", response.status_code)
+    print("âœ… Response:", response.text)
+
+    if response.status_code == 422:
+        # server's reassembled file does not hash to ours; it dropped the session
+        entry["upload_id"], entry["offset"] = None, 0
+        save_progress(entry)
+        return False
+    if response.status_code not in [200, 201]:
+        return False
+    if response.json().get("sha256", digest) != digest:
+        print(f"âŒ Server hash mismatch for {invoice_id}")
+        return False
+    return True
+
+def upload_proxy(entry):
+    """Send the low-bitrate proxy so staff can watch the packing before the full video arrives."""
+    invoice_id = entry["id"]
+    proxy = f"{VIDEO_PATH}/{invoice_id}.proxy.mp4"
+    print(f"ðŸ“¤ Uploading proxy {invoice_id} ...")
+    try:
+        fields = [
+            ("name", invoice_id),
+            ("variant", "proxy"),
+            ("videoFile", ("video.mp4", proxy, "video/mp4")),
+        ]
+        response = post_multipart(API_URL, fields, UPLOAD_TIMEOUT,
+                                  idempotency_headers(entry, "proxy_hash"))
+        print("âœ… Status:", response.status_code)
+        return response.status_code in [200, 201]
+    except Exception as e:
+        print("âŒ Proxy upload error:", e)
+        return False
+
+def send_segment(order_id, index, sha256):
+    path = f"{spool.segment_dir(order_id)}/{index:05d}.ts"
+    fields = [
+        ("name", order_id),
+        ("index", str(index)),
+        ("sha256", sha256 or ""),
+        ("segment", (f"{index:05d}.ts", path, "video/mp2t")),
+    ]
+    r = post_multipart(SEGMENTS_URL, fields, UPLOAD_TIMEOUT)
+    return r.status_code in [200, 201]
+
+def upload_segment(entry):
+    """One finished segment of a recording that may still be going on."""
+    order_id, index = entry["parent"], entry["seg_index"]
+    path = f"{spool.segment_dir(order_id)}/{index:05d}.ts"
+    if not os.path.exists(path):
+        print(f"âš  Segment {index} of {order_id} missing")
+        lifecycle.event(order_id, "upload_skipped", reason="missing", index=index)
+        return None
+    t0 = time.time()
+    try:
+        ok = send_segment(order_id, index, entry["content_hash"])
+    except Exception as e:
+        print(f"âŒ Segment {index} of {order_id}: {e}")
+        ok = False
+    trace_attempt(entry, "segment", entry["size"] or 0, time.time() - t0, ok)
+    if ok:
+        count_upload(entry["size"] or 0, time.time() - t0)
+        queue_db.mark_uploaded(entry["id"])   # files go with the order's entry
+    return ok
+
+def complete_segments(entry):
+    """
+    Send the manifest of a segmented recording; the server joins the segments.
+    A 409 lists segments the server does not have; they are sent again once.
+    """
+    invoice_id = entry["id"]
+    manifest = f"{spool.segment_dir(invoice_id)}/{segments.MANIFEST_FILE}"
+    image = f"{IMAGE_PATH}/{invoice_id}.jpg"
+    if not os.path.exists(manifest):
+        print(f"âš  Manifest missing for {invoice_id}")
+        return None
+    try:
+        if already_uploaded(entry):
+            print(f"[upload] Server already has {invoice_id}, skipping")
+            lifecycle.event(invoice_id, "upload_skipped", reason="on server")
+            return True
+        with open(manifest) as f:
+            fields = [("name", invoice_id), ("manifest", f.read())]
+        if os.path.exists(image):
+            fields.append(("imageFile", ("image.jpg", image, "image/jpeg")))
+        for _ in range(2):
+            r = post_multipart(f"{SEGMENTS_URL}/complete", fields, UPLOAD_TIMEOUT,
+                               idempotency_headers(entry))
+            if r.status_code != 409:
+                break
+            by_index = {s["index"]: s for s in json.loads(fields[1][1])["segments"]}
+            for index in r.json().get("missing", []):
+                if not send_segment(invoice_id, index, by_index.get(index, {}).get("sha256")):
+                    return False
+        print(f"âœ… Segments of {invoice_id} joined:", r.status_code)
+        return r.status_code in [200, 201]
+    except Exception as e:
+        print("âŒ Manifest upload error:", e)
+        return False
+
 def upload_entry(entry):
     invoice_id = entry["id"]
 
@@ -41,26 +376,26 @@ def upload_entry(entry):
         print(f"âš  Video file missing for {invoice_id}, retry later")
         return False
 
-    print(f"ðŸ“¤ Uploading {invoice_id} ...")
-
     try:
-        files = {
-            "name": (None, invoice_id),
-            "videoFile": ("video.mp4", open(video, "rb"), "video/mp4"),
-        }
-        if os.path.exists(image):
-            files["imageFile"] = ("image.jpg", open(image, "rb"), "image/jpeg")
+        if already_uploaded(entry):
+            print(f"[upload] Server already has {invoice_id}, skipping")
+            lifecycle.event(invoice_id, "upload_skipped", reason="on server")
+            return True
+
+        print(f"ðŸ“¤ Uploading {invoice_id} ...")
 
-        response = requests.post(
-            API_URL,
-            files=files,
-            timeout=UPLOAD_TIMEOUT
-        )
+        if UPLOAD_MODE == "chunked":
+            return upload_entry_chunked(entry, image)
+
+        fields = [
+            ("name", invoice_id),
+            ("videoFile", ("video.mp4", video, "video/mp4")),
+        ]
+        if os.path.exists(image):
+            fields.append(("imageFile", ("image.jpg", image, "image/jpeg")))
 
-        # Close file handles (avoid resource warning if only video)
-        for v in files.values():
-            if hasattr(v[1], 'close'):
-                v[1].close()
+        # streamed from disk; never holds the whole video in RAM
+        response = post_multipart(API_URL, fields, UPLOAD_TIMEOUT, idempotency_headers(entry))
 
         print("âœ… Status:", response.status_code)
         print("âœ… Response:", response.text)
@@ -79,46 +414,202 @@ def upload_entry(entry):
         print("âŒ Upload error:", e)
         return False
 
-def main():
-    while True:
-        queue = load_queue()
+def finish_entry(entry, ok):
+    """Record the result of one upload. Runs on the worker thread that did it."""
+    if not ok:
+        return   # stays pending for retry
 
-        if not queue["pending"]:
-            print("â¸ No pending uploads. Waiting...")
-            time.sleep(5)
-            continue
+    if not queue_db.mark_uploaded(entry["id"], kept=spool.KEEP_UPLOADED):
+        return   # already marked by someone else; files are theirs to delete
+    lifecycle.event(entry["id"], "uploaded")
 
-        wake_up_server()
+    if spool.KEEP_UPLOADED:
+        return   # retained until spool.evict() needs the space
 
-        new_pending = []
+    # âœ… DELETE FILES
+    try:
+        freed = spool.remove_files(entry["id"])
+        lifecycle.event(entry["id"], "deleted", reason="uploaded", bytes=freed)
+        print(f"ðŸ—‘ï¸ Deleted files for {entry['id']}")
+    except Exception as e:
+        print(f"âš ï¸ Error deleting files for {entry['id']}: {e}")
 
-        for entry in queue["pending"]:
-            if upload_entry(entry):
-                # âœ… Move to uploaded list
-                queue["uploaded"].append(entry)
+def run_entry(entry):
+    """Returns True, False, or None when the server was never asked (missing/damaged/busy file)."""
+    if not queue_db.claim(entry["id"], LEASE_SECONDS, "uploader"):
+        return None   # spool is re-encoding it
+    try:
+        # re-read: the entry may have changed (e.g. downscaled) since it was listed
+        entry = queue_db.get(entry["id"]) or entry
+        if entry["kind"] == "segment":
+            return upload_segment(entry)
 
-                # âœ… DELETE FILES
-                video = f"{VIDEO_PATH}/{entry['id']}.mp4"
-                image = f"{IMAGE_PATH}/{entry['id']}.jpg"
+        video = f"{VIDEO_PATH}/{entry['id']}.mp4"
+        if entry["kind"] == "segmented":
+            pass   # no single file; complete_segments() checks the manifest
+        elif not os.path.exists(video):
+            upload_entry(entry)   # logs the missing file
+            lifecycle.event(entry["id"], "upload_skipped", reason="missing")
+            return None
+        elif entry.get("size") and os.path.getsize(video) != entry["size"]:
+            print(f"âš  {entry['id']}: video is {os.path.getsize(video)} bytes, "
+                  f"recorded as {entry['size']}; not uploading a damaged file")
+            lifecycle.event(entry["id"], "upload_skipped", reason="damaged")
+            return None
+        queue_db.update(entry["id"], last_attempt_at=time.time())
 
-                try:
-                    if os.path.exists(video):
-                        os.remove(video)
-                    if os.path.exists(image):
-                        os.remove(image)
-                    print(f"ðŸ—‘ï¸ Deleted files for {entry['id']}")
-                except Exception as e:
-                    print(f"âš ï¸ Error deleting files for {entry['id']}: {e}")
+        # proxy first; the entry stays pending and comes back for the full video
+        proxy = f"{VIDEO_PATH}/{entry['id']}.proxy.mp4"
+        t0 = time.time()
+        if entry.get("proxy_state") == "pending" and os.path.exists(proxy):
+            ok = upload_proxy(entry)
+            trace_attempt(entry, "proxy", os.path.getsize(proxy), time.time() - t0, ok)
+            if ok:
+                queue_db.update(entry["id"], proxy_state="uploaded")
+                count_upload(os.path.getsize(proxy), time.time() - t0)
+            return ok
 
-            else:
-                # keep pending for retry
-                new_pending.append(entry)
+        if entry["kind"] == "segmented":
+            ok = complete_segments(entry)
+            trace_attempt(entry, "manifest", 0, time.time() - t0, ok)
+            finish_entry(entry, ok)
+            return ok
+
+        ok = upload_entry(entry)
+        trace_attempt(entry, "video", os.path.getsize(video), time.time() - t0, ok)
+        if ok:
+            count_upload(os.path.getsize(video), time.time() - t0)
+        finish_entry(entry, ok)
+        return ok
+    finally:
+        queue_db.release(entry["id"])
+
+def trace_attempt(entry, kind, size, seconds, ok):
+    extra = {"index": entry["seg_index"]} if entry.get("parent") else {}
+    lifecycle.event(entry.get("parent") or entry["id"], "upload_attempt", kind=kind, bytes=size,
+                    seconds=round(seconds, 3), ok=bool(ok), attempt=entry["attempts"] + 1, **extra)
+
+def count_upload(size, seconds):
+    metrics.inc("packproof_upload_bytes_total", size)
+    metrics.inc("packproof_upload_seconds_total", round(seconds, 3))
+    metrics.gauge("packproof_upload_throughput_bytes", round(size / max(seconds, 1e-3)))
+    metrics.gauge("packproof_last_upload_timestamp_seconds", round(time.time(), 3))
+    quality.record_throughput(size, seconds)      # input to the recorder's quality choice
+
+@metrics.collector
+def shared_state():
+    """Queue depth and spool usage from the database and one statvfs."""
+    pending, pending_bytes = queue_db.pending_stats()
+    used = spool.used_bytes()
+    return {"packproof_queue_pending": pending, "packproof_queue_pending_bytes": pending_bytes,
+            "packproof_spool_used_bytes": used, "packproof_spool_limit_bytes": spool.limit(used)}
+
+_waking = threading.Lock()
+
+def wake_in_background():
+    """Send the wake-up GET alongside the first upload instead of before it."""
+    if SERVER.is_warm() or not _waking.acquire(blocking=False):
+        return
+    def worker():
+        try:
+            wake_up_server()
+        finally:
+            _waking.release()
+    threading.Thread(target=worker, daemon=True).start()
+
+def wait_for_work(listener, futures, timeout):
+    """Block until the recorder queues something, an upload finishes, or timeout passes."""
+    if listener:
+        queue_db.wait(listener, timeout)
+    elif futures:
+        wait(futures, timeout=min(timeout, POLL_INTERVAL), return_when=FIRST_COMPLETED)
+    else:
+        time.sleep(min(timeout, POLL_INTERVAL))
+
+def main():
+    pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    listener = queue_db.listen() if NOTIFY else None
+    breaker = schedule.CircuitBreaker()
+    net = connectivity.Monitor(
+        on_change=lambda state: queue_db.notify("online") if state == connectivity.ONLINE else None).start()
+    metrics.collector(lambda: {"packproof_breaker_open": int(breaker.state == "open")})
+    metrics.start("uploader", serve=True)
+    queue_db.release_owned("uploader")
+    schedule.order_by(UPLOAD_POLICY)   # fail at startup on an unknown policy
+    print(f"[upload] {UPLOAD_WORKERS} workers, {UPLOAD_POLICY} order")
+    in_flight = {}     # invoice id -> (entry, future); an id is never submitted twice
+    next_compact = 0
+    offline_try_at = 0   # next attempt allowed while offline
+
+    while True:
+        for invoice_id, (entry, fut) in list(in_flight.items()):
+            if not fut.done():
+                continue
+            del in_flight[invoice_id]
+            exc = fut.exception()
+            if exc:
+                print(f"[upload] {invoice_id} raised {exc!r}")
+                traceback.print_exception(exc)
+            result = False if exc else fut.result()
+            breaker.record(result)
+            metrics.inc("packproof_uploads_total",
+                        result="ok" if result else "skipped" if result is None else "failed")
+            if not result:
+                attempts = entry["attempts"] + 1
+                delay = schedule.backoff_delay(attempts)
+                queue_db.record_failure(invoice_id, attempts, time.time() + delay,
+                                        "missing video" if result is None else "upload failed")
+                print(f"[upload] {invoice_id} failed {attempts}x, next try in {delay:.0f}s")
+
+        now = time.time()
+        if now >= next_compact:
+            queue_db.compact()
+            next_compact = now + COMPACT_EVERY
+
+        next_due = queue_db.next_due()
+        if next_due is None and not in_flight:
+            print("â¸ No pending uploads. Waiting...")
+            wait_for_work(listener, in_flight, FALLBACK_POLL)
+            continue
+
+        # the probe host may be blocked while the server works: hold only if both say down
+        unreachable = not net.online() and not SERVER.reachable()
+        held = unreachable and now < offline_try_at
+        free = 0 if held else breaker.slots(UPLOAD_WORKERS - len(in_flight))
+        ready = []
+        if free:
+            order = schedule.order_by(UPLOAD_POLICY, now)
+            ready = [e for e in queue_db.due(now, limit=free + len(in_flight), order_by=order)
+                     if e["id"] not in in_flight][:free]
+        if ready and unreachable:
+            ready = ready[:1]
+            offline_try_at = now + OFFLINE_RETRY
+            print(f"[upload] {net.state}, server unreachable: trying {ready[0]['id']}, "
+                  f"then holding for {OFFLINE_RETRY}s")
+        if ready:
+            wake_in_background()
 
-        queue["pending"] = new_pending
-        save_queue(queue)
+        for entry in ready:
+            if entry["attempts"] == 0 and entry.get("created_at"):
+                print(f"[upload] {entry['id']} started {time.time() - entry['created_at']:.3f}s after queueing")
+            breaker.begin_probe()
+            fut = pool.submit(run_entry, entry)
+            if listener:
+                fut.add_done_callback(lambda f: queue_db.notify("done"))
+            in_flight[entry["id"]] = (entry, fut)
 
-        print("â¸ Waiting...\n")
-        time.sleep(5)
+        # sleep until something changes, the next backed-off entry is due or the breaker half-opens;
+        # while the half-open probe runs, only its result can change anything
+        timeout = FALLBACK_POLL
+        next_due = queue_db.next_due(exclude=in_flight)
+        can_start = breaker.slots(1) or breaker.retry_in()
+        if held:
+            timeout = min(timeout, max(offline_try_at - time.time(), 0.05))
+        elif next_due is not None and len(in_flight) < UPLOAD_WORKERS and can_start:
+            timeout = min(timeout, max(breaker.retry_in(), next_due - time.time(), 0.05))
+        if not in_flight:
+            print("â¸ Waiting...\n")
+        wait_for_work(listener, [f for _, f in in_flight.values()], timeout)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,32 @@
+"""
+Small helpers shared by the recorder, the uploader, the stand-in server
+and the benches. Standard library only.
+"""
+import os
+import hashlib
+import threading
+
+HASH_BLOCK = 1024 * 1024     # read size for file_sha256
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file, read in HASH_BLOCK pieces."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def percentile(values, p):
+    """Nearest-rank p-th percentile (0-100) of a non-empty sequence."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def lower_thread_priority(nice):
+    """Renice the calling thread only (Linux); a no-op where that is not possible."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass